@@ -1,25 +1,34 @@
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, session
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
-import chromadb
-import bcrypt
 import uuid
+import json
+import time
+import threading
+from datetime import datetime, timezone
 
 # Modules
-from ingestion.docEmbed import process_and_embed_document
-from ingestion.imageEmbed import process_and_embed_image
-from rag_core.retrieval import get_rag_answer
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from firebaseconfig import db, user_collection
+from ingestion.jobQueue import IngestionJobQueue, QueueFullError, IMAGE_EXTENSIONS, DOC_EXTENSIONS, ingest_message
+from ingestion.visionCache import VisionCache
+from ingestion.uploads import UploadedFile
+from ingestion.chunkedUploads import ChunkedUploadStore, UploadError
+from ingestion.manifest import SourceManifestStore
+from rag_core.engine import RetrievalEngine
+from rag_core.retrieval import QueryCache
+from rag_core.embedding_cache import EmbeddingCache, CachedEmbeddings
+from rag_core.rate_limiter import BatchedEmbeddings, get_rate_limiter
+from rag_core.metrics import get_metrics, span, SamplingProfiler
+from rag_core.lazy import LazyObject, preload
+from rag_core.conversation import ConversationStore, UnknownConversationError, ConversationBusyError
+from user_store import UserStore, AuthBusyError, make_user_backend
 
 
 app = Flask(__name__)
 CORS(app,
      supports_credentials=True,
      origins=["http://localhost:5173"],
-     allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
+     allow_headers=["Content-Type", "Authorization", "X-Requested-With", "X-Part-SHA256"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
      expose_headers=["Content-Type"])
 
@@ -28,42 +37,268 @@ from dotenv import load_dotenv
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Sessions carry the user id that selects the user's collection
+app.secret_key = os.getenv("FLASK_SECRET_KEY")
+if not app.secret_key:
+    print("Warning : FLASK_SECRET_KEY is not set. Using a random key, sessions will not survive a restart.")
+    app.secret_key = os.urandom(32)
+
 
 if not GOOGLE_API_KEY:
     print("Error : GOOGLE_API_KEY environment variable not set. Please set it.")
 
+# The Gemini SDK, ChromaDB and Firestore are imported and their clients built on first use,
+# so the app starts serving before any of them is loaded
+
+def _make_gemini_model():
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel('gemini-2.5-flash')
+
+
+def _make_embedding_client():
+    import google.generativeai as genai
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=GOOGLE_API_KEY)
+
+
+# Chroma by default; VECTOR_STORE_BACKEND=numpy selects the quantized NumPy store (see rag_core.vector_store)
+
+def _make_chroma_client():
+    from rag_core.vector_store import vector_client_from_env
+    return vector_client_from_env()
+
+
+def _load_user_collection():
+    from firebaseconfig import user_collection
+    return user_collection
+
+
+EMBEDDING_MODEL_NAME = "models/embedding-001"
+
 # Initialize Gemini Models & ChromaDB
 try:
-    genai.configure(api_key=GOOGLE_API_KEY)
-    
-    
-    embedding_model = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=GOOGLE_API_KEY)
-    vision_model = genai.GenerativeModel('gemini-2.5-flash')
-    text_generation_model = genai.GenerativeModel('gemini-2.5-flash')
+    # One limiter paces every Gemini call made by this process
+    rate_limiter = get_rate_limiter()
+
+    # Embeddings go through a persistent cache so unchanged chunks and repeated queries are not re-embedded.
+    # Cache misses from concurrent ingests are grouped into maximum-size batch requests.
+    embedding_cache = EmbeddingCache(
+        path=os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3"),
+        max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB", "256")) * 1024 * 1024
+    )
+    batched_embeddings = BatchedEmbeddings(
+        LazyObject(_make_embedding_client, "Gemini embedding client"),
+        limiter=rate_limiter,
+        max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
+        max_concurrency=int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+    )
+    embedding_model = CachedEmbeddings(batched_embeddings, cache=embedding_cache, model_name=EMBEDDING_MODEL_NAME)
+    vision_model = LazyObject(_make_gemini_model, "Gemini vision model")
+
+    # Vision results keyed by a perceptual hash, so re-uploaded images and near-duplicate photographs skip Gemini
+    vision_cache = VisionCache(
+        path=os.getenv("VISION_CACHE_PATH", "./vision_cache.sqlite3"),
+        max_distance=int(os.getenv("VISION_CACHE_MAX_DISTANCE", "8"))
+    )
+    text_generation_model = LazyObject(_make_gemini_model, "Gemini text model")
     
-    # ChromaDB Client
-    chroma_client = chromadb.PersistentClient(path="./chroma_db_mvp")
+    # Vector store client (ChromaDB unless VECTOR_STORE_BACKEND says otherwise)
+    chroma_client = LazyObject(_make_chroma_client, "vector store client")
+
+    # Firestore collection of user credentials
+    user_collection = LazyObject(_load_user_collection, "Firestore user collection")
+
+    # Cached user lookups and a bounded bcrypt pool for /login and /register.
+    # USER_STORE_BACKEND=memory swaps Firestore for an in-memory stand-in.
+    user_store = UserStore(
+        make_user_backend(os.getenv("USER_STORE_BACKEND", "firestore"), user_collection),
+        ttl=float(os.getenv("USER_CACHE_TTL_SECONDS", "300")),
+        negative_ttl=float(os.getenv("USER_CACHE_NEGATIVE_TTL_SECONDS", "30")),
+        max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000")),
+        hash_workers=int(os.getenv("BCRYPT_WORKERS", "0")) or None,
+        max_pending_hashes=int(os.getenv("BCRYPT_MAX_PENDING", "0")) or None,
+        bcrypt_rounds=int(os.getenv("BCRYPT_ROUNDS", "12"))
+    )
     
     # Collection Name
     HARDCODED_COLLECTION_NAME = "default_brain"
+
+    # Long-lived engine that keeps collection handles, retrievers and model clients between requests
+    engine = RetrievalEngine(
+        chroma_client=chroma_client,
+        embedding_model=embedding_model,
+        text_generation_model=text_generation_model,
+        vision_model=vision_model,
+        default_collection=HARDCODED_COLLECTION_NAME,
+        query_cache=QueryCache(
+            max_embeddings=int(os.getenv("QUERY_CACHE_MAX_EMBEDDINGS", "1024")),
+            max_answers=int(os.getenv("QUERY_CACHE_MAX_ANSWERS", "512")),
+            similarity_threshold=float(os.getenv("QUERY_CACHE_SIMILARITY", "0.95")),
+            answer_ttl=float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+        ),
+        vision_cache=vision_cache,
+        # Re-uploads only embed the chunks that changed and delete the ones that are gone
+        manifest_store=SourceManifestStore(os.getenv("SOURCE_MANIFEST_PATH", "./source_manifests.sqlite3")),
+        # One collection per user; open handles are kept in a bounded LRU
+        max_open_collections=int(os.getenv("MAX_OPEN_COLLECTIONS", "64")),
+        idle_timeout=float(os.getenv("COLLECTION_IDLE_SECONDS", "900")),
+        # Answers generated in parallel for one /api/query-batch request
+        batch_concurrency=int(os.getenv("BATCH_QUERY_CONCURRENCY", "4")),
+        # Multi-turn sessions with a rolling summary; token budgets come from CONVERSATION_* variables
+        conversations=ConversationStore(
+            text_generation_model,
+            max_conversations=int(os.getenv("MAX_CONVERSATIONS", "1000")),
+            idle_timeout=float(os.getenv("CONVERSATION_IDLE_SECONDS", "3600"))
+        )
+    )
     
     print("✅ Initialized Gemini Models and ChromaDB Client.")
 except Exception as e:
     print(f"❌ Error during initialization: {e}")
 
 
+# Modules that are otherwise imported by the first upload or query
+WARM_UP_MODULES = [
+    "PyPDF2",
+    "docx",
+    "PIL.Image",
+    "langchain.text_splitter",
+    "langchain_community.vectorstores",
+]
+
+
+# Builds the clients, imports the parsers and opens the default collection ahead of traffic.
+# Runs on a background thread so the server accepts requests while it happens.
+
+def warm_up():
+    try:
+        objects = {
+            "chroma_client": chroma_client,
+            "text_generation_model": text_generation_model,
+            "vision_model": vision_model,
+        }
+        # The in-memory user backend never touches Firestore
+        if os.getenv("USER_STORE_BACKEND", "firestore") == "firestore":
+            objects["user_collection"] = user_collection
+
+        timings = preload(objects=objects, modules=WARM_UP_MODULES)
+        print(f" - Preloaded clients and modules: {timings}")
+        engine.warm_up(embed=os.getenv("GLIMPSE_WARM_UP_EMBED", "0") == "1")
+    except Exception as e:
+        print(f"❌ Error during warm-up: {e}")
+
+
+if os.getenv("GLIMPSE_WARM_UP", "1") == "1":
+    threading.Thread(target=warm_up, name="glimpse-warm-up", daemon=True).start()
+
+
+# Caches and the rate limiter keep their own counters; export them on /api/metrics as they are
+def _component_metric_samples():
+    limiter = rate_limiter.stats()
+    batches = batched_embeddings.stats()
+    embeddings = embedding_cache.stats()
+    queries = engine.query_cache.stats()
+    visions = vision_cache.stats()
+    users = user_store.stats()
+    uploads = chunked_uploads.stats()
+    conversations = engine.conversations.stats()
+    return [
+        ("glimpse_gemini_rate_per_second", "gauge", "Current request rate allowed by the adaptive limiter.", None, limiter["rate_per_second"]),
+        ("glimpse_embedding_batches_total", "counter", "Embedding batch requests sent to Gemini.", None, batches["batches"]),
+        ("glimpse_embedding_batch_texts_total", "counter", "Texts embedded through batch requests.", None, batches["texts"]),
+        ("glimpse_cache_hits_total", "counter", "Cache hits by cache.", {"cache": "embedding"}, embeddings["hits"]),
+        ("glimpse_cache_misses_total", "counter", "Cache misses by cache.", {"cache": "embedding"}, embeddings["misses"]),
+        ("glimpse_cache_hits_total", "counter", None, {"cache": "query_embedding"}, queries["embedding_hits"]),
+        ("glimpse_cache_misses_total", "counter", None, {"cache": "query_embedding"}, queries["embedding_misses"]),
+        ("glimpse_cache_hits_total", "counter", None, {"cache": "answer"}, queries["answer_hits"]),
+        ("glimpse_cache_misses_total", "counter", None, {"cache": "answer"}, queries["answer_misses"]),
+        ("glimpse_cache_hits_total", "counter", None, {"cache": "vision"}, visions["hits"]),
+        ("glimpse_cache_hits_total", "counter", None, {"cache": "vision_near_duplicate"}, visions["near_hits"]),
+        ("glimpse_cache_misses_total", "counter", None, {"cache": "vision"}, visions["misses"]),
+        ("glimpse_cache_hits_total", "counter", None, {"cache": "user"}, users["hits"]),
+        ("glimpse_cache_hits_total", "counter", None, {"cache": "user_negative"}, users["negative_hits"]),
+        ("glimpse_cache_misses_total", "counter", None, {"cache": "user"}, users["misses"]),
+        ("glimpse_bcrypt_operations_total", "counter", "Password hashes and checks run on the bcrypt pool.", None, users["hashes"]),
+        ("glimpse_bcrypt_rejected_total", "counter", "Password hashes and checks refused because the bcrypt queue was full.", None, users["rejected_hashes"]),
+        ("glimpse_upload_parts_total", "counter", "Parts received by chunked uploads.", None, uploads["parts_received"]),
+        ("glimpse_upload_bytes_total", "counter", "Bytes received by chunked uploads.", None, uploads["bytes_received"]),
+        ("glimpse_uploads_active", "gauge", "Chunked uploads started and not yet completed.", None, uploads["active_uploads"]),
+        ("glimpse_conversations_active", "gauge", "Conversations kept in memory.", None, conversations["conversations"]),
+        ("glimpse_conversation_turns_total", "counter", "Questions answered as turns of a conversation.", None, conversations["turns"]),
+        ("glimpse_conversation_rewrites_total", "counter", "Follow-up questions rewritten before retrieval.", None, conversations["rewrites"]),
+        ("glimpse_conversation_summary_folds_total", "counter", "Turns folded into a conversation summary.", None, conversations["summary_folds"]),
+        ("glimpse_cache_evictions_total", "counter", "Entries evicted from the embedding cache.", {"cache": "embedding"}, embeddings["evictions"]),
+        ("glimpse_cache_invalidations_total", "counter", "Collections whose cached answers were dropped after an ingest.", {"cache": "answer"}, queries["invalidations"]),
+    ]
+
+
+metrics = get_metrics()
+metrics.register_collector(_component_metric_samples)
+metrics.describe("glimpse_http_request_duration_seconds", "Time to produce a response, per endpoint and status.")
+
+# Sampling profiler, off by default. Folded stacks are served on /api/profile.
+profiler = None
+if os.getenv("GLIMPSE_PROFILE", "0") == "1":
+    profiler = SamplingProfiler(interval=float(os.getenv("GLIMPSE_PROFILE_INTERVAL_MS", "10")) / 1000)
+    profiler.start()
+
+
+# Background ingestion for batch uploads
+ingestion_queue = IngestionJobQueue(
+    engine=engine,
+    upload_root="./temp_uploads",
+    max_io_workers=int(os.getenv("INGEST_IO_WORKERS", "4")),
+    max_pending_files=int(os.getenv("INGEST_MAX_PENDING_FILES", "500"))
+)
+
+# Chunked, resumable uploads; unfinished ones survive a restart under this folder
+chunked_uploads = ChunkedUploadStore(root="./temp_uploads/chunked")
+
+
 
 # Testing route : A simple route to check if the backend is running
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Streamed responses are timed until the first byte is ready, not until the stream ends
+        metrics.observe(
+            "glimpse_http_request_duration_seconds",
+            time.perf_counter() - started,
+            endpoint=request.endpoint or "unknown",
+            status=response.status_code
+        )
+    return response
+
+
+def _request_collection() -> str:
+    """The collection of the logged-in user; anonymous requests use the default collection."""
+    return engine.collection_for_user(session.get("user_id"))
+
+
 @app.route('/api/test', methods=['GET'])
 def test_route():
     """A simple route to check if the server is running."""
     return jsonify({"message": "Glimpse backend is up and running!"})
 
 
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Reports whether the vector store and model clients are usable."""
+    health = engine.health()
+    return jsonify(health), 200 if health["status"] == "ok" else 503
+
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Handles single or multiple file uploads, processes them, and stores them in the default brain."""
-    import time
+    """Processes a single uploaded file and stores it in the requesting user's collection."""
     
     if 'file' not in request.files:
         return jsonify({"error": "No file part in the request"}), 400
@@ -74,70 +309,40 @@ def upload_file():
 
     # --- The "Traffic Cop" logic ---
     filename = secure_filename(file.filename)
-    # Create a temporary folder for uploads if it doesn't exist
-    os.makedirs("./temp_uploads", exist_ok=True)
-    temp_path = os.path.join("./temp_uploads", filename)
-    file.save(temp_path)
-    
     file_ext = os.path.splitext(filename)[1].lower()
-    image_extensions = ['.png', '.jpg', '.jpeg']
-    doc_extensions = ['.pdf', '.docx', '.txt']
     success = False
     error_message = None
+
+    if file_ext not in IMAGE_EXTENSIONS and file_ext not in DOC_EXTENSIONS:
+        error_message = f"Unsupported file type: {file_ext}"
+        return jsonify({"error": error_message}), 400
+
+    collection_name = _request_collection()
+
+    # Small uploads are parsed straight from memory; large ones are spooled to a uniquely named temp file
+    with span("upload_save"):
+        upload = UploadedFile.from_storage(file, filename, spool_dir="./temp_uploads")
     
     try:
-        if file_ext in image_extensions:
+        if file_ext in IMAGE_EXTENSIONS:
             # Delegate to the image processing module
-            success = process_and_embed_image(
-                file_path=temp_path,
-                collection_name=HARDCODED_COLLECTION_NAME,
-                chroma_client=chroma_client,
-                embedding_model=embedding_model,
-                vision_model=vision_model
-            )
-        elif file_ext in doc_extensions:
-            # Delegate to the document processing module
-            success = process_and_embed_document(
-                file_path=temp_path,
-                collection_name=HARDCODED_COLLECTION_NAME,
-                chroma_client=chroma_client,
-                embedding_model=embedding_model
-            )
+            success = engine.ingest_image(upload.open_source(), collection_name=collection_name, file_name=filename)
         else:
-            error_message = f"Unsupported file type: {file_ext}"
-            return jsonify({"error": error_message}), 400
+            # Delegate to the document processing module
+            success = engine.ingest_document(upload.open_source(), collection_name=collection_name, file_name=filename)
     except Exception as e:
         print(f"❌ Error processing {filename}: {str(e)}")
         error_message = str(e)
         success = False
     finally:
-        # Clean up the temporary file after processing
-        # Give a small delay to ensure all file handles are released (Windows issue)
-        time.sleep(0.2)
-        
-        max_attempts = 3
-        for attempt in range(max_attempts):
-            try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                    print(f" - Temporary file '{filename}' removed successfully.")
-                break
-            except PermissionError as pe:
-                if attempt < max_attempts - 1:
-                    print(f" - File locked, retrying deletion... (attempt {attempt + 1})")
-                    time.sleep(0.5)
-                else:
-                    print(f" - Warning: Could not delete temporary file '{temp_path}': {pe}")
-                    # Continue anyway - file will be cleaned up later
-            except Exception as e:
-                print(f" - Error deleting temporary file: {e}")
-                break
+        upload.close()
 
     if success:
         return jsonify({
-            "message": f"File '{filename}' processed successfully.",
+            "message": ingest_message(filename, success),
             "filename": filename,
-            "status": "success"
+            "status": "success",
+            "ingest_status": success
         }), 200
     else:
         return jsonify({
@@ -149,139 +354,388 @@ def upload_file():
 
 @app.route('/api/upload-batch', methods=['POST'])
 def upload_batch():
-    """Handles multiple file uploads in a single request."""
-    import time
+    """Accepts multiple files, queues them for background ingestion and returns a job id right away."""
     
     if 'files' not in request.files:
         return jsonify({"error": "No files part in the request"}), 400
     
-    files = request.files.getlist('files')
-    if not files or len(files) == 0:
+    files = [file for file in request.files.getlist('files') if file.filename != '']
+    if not files:
         return jsonify({"error": "No files selected"}), 400
-    
-    results = []
-    successful_uploads = 0
-    failed_uploads = 0
-    
-    # Create temporary folder for uploads if it doesn't exist
-    os.makedirs("./temp_uploads", exist_ok=True)
-    
-    image_extensions = ['.png', '.jpg', '.jpeg']
-    doc_extensions = ['.pdf', '.docx', '.txt']
-    
+
+    # Uploads are read into memory; the few that are spooled to disk go to this job's own folder
+    job_id, job_dir = ingestion_queue.new_job_dir()
+    saved_files = []
+
     for file in files:
-        if file.filename == '':
-            continue
-            
         filename = secure_filename(file.filename)
-        temp_path = os.path.join("./temp_uploads", filename)
         file_ext = os.path.splitext(filename)[1].lower()
-        
-        try:
-            file.save(temp_path)
-            success = False
-            
-            if file_ext in image_extensions:
-                # Process image
-                success = process_and_embed_image(
-                    file_path=temp_path,
-                    collection_name=HARDCODED_COLLECTION_NAME,
-                    chroma_client=chroma_client,
-                    embedding_model=embedding_model,
-                    vision_model=vision_model
-                )
-            elif file_ext in doc_extensions:
-                # Process document
-                success = process_and_embed_document(
-                    file_path=temp_path,
-                    collection_name=HARDCODED_COLLECTION_NAME,
-                    chroma_client=chroma_client,
-                    embedding_model=embedding_model
-                )
-            else:
-                results.append({
-                    "filename": filename,
-                    "status": "failed",
-                    "error": f"Unsupported file type: {file_ext}"
-                })
-                failed_uploads += 1
-                continue
-            
-            if success:
-                results.append({
-                    "filename": filename,
-                    "status": "success",
-                    "message": f"File '{filename}' processed successfully."
-                })
-                successful_uploads += 1
-            else:
-                results.append({
-                    "filename": filename,
-                    "status": "failed",
-                    "error": f"Failed to process '{filename}'"
-                })
-                failed_uploads += 1
-                
-        except Exception as e:
-            print(f"❌ Error processing {filename}: {str(e)}")
-            results.append({
-                "filename": filename,
-                "status": "failed",
-                "error": str(e)
-            })
-            failed_uploads += 1
-        finally:
-            # Clean up temporary file with retry logic for Windows file locks
-            time.sleep(0.2)
-            
-            max_attempts = 3
-            for attempt in range(max_attempts):
-                try:
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                        print(f" - Temporary file '{filename}' removed successfully.")
-                    break
-                except PermissionError as pe:
-                    if attempt < max_attempts - 1:
-                        print(f" - File locked, retrying deletion... (attempt {attempt + 1})\")")
-                        time.sleep(0.5)
-                    else:
-                        print(f" - Warning: Could not delete temporary file '{temp_path}': {pe}")
-                except Exception as e:
-                    print(f" - Error deleting temporary file: {e}")
-                    break
-    
+
+        if file_ext not in IMAGE_EXTENSIONS and file_ext not in DOC_EXTENSIONS:
+            # Rejected files are still reported in the job results
+            saved_files.append((filename, None))
+            continue
+
+        with span("upload_save"):
+            saved_files.append((filename, UploadedFile.from_storage(file, filename, spool_dir=job_dir)))
+
+    try:
+        job = ingestion_queue.submit(job_id, job_dir, saved_files, collection_name=_request_collection())
+    except QueueFullError as e:
+        ingestion_queue.discard_job(job_dir, saved_files)
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({
+        "message": f"Queued {job['total']} file(s) for processing.",
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}",
+        "total": job["total"],
+        "status": job["status"]
+    }), 202
+
+
+@app.route('/api/uploads', methods=['POST'])
+def start_chunked_upload():
+    """Starts a chunked upload, or returns the unfinished upload with the same fingerprint to resume it."""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get("filename") or "")
+    file_ext = os.path.splitext(filename)[1].lower()
+
+    if not filename:
+        return jsonify({"error": "Missing 'filename'"}), 400
+    if file_ext not in IMAGE_EXTENSIONS and file_ext not in DOC_EXTENSIONS:
+        return jsonify({"error": f"Unsupported file type: {file_ext}"}), 400
+
+    try:
+        upload = chunked_uploads.create(
+            filename,
+            int(data.get("size") or 0),
+            collection_name=_request_collection(),
+            part_size=data.get("part_size"),
+            fingerprint=data.get("fingerprint")
+        )
+    except (TypeError, ValueError):
+        return jsonify({"error": "'size' and 'part_size' must be integers"}), 400
+    except UploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status_code
+
+    return jsonify(upload), 201
+
+
+@app.route('/api/uploads/<upload_id>/parts/<int:index>', methods=['PUT'])
+def upload_part(upload_id, index):
+    """Stores one part of a chunked upload from the raw request body. Parts can be sent in parallel."""
+    try:
+        upload = chunked_uploads.write_part(
+            upload_id, index, request.stream,
+            collection_name=_request_collection(),
+            checksum=request.headers.get("X-Part-SHA256")
+        )
+    except UploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status_code
+    return jsonify(upload)
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_chunked_upload(upload_id):
+    """Returns the parts of a chunked upload received so far."""
+    try:
+        return jsonify(chunked_uploads.status(upload_id, collection_name=_request_collection()))
+    except UploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status_code
+
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Queues the assembled file of a finished chunked upload for ingestion and returns the job id."""
+    collection_name = _request_collection()
+
+    # The parts were written in place, so the file goes to the ingestion queue as it is
+    def handoff(upload, upload_dir):
+        return ingestion_queue.submit(uuid.uuid4().hex, upload_dir, [(upload.filename, upload)],
+                                      collection_name=collection_name)
+
+    try:
+        job = chunked_uploads.complete(upload_id, collection_name, handoff)
+    except UploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status_code
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+
     return jsonify({
-        "message": f"Processed {successful_uploads} files successfully, {failed_uploads} failed.",
-        "total": len(files),
-        "successful": successful_uploads,
-        "failed": failed_uploads,
-        "results": results
-    }), 200 if failed_uploads == 0 else 207  # 207 = Multi-Status
+        "message": f"Queued '{job['results'][0]['filename']}' for processing.",
+        "job_id": job["job_id"],
+        "status_url": f"/api/jobs/{job['job_id']}",
+        "total": job["total"],
+        "status": job["status"]
+    }), 202
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    """Aborts a chunked upload and removes its parts."""
+    try:
+        chunked_uploads.abort(upload_id, collection_name=_request_collection())
+    except UploadError as e:
+        return jsonify({"error": str(e), **e.details}), e.status_code
+    return jsonify({"message": f"Upload '{upload_id}' aborted."})
+
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Lists recent ingestion jobs with their progress counters."""
+    return jsonify({"jobs": ingestion_queue.list_jobs()})
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Returns the progress and per-file results of an ingestion job."""
+    job = ingestion_queue.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job id '{job_id}'"}), 404
+    return jsonify(job)
+
+
+@app.route('/api/embedding-cache', methods=['GET'])
+def embedding_cache_stats():
+    """Returns hit/miss counters and size of the embedding cache."""
+    return jsonify(embedding_cache.stats())
+
+
+@app.route('/api/rate-limiter', methods=['GET'])
+def rate_limiter_stats():
+    """Returns the current Gemini request rate, 429 counters and embedding batch sizes."""
+    return jsonify({
+        "limiter": rate_limiter.stats(),
+        "embedding_batches": batched_embeddings.stats()
+    })
+
+
+@app.route('/api/query-cache', methods=['GET'])
+def query_cache_stats():
+    """Returns hit rates of the query-embedding and semantic answer caches."""
+    return jsonify(engine.query_cache.stats())
+
+
+@app.route('/api/vision-cache', methods=['GET'])
+def vision_cache_stats():
+    """Returns exact and near-duplicate hit counters of the vision result cache."""
+    return jsonify(vision_cache.stats())
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_export():
+    """Exports per-stage latency histograms and counters in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/profile', methods=['GET'])
+def profile_export():
+    """Returns the sampling profiler's folded stacks (enable with GLIMPSE_PROFILE=1). ?reset=1 clears them."""
+    if profiler is None:
+        return jsonify({"error": "Profiler is disabled. Start the server with GLIMPSE_PROFILE=1."}), 404
+
+    report = profiler.report(top=int(request.args.get('top', 200)))
+    if request.args.get('reset') == '1':
+        profiler.reset()
+    return Response(report, mimetype='text/plain')
 
 
 @app.route('/api/query', methods=['POST'])
 def handle_query():
-    """Handles user queries and returns a RAG-generated answer."""
+    """Handles user queries and returns a RAG-generated answer, optionally streamed as Server-Sent Events."""
     data = request.get_json()
     query_text = data.get('query')
     
     if not query_text:
         return jsonify({"error": "Missing query text"}), 400
+
+    filters, error_message = _parse_query_filters(data.get('filters'))
+    if error_message:
+        return jsonify({"error": error_message}), 400
+
+    # Clients opt into streaming with {"stream": true} or an "Accept: text/event-stream" header
+    wants_stream = data.get('stream') or 'text/event-stream' in request.headers.get('Accept', '')
+
+    collection_name = _request_collection()
+
+    # With a conversation id the question is a turn of that conversation (see /api/conversations)
+    conversation_id = data.get('conversation_id')
+    if conversation_id:
+        try:
+            if wants_stream:
+                events = engine.stream_converse(conversation_id, query_text, collection_name, filters)
+                return _sse_response(events)
+            return jsonify(engine.converse(conversation_id, query_text, collection_name, filters))
+        except UnknownConversationError as e:
+            return jsonify({"error": str(e)}), 404
+        except ConversationBusyError as e:
+            return jsonify({"error": str(e)}), 409
+
+    if wants_stream:
+        events = engine.stream_answer(query_text, collection_name, filters)
+        return _sse_response(events)
             
     # Delegate the entire RAG process to the retrieval module
-    answer = get_rag_answer(
-        query=query_text,
-        collection_name=HARDCODED_COLLECTION_NAME,
-        chroma_client=chroma_client,
-        embedding_model=embedding_model,
-        text_generation_model=text_generation_model
-    )
+    result = engine.answer(query_text, collection_name, filters)
     
-    return jsonify({"answer": answer})
+    return jsonify(result)
+
+
+@app.route('/api/conversations', methods=['POST'])
+def start_conversation():
+    """Starts a conversation. Send its id as "conversation_id" with /api/query to ask follow-up questions."""
+    conversation = engine.conversations.create(_request_collection())
+    return jsonify(conversation), 201
 
 
-@app.route('/register')
+@app.route('/api/conversations/<conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    """Returns the rolling summary, the turns kept verbatim and the chunk ids used by every turn."""
+    try:
+        return jsonify(engine.conversations.describe(conversation_id, _request_collection()))
+    except UnknownConversationError as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
+def end_conversation(conversation_id):
+    """Ends a conversation and drops its history."""
+    try:
+        engine.conversations.delete(conversation_id, _request_collection())
+    except UnknownConversationError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"message": f"Conversation '{conversation_id}' ended."})
+
+
+# Largest number of questions accepted by one batch query request
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "256"))
+
+
+@app.route('/api/query-batch', methods=['POST'])
+def handle_query_batch():
+    """Answers a list of queries with one embedding call and one vector search, optionally streaming results as they finish."""
+    data = request.get_json(silent=True) or {}
+    queries, error_message = _parse_batch_queries(data.get('queries'))
+    if not error_message:
+        filters, error_message = _parse_query_filters(data.get('filters'))
+
+    if error_message:
+        return jsonify({"error": error_message}), 400
+
+    wants_stream = data.get('stream') or 'text/event-stream' in request.headers.get('Accept', '')
+    collection_name = _request_collection()
+
+    if wants_stream:
+        events = engine.stream_answer_batch(queries, collection_name, filters)
+        return _sse_response(events)
+
+    return jsonify(engine.answer_batch(queries, collection_name, filters))
+
+
+@app.route('/api/sources', methods=['GET'])
+def list_sources():
+    """Lists the indexed sources of the user's collection; ?source=, ?type=, ?uploaded_after= and ?uploaded_before= filter them."""
+    filters, error_message = _parse_query_filters({
+        "sources": request.args.getlist('source'),
+        "types": request.args.getlist('type'),
+        "uploaded_after": request.args.get('uploaded_after'),
+        "uploaded_before": request.args.get('uploaded_before'),
+    })
+    if error_message:
+        return jsonify({"error": error_message}), 400
+
+    sources = engine.list_sources(_request_collection(), filters)
+    return jsonify({"sources": sources, "count": len(sources)})
+
+
+def _parse_batch_queries(queries):
+    """Validates the "queries" field of a batch query. Returns (queries, error message)."""
+    if not isinstance(queries, list) or not queries:
+        return None, "Missing queries: expected a non-empty list of strings"
+    if len(queries) > MAX_BATCH_QUERIES:
+        return None, f"Too many queries: {len(queries)} (at most {MAX_BATCH_QUERIES} per request)"
+    if not all(isinstance(query, str) and query.strip() for query in queries):
+        return None, "Every query must be a non-empty string"
+    return queries, None
+
+
+def _parse_query_filters(filters):
+    """Validates the "filters" of a query: {"sources": [...], "types": [...], "uploaded_after", "uploaded_before"}.
+    A single source or type may be given as a string, times as epoch seconds or ISO 8601. Returns (filters, error message)."""
+    if not filters:
+        return None, None
+    if not isinstance(filters, dict):
+        return None, "Filters must be an object"
+
+    unknown = set(filters) - {"sources", "types", "uploaded_after", "uploaded_before"}
+    if unknown:
+        return None, f"Unknown filters: {', '.join(sorted(unknown))}"
+
+    parsed = {}
+    for key in ("sources", "types"):
+        values = filters.get(key)
+        if isinstance(values, str):
+            values = [values]
+        if values is None or values == []:
+            continue
+        if not isinstance(values, list) or not all(isinstance(value, str) and value for value in values):
+            return None, f"Filter '{key}' must be a string or a list of strings"
+        parsed[key] = values
+
+    for key in ("uploaded_after", "uploaded_before"):
+        value = filters.get(key)
+        if value is None or value == "":
+            continue
+        timestamp = _parse_timestamp(value)
+        if timestamp is None:
+            return None, f"Filter '{key}' must be epoch seconds or an ISO 8601 date"
+        parsed[key] = timestamp
+
+    return parsed or None, None
+
+
+def _parse_timestamp(value):
+    """Epoch seconds from a number or an ISO 8601 string (UTC unless it has an offset); None if it is neither."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _sse_response(events):
+    """Streams retrieval events to the client as Server-Sent Events."""
+    return Response(
+        stream_with_context(_format_sse(events)),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _format_sse(events):
+    """Serializes retrieval events into the Server-Sent Events wire format."""
+    try:
+        for event in events:
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+    finally:
+        # Runs the engine generator's cleanup (e.g. releasing a conversation's lock) when the client disconnects
+        events.close()
+
+
+@app.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
     name = data.get("username")
@@ -290,21 +744,15 @@ def register():
 
     if not name or not usermail or not password:
         return jsonify({"message": "Missing Feilds"}), 400
-    
-    existing_user = user_collection.where("usermail", "==", usermail).stream()
 
-    if next(existing_user, None):
-        return jsonify({"message": "User already exists"}), 409
-
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    # Lookup is cached; the hash runs on the bcrypt pool
+    try:
+        user = user_store.register(name, usermail, password)
+    except AuthBusyError as e:
+        return jsonify({"message": str(e)}), 503
 
-    new_user_id = str(uuid.uuid4())
-    user_collection.document.set({
-        "user_id": new_user_id,
-        "name": name,
-        "usermail": usermail,
-        "password": hashed_password.decode('utf-8')
-    })
+    if user is None:
+        return jsonify({"message": "User already exists"}), 409
 
     return jsonify({"message": "User registered successfully"}), 200
 
@@ -315,17 +763,19 @@ def login():
     usermail = data.get("usermail")
     password = data.get("password")
 
-    email_query = user_collection.where("usermail", "==", usermail).stream()
-    user_doc = next(email_query, None)
+    if not usermail or not password:
+        return jsonify({"message": "Missing Feilds"}), 400
+
+    # The user record comes from the cache when it can; bcrypt runs on the bcrypt pool
+    try:
+        user_data, valid = user_store.authenticate(usermail, password)
+    except AuthBusyError as e:
+        return jsonify({"message": str(e)}), 503
 
-    if user_doc is None:
+    if user_data is None:
         return jsonify({"message": "User not registered"}), 404
 
-    user_data = user_doc.to_dict()
-    
-    # Get the hashed password from Firestore and check it
-    stored_password = user_data.get("password", "").encode('utf-8')
-    if not bcrypt.checkpw(password.encode('utf-8'), stored_password):
+    if not valid:
         return jsonify({"message": "Invalid credentials"}), 401
 
     telegram_id = user_data.get("telegramID", "")
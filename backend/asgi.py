@@ -0,0 +1,316 @@
+import io
+import os
+import json
+
+import anyio
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, Mount
+from werkzeug.utils import secure_filename
+
+# The Flask module builds the engine, caches and job queue once; both serving modes share them
+from app import app as flask_app, engine, ingestion_queue, chunked_uploads, _parse_batch_queries, _parse_query_filters
+from ingestion.jobQueue import IMAGE_EXTENSIONS, DOC_EXTENSIONS, QueueFullError, ingest_message
+from ingestion.chunkedUploads import UploadError, MAX_PART_SIZE
+from rag_core.conversation import UnknownConversationError, ConversationBusyError
+from ingestion.uploads import UploadedFile
+from rag_core.metrics import span
+
+
+"""
+Asyncio (ASGI) serving mode with the same endpoints as app.py:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Uploads and queries are handled on the event loop. The Gemini SDK, Chroma and the parsers are
+blocking, so every blocking step runs on worker threads behind one limiter of ASYNC_MAX_CONCURRENCY,
+and a slow Gemini call never holds up other requests. Files of a batch upload are analyzed and
+embedded concurrently by the ingestion job queue. Parts of chunked uploads are read on the event loop
+and written on a worker thread. Every other route (login, register, starting and completing chunked
+uploads, starting and ending conversations, stats) is served by the Flask app itself.
+"""
+
+
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "32"))
+
+_limiter = None
+_DONE = object()
+
+
+def _get_limiter() -> anyio.CapacityLimiter:
+    # Created lazily because a CapacityLimiter has to be created inside the running event loop
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(ASYNC_MAX_CONCURRENCY)
+    return _limiter
+
+
+async def run_blocking(func, *args):
+    return await anyio.to_thread.run_sync(func, *args, limiter=_get_limiter())
+
+
+# Drives a blocking generator (e.g. engine.stream_answer) from the event loop, one item per worker hop.
+# When the stream stops early (the client disconnected) the generator is closed on a worker thread too,
+# so its own cleanup still runs: stream_converse releases the conversation lock in its `finally`.
+
+async def iterate_blocking(generator):
+    try:
+        while True:
+            item = await run_blocking(next, generator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        # Shielded, because a disconnect arrives here as a cancellation of the response task
+        with anyio.CancelScope(shield=True):
+            await run_blocking(generator.close)
+
+
+
+# Reads the user id from Flask's signed session cookie, so both serving modes route to the same collection
+
+def _request_collection(request: Request) -> str:
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    user_id = None
+
+    if cookie:
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        try:
+            max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+            user_id = serializer.loads(cookie, max_age=max_age).get("user_id")
+        except Exception:
+            user_id = None
+
+    return engine.collection_for_user(user_id)
+
+
+
+async def health_check(request: Request):
+    health = await run_blocking(engine.health)
+    return JSONResponse(health, status_code=200 if health["status"] == "ok" else 503)
+
+
+async def upload_file(request: Request):
+    async with request.form() as form:
+        file = form.get('file')
+        if file is None or isinstance(file, str):
+            return JSONResponse({"error": "No file part in the request"}, status_code=400)
+        if not file.filename:
+            return JSONResponse({"error": "No selected file"}, status_code=400)
+
+        filename = secure_filename(file.filename)
+        file_ext = os.path.splitext(filename)[1].lower()
+        if file_ext not in IMAGE_EXTENSIONS and file_ext not in DOC_EXTENSIONS:
+            return JSONResponse({"error": f"Unsupported file type: {file_ext}"}, status_code=400)
+
+        collection_name = _request_collection(request)
+        with span("upload_save"):
+            upload = await run_blocking(UploadedFile.from_stream, file.file, filename, "./temp_uploads")
+
+    error_message = None
+    try:
+        if file_ext in IMAGE_EXTENSIONS:
+            success = await run_blocking(
+                lambda: engine.ingest_image(upload.open_source(), collection_name=collection_name, file_name=filename)
+            )
+        else:
+            success = await run_blocking(
+                lambda: engine.ingest_document(upload.open_source(), collection_name=collection_name, file_name=filename)
+            )
+    except Exception as e:
+        print(f"❌ Error processing {filename}: {str(e)}")
+        error_message = str(e)
+        success = False
+    finally:
+        upload.close()
+
+    if success:
+        return JSONResponse({
+            "message": ingest_message(filename, success),
+            "filename": filename,
+            "status": "success",
+            "ingest_status": success
+        })
+    return JSONResponse({
+        "error": error_message or f"Failed to process file '{filename}'.",
+        "filename": filename,
+        "status": "failed"
+    }, status_code=500)
+
+
+async def upload_batch(request: Request):
+    async with request.form() as form:
+        files = [file for file in form.getlist('files') if not isinstance(file, str) and file.filename]
+        if not files:
+            return JSONResponse({"error": "No files selected"}, status_code=400)
+
+        job_id, job_dir = ingestion_queue.new_job_dir()
+        saved_files = []
+
+        for file in files:
+            filename = secure_filename(file.filename)
+            file_ext = os.path.splitext(filename)[1].lower()
+
+            if file_ext not in IMAGE_EXTENSIONS and file_ext not in DOC_EXTENSIONS:
+                saved_files.append((filename, None))
+                continue
+
+            with span("upload_save"):
+                upload = await run_blocking(UploadedFile.from_stream, file.file, filename, job_dir)
+            saved_files.append((filename, upload))
+
+    try:
+        job = ingestion_queue.submit(job_id, job_dir, saved_files, collection_name=_request_collection(request))
+    except QueueFullError as e:
+        ingestion_queue.discard_job(job_dir, saved_files)
+        return JSONResponse({"error": str(e)}, status_code=503)
+
+    return JSONResponse({
+        "message": f"Queued {job['total']} file(s) for processing.",
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}",
+        "total": job["total"],
+        "status": job["status"]
+    }, status_code=202)
+
+
+async def upload_part(request: Request):
+    upload_id = request.path_params["upload_id"]
+    index = request.path_params["index"]
+
+    # Parts are at most MAX_PART_SIZE, so one is buffered here and written in a single worker hop
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > MAX_PART_SIZE:
+            break
+
+    try:
+        upload = await run_blocking(
+            lambda: chunked_uploads.write_part(upload_id, index, io.BytesIO(body),
+                                               collection_name=_request_collection(request),
+                                               checksum=request.headers.get("x-part-sha256"))
+        )
+    except UploadError as e:
+        return JSONResponse({"error": str(e), **e.details}, status_code=e.status_code)
+    return JSONResponse(upload)
+
+
+async def list_jobs(request: Request):
+    return JSONResponse({"jobs": ingestion_queue.list_jobs()})
+
+
+async def get_job_status(request: Request):
+    job_id = request.path_params["job_id"]
+    job = ingestion_queue.get_job(job_id)
+    if job is None:
+        return JSONResponse({"error": f"Unknown job id '{job_id}'"}, status_code=404)
+    return JSONResponse(job)
+
+
+async def handle_query(request: Request):
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        data = {}
+    query_text = data.get('query')
+
+    if not query_text:
+        return JSONResponse({"error": "Missing query text"}, status_code=400)
+
+    filters, error_message = _parse_query_filters(data.get('filters'))
+    if error_message:
+        return JSONResponse({"error": error_message}, status_code=400)
+
+    collection_name = _request_collection(request)
+    wants_stream = data.get('stream') or 'text/event-stream' in request.headers.get('accept', '')
+
+    conversation_id = data.get('conversation_id')
+    if conversation_id:
+        try:
+            if wants_stream:
+                events = await run_blocking(engine.stream_converse, conversation_id, query_text, collection_name, filters)
+                return _sse_response(events)
+            result = await run_blocking(engine.converse, conversation_id, query_text, collection_name, filters)
+        except UnknownConversationError as e:
+            return JSONResponse({"error": str(e)}, status_code=404)
+        except ConversationBusyError as e:
+            return JSONResponse({"error": str(e)}, status_code=409)
+        return JSONResponse(result)
+
+    if wants_stream:
+        # Resolving the filters reads the source index, so even building the stream happens off the event loop
+        events = await run_blocking(engine.stream_answer, query_text, collection_name, filters)
+        return _sse_response(events)
+
+    result = await run_blocking(engine.answer, query_text, collection_name, filters)
+    return JSONResponse(result)
+
+
+async def handle_query_batch(request: Request):
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        data = {}
+    queries, error_message = _parse_batch_queries(data.get('queries'))
+    if not error_message:
+        filters, error_message = _parse_query_filters(data.get('filters'))
+
+    if error_message:
+        return JSONResponse({"error": error_message}, status_code=400)
+
+    collection_name = _request_collection(request)
+    wants_stream = data.get('stream') or 'text/event-stream' in request.headers.get('accept', '')
+
+    if wants_stream:
+        events = await run_blocking(engine.stream_answer_batch, queries, collection_name, filters)
+        return _sse_response(events)
+
+    result = await run_blocking(engine.answer_batch, queries, collection_name, filters)
+    return JSONResponse(result)
+
+
+# Streams the events of a blocking engine generator as Server-Sent Events
+
+def _sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        _format_sse(iterate_blocking(events)),
+        media_type='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _format_sse(events):
+    async for event in events:
+        yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+
+app = Starlette(
+    routes=[
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/upload', upload_file, methods=['POST']),
+        Route('/api/upload-batch', upload_batch, methods=['POST']),
+        Route('/api/uploads/{upload_id}/parts/{index:int}', upload_part, methods=['PUT']),
+        Route('/api/jobs', list_jobs, methods=['GET']),
+        Route('/api/jobs/{job_id}', get_job_status, methods=['GET']),
+        Route('/api/query', handle_query, methods=['POST']),
+        Route('/api/query-batch', handle_query_batch, methods=['POST']),
+        # Everything else is answered by the Flask app on a worker thread
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["http://localhost:5173"],
+            allow_credentials=True,
+            allow_headers=["Content-Type", "Authorization", "X-Requested-With", "X-Part-SHA256"],
+            allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+            expose_headers=["Content-Type"],
+        )
+    ],
+)
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_store import UserStore, InMemoryUserBackend, AuthBusyError
+from benchmarks.bench_pipeline import compare, percentile
+
+
+"""
+Load test of the login path (user_store.UserStore) against the in-memory user backend, offline.
+
+A burst of logins from a small set of users, some with unknown emails, is sent from many threads at once.
+The backend sleeps for --lookup-latency-ms per call to stand in for the Firestore round trip.
+Each configuration reports throughput, login latency and how many backend lookups were made:
+
+  - uncached: the previous path, a backend lookup and an inline bcrypt check on every request
+  - cached:   UserStore with the TTL cache, negative caching and the bcrypt pool
+
+    python -m benchmarks.bench_auth --output auth.json
+    python -m benchmarks.bench_auth --compare auth.json --max-regression 0.2
+"""
+
+
+PASSWORD = "correct horse battery staple"
+
+
+def make_users(count: int, rounds: int) -> list:
+    hashed = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+    return [
+        {"user_id": f"user-{index}", "name": f"User {index}", "usermail": f"user{index}@example.com", "password": hashed}
+        for index in range(count)
+    ]
+
+
+# One login as app.py did it before the user store
+
+def uncached_login(backend, usermail: str, password: str) -> int:
+    user = backend.find_by_email(usermail)
+    if user is None:
+        return 404
+    if not bcrypt.checkpw(password.encode('utf-8'), user["password"].encode('utf-8')):
+        return 401
+    return 200
+
+
+def cached_login(store, usermail: str, password: str) -> int:
+    try:
+        user, valid = store.authenticate(usermail, password)
+    except AuthBusyError:
+        return 503
+    if user is None:
+        return 404
+    return 200 if valid else 401
+
+
+def run_burst(login, requests: list, concurrency: int) -> dict:
+    def timed(request):
+        started = time.perf_counter()
+        status = login(*request)
+        return status, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, requests))
+    elapsed = time.perf_counter() - started
+
+    samples = [latency for _, latency in results]
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "logins_per_second": round(len(requests) / elapsed, 2),
+        "p50_ms": round(percentile(samples, 0.50), 3),
+        "p95_ms": round(percentile(samples, 0.95), 3),
+        "statuses": statuses,
+    }
+
+
+def run_benchmark(args) -> dict:
+    users = make_users(args.users, args.rounds)
+    requests = []
+    for index in range(args.requests):
+        if index % 10 < args.unknown_per_ten:
+            requests.append((f"unknown{index % 20}@example.com", PASSWORD))
+        else:
+            requests.append((users[index % len(users)]["usermail"], PASSWORD))
+
+    metrics = {}
+    details = {}
+    for name in ("uncached", "cached"):
+        backend = InMemoryUserBackend(latency=args.lookup_latency_ms / 1000)
+        for user in users:
+            backend.create(user)
+        backend.lookups = 0
+
+        if name == "uncached":
+            result = run_burst(lambda usermail, password: uncached_login(backend, usermail, password), requests, args.concurrency)
+        else:
+            store = UserStore(backend, hash_workers=args.hash_workers or None,
+                              max_pending_hashes=max(args.requests, args.concurrency))
+            result = run_burst(lambda usermail, password: cached_login(store, usermail, password), requests, args.concurrency)
+            result["cache"] = store.stats()
+            store.close()
+
+        result["backend_lookups"] = backend.lookups
+        details[name] = result
+        metrics[f"{name}_p50_ms"] = result["p50_ms"]
+        metrics[f"{name}_p95_ms"] = result["p95_ms"]
+        print(f" - {name}: {result['logins_per_second']} logins/s, p50 {result['p50_ms']} ms, "
+              f"{backend.lookups} backend lookups", file=sys.stderr)
+
+    return {
+        "benchmark": "glimpse-auth",
+        "environment": {
+            "python": platform.python_version(),
+            "bcrypt": bcrypt.__version__,
+            "cpu_count": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+        "parameters": {
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "unknown_per_ten": args.unknown_per_ten,
+            "lookup_latency_ms": args.lookup_latency_ms,
+            "rounds": args.rounds,
+        },
+        "metrics": metrics,
+        "details": details,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the Glimpse login path.")
+    parser.add_argument("--users", type=int, default=20, help="Registered users the logins are spread over")
+    parser.add_argument("--requests", type=int, default=200, help="Logins in the burst")
+    parser.add_argument("--concurrency", type=int, default=32, help="Threads sending logins")
+    parser.add_argument("--unknown-per-ten", type=int, default=2, help="Logins out of every ten with an unknown email")
+    parser.add_argument("--lookup-latency-ms", type=float, default=40.0, help="Simulated Firestore round trip")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor of the stored hashes")
+    parser.add_argument("--hash-workers", type=int, default=0, help="bcrypt pool size (default: CPU count)")
+    parser.add_argument("--output", help="Write the JSON result to this file as well as stdout")
+    parser.add_argument("--compare", help="Baseline JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail when a metric is worse than the baseline by more than this fraction")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    output = json.dumps(result, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions over {args.max_regression:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
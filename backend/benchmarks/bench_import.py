@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import argparse
+import platform
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pipeline import compare
+
+
+"""
+Import-time benchmark. Imports each entry point in a fresh interpreter, so nothing is already cached,
+and reports how long it took and which heavy dependencies were loaded on the way:
+
+    python -m benchmarks.bench_import --output imports.json
+    python -m benchmarks.bench_import --compare imports.json --max-regression 0.2
+"""
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ["rag_core", "ingestion", "rag_core.engine", "app"]
+
+# Dependencies that should only be imported when an upload or query needs them
+HEAVY_MODULES = [
+    "chromadb",
+    "google.generativeai",
+    "langchain_google_genai",
+    "langchain_community.vectorstores",
+    "langchain.text_splitter",
+    "firebase_admin",
+    "PyPDF2",
+    "docx",
+    "PIL.Image",
+]
+
+_PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print("\\n" + json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+# Imports `module` in a new interpreter. The clients are not warmed up, so only import cost is measured.
+
+def measure_import(module: str) -> dict:
+    env = dict(os.environ, GLIMPSE_WARM_UP="0", GLIMPSE_PROFILE="0")
+    completed = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+
+    # The modules log with print(); the measurement is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_benchmark(args) -> dict:
+    metrics = {}
+    eager = {}
+
+    for module in args.modules:
+        samples = [measure_import(module) for _ in range(args.repeat)]
+        key = module.replace(".", "_")
+        metrics[f"import_{key}_ms"] = round(statistics.median(sample["ms"] for sample in samples), 3)
+        eager[module] = samples[-1]["loaded"]
+        print(f" - {module}: {metrics[f'import_{key}_ms']} ms, eager heavy modules: {eager[module] or 'none'}", file=sys.stderr)
+
+    return {
+        "benchmark": "glimpse-imports",
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "parameters": {"modules": args.modules, "repeat": args.repeat},
+        "metrics": metrics,
+        "eager_heavy_modules": eager,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the Glimpse backend.")
+    parser.add_argument("--modules", nargs="+", default=ENTRY_POINTS, help="Modules to import")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module; the median is reported")
+    parser.add_argument("--output", help="Write the JSON result to this file as well as stdout")
+    parser.add_argument("--compare", help="Baseline JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail when an import is slower than the baseline by more than this fraction")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    output = json.dumps(result, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions over {args.max_regression:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_core.retrieval import mmr_select, MMR_LAMBDA
+from benchmarks.bench_pipeline import compare, percentile
+
+
+"""
+Micro-benchmark of the MMR reranking stage (rag_core.retrieval.mmr_select).
+
+Candidate pools are built from clusters of near-duplicate vectors, like a document uploaded several times.
+For every pool size it reports the rerank latency and how many distinct clusters end up in the top k,
+for plain top-k by relevance and for MMR:
+
+    python -m benchmarks.bench_mmr --output mmr.json
+    python -m benchmarks.bench_mmr --compare mmr.json --max-regression 0.2
+"""
+
+
+# `size` candidates in clusters of `duplicates` near-identical unit vectors, with their relevance to a query
+# and the cluster of every candidate
+
+def make_pool(rng, size: int, dimensions: int, duplicates: int):
+    clusters = max(1, size // duplicates)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    labels = np.arange(size) % clusters
+
+    vectors = centers[labels] + 0.05 * rng.standard_normal((size, dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    # A query close to a few clusters, so the best candidates are duplicates of each other
+    query = centers[:3].sum(axis=0) + 0.5 * rng.standard_normal(dimensions).astype(np.float32)
+    query /= np.linalg.norm(query)
+    relevance = vectors @ query
+    return vectors, relevance, labels
+
+
+def time_call(func, repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def run_benchmark(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    metrics = {}
+    diversity = {}
+
+    try:
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+    except ImportError:
+        maximal_marginal_relevance = None
+
+    for size in args.pool_sizes:
+        vectors, relevance, labels = make_pool(rng, size, args.dimensions, args.duplicates)
+
+        samples = time_call(lambda: mmr_select(vectors, relevance, args.k, args.lambda_mult), args.repeat)
+        metrics[f"mmr_{size}_p50_ms"] = round(percentile(samples, 0.50), 4)
+        metrics[f"mmr_{size}_p95_ms"] = round(percentile(samples, 0.95), 4)
+
+        top_k = np.argsort(-relevance)[:args.k]
+        picks = mmr_select(vectors, relevance, args.k, args.lambda_mult)
+        diversity[str(size)] = {
+            "top_k_clusters": len(set(labels[top_k].tolist())),
+            "mmr_clusters": len(set(labels[picks].tolist())),
+            "top_k_mean_relevance": round(float(relevance[top_k].mean()), 4),
+            "mmr_mean_relevance": round(float(relevance[picks].mean()), 4),
+        }
+
+        # LangChain's implementation recomputes the full similarity matrix on every step; for reference only
+        if maximal_marginal_relevance is not None:
+            query = (relevance @ vectors).astype(np.float32)
+            samples = time_call(
+                lambda: maximal_marginal_relevance(query, vectors, lambda_mult=args.lambda_mult, k=args.k),
+                max(1, args.repeat // 10)
+            )
+            diversity[str(size)]["langchain_p50_ms"] = round(percentile(samples, 0.50), 4)
+
+        print(f" - pool {size}: p50 {metrics[f'mmr_{size}_p50_ms']} ms, clusters in top {args.k}: "
+              f"{diversity[str(size)]['top_k_clusters']} plain vs {diversity[str(size)]['mmr_clusters']} MMR", file=sys.stderr)
+
+    return {
+        "benchmark": "glimpse-mmr",
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "parameters": {
+            "pool_sizes": args.pool_sizes,
+            "dimensions": args.dimensions,
+            "duplicates": args.duplicates,
+            "k": args.k,
+            "lambda_mult": args.lambda_mult,
+            "repeat": args.repeat,
+        },
+        "metrics": metrics,
+        "diversity": diversity,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of MMR reranking for Glimpse.")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[50, 100, 200, 400], help="Candidate pool sizes")
+    parser.add_argument("--dimensions", type=int, default=768, help="Embedding dimensions (embedding-001 has 768)")
+    parser.add_argument("--duplicates", type=int, default=5, help="Near-identical candidates per cluster")
+    parser.add_argument("--k", type=int, default=5, help="Chunks to pick")
+    parser.add_argument("--lambda-mult", type=float, default=MMR_LAMBDA)
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON result to this file as well as stdout")
+    parser.add_argument("--compare", help="Baseline JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail when a metric is worse than the baseline by more than this fraction")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    output = json.dumps(result, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions over {args.max_regression:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+
+# The fake models answer instantly, so lift the shared Gemini rate limit before anything creates it
+os.environ.setdefault("GEMINI_REQUESTS_PER_SECOND", "100000")
+os.environ.setdefault("GEMINI_BURST", "100000")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The ingestion package prints on import; keep stdout clean for the JSON result
+with contextlib.redirect_stdout(sys.stderr):
+    from ingestion.docEmbed import process_and_embed_document
+    from ingestion.imageEmbed import process_and_embed_image
+from rag_core.retrieval import get_rag_answer
+from rag_core.metrics import get_metrics
+from rag_core.vector_store import make_vector_client, VECTOR_STORE_BACKENDS
+from benchmarks.fakes import FakeEmbeddings, FakeVisionModel, FakeGenerationModel
+from benchmarks.corpus import generate_corpus, generate_queries
+
+
+"""
+Offline benchmark of the ingestion and query pipeline.
+
+Runs process_and_embed_document, process_and_embed_image and get_rag_answer against a
+temporary vector store (Chroma, or the NumPy store with --backend numpy) with deterministic fake models, and prints machine-readable JSON:
+
+    python -m benchmarks.bench_pipeline --output bench.json
+    python -m benchmarks.bench_pipeline --compare bench.json --max-regression 0.2
+"""
+
+
+COLLECTION_NAME = "benchmark_brain"
+
+# Metrics where a lower value is better; everything else is a throughput
+LOWER_IS_BETTER = ("_ms", "_mb", "_seconds")
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    return round(peak / divisor, 2)
+
+
+def run_benchmark(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="glimpse-bench-")
+
+    try:
+        document_paths, image_paths = generate_corpus(
+            os.path.join(workdir, "corpus"),
+            documents=args.documents,
+            pages=args.pages,
+            images=args.images,
+            image_size=args.image_size,
+            seed=args.seed
+        )
+
+        embedding_model = FakeEmbeddings(latency=args.embed_latency_ms / 1000)
+        vision_model = FakeVisionModel(latency=args.vision_latency_ms / 1000)
+        text_generation_model = FakeGenerationModel(latency=args.generation_latency_ms / 1000)
+        chroma_client = make_vector_client(args.backend, os.path.join(workdir, "store"))
+
+        # Ingestion
+        started = time.perf_counter()
+        failures = 0
+        for path in document_paths:
+            if not process_and_embed_document(path, COLLECTION_NAME, chroma_client, embedding_model):
+                failures += 1
+        documents_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for path in image_paths:
+            if not process_and_embed_image(path, COLLECTION_NAME, chroma_client, embedding_model, vision_model):
+                failures += 1
+        images_seconds = time.perf_counter() - started
+
+        chunks = chroma_client.get_or_create_collection(COLLECTION_NAME).count()
+        ingest_seconds = documents_seconds + images_seconds
+
+        # Queries
+        latencies = []
+        for query in generate_queries(args.queries, seed=args.seed):
+            started = time.perf_counter()
+            get_rag_answer(query, COLLECTION_NAME, chroma_client, embedding_model, text_generation_model)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        return {
+            "config": {
+                "documents": args.documents,
+                "pages": args.pages,
+                "images": args.images,
+                "queries": args.queries,
+                "backend": args.backend,
+                "embed_latency_ms": args.embed_latency_ms,
+                "vision_latency_ms": args.vision_latency_ms,
+                "generation_latency_ms": args.generation_latency_ms,
+                "python": platform.python_version(),
+            },
+            "metrics": {
+                "ingest_seconds": round(ingest_seconds, 3),
+                "docs_per_sec": round(len(document_paths) / documents_seconds, 3) if documents_seconds else 0.0,
+                "images_per_sec": round(len(image_paths) / images_seconds, 3) if images_seconds else 0.0,
+                "chunks_per_sec": round(chunks / ingest_seconds, 3) if ingest_seconds else 0.0,
+                "query_p50_ms": round(percentile(latencies, 0.50), 3),
+                "query_p95_ms": round(percentile(latencies, 0.95), 3),
+                "query_p99_ms": round(percentile(latencies, 0.99), 3),
+                "peak_rss_mb": peak_rss_mb(),
+            },
+            "counts": {
+                "chunks": chunks,
+                "failed_files": failures,
+                "embedding_calls": embedding_model.calls,
+                "embedded_texts": embedding_model.texts,
+                "vision_calls": vision_model.calls,
+                "generation_calls": text_generation_model.calls,
+            },
+            # Where the time went, per pipeline stage
+            "stages": get_metrics().stage_summary(),
+        }
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Compares two result files metric by metric. Returns the metrics that got worse by more than `max_regression`.
+
+def compare(current: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+
+    for name, value in current["metrics"].items():
+        previous = baseline.get("metrics", {}).get(name)
+        if not previous:
+            continue
+
+        change = (value - previous) / previous
+        worse = change > 0 if name.endswith(LOWER_IS_BETTER) else change < 0
+        print(f"{name:>18}: {previous:>12} -> {value:>12} ({change:+.1%})", file=sys.stderr)
+
+        if worse and abs(change) > max_regression:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion and query benchmark for Glimpse.")
+    parser.add_argument("--documents", type=int, default=9, help="Number of PDF/DOCX/TXT files to generate")
+    parser.add_argument("--pages", type=int, default=10, help="Pages (or paragraph groups) per document")
+    parser.add_argument("--images", type=int, default=3, help="Number of images to generate")
+    parser.add_argument("--image-size", type=int, default=1024, help="Side length of generated images in pixels")
+    parser.add_argument("--queries", type=int, default=50, help="Number of queries to run")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Artificial latency per embedding call")
+    parser.add_argument("--vision-latency-ms", type=float, default=0.0, help="Artificial latency per vision call")
+    parser.add_argument("--generation-latency-ms", type=float, default=0.0, help="Artificial latency per generation call")
+    parser.add_argument("--backend", choices=VECTOR_STORE_BACKENDS, default="chroma", help="Vector store backend")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON result to this file as well as stdout")
+    parser.add_argument("--compare", help="Baseline JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail when a metric is worse than the baseline by more than this fraction")
+    args = parser.parse_args()
+
+    # The pipeline logs with print() as well
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run_benchmark(args)
+    output = json.dumps(result, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions over {args.max_regression:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_core.vector_store import make_vector_client
+from benchmarks.bench_pipeline import compare, percentile
+
+
+"""
+Benchmark of the vector store backends (rag_core.vector_store) on synthetic embeddings.
+
+Loads the same clustered vectors into Chroma and into the NumPy store in several configurations, then
+reports per configuration: recall@k against an exact float32 search, single-query and batched query
+latency, build time, size on disk and the time to reopen the store and answer a first query:
+
+    python -m benchmarks.bench_vector_store --output vector_store.json
+    python -m benchmarks.bench_vector_store --compare vector_store.json --max-regression 0.2
+"""
+
+
+COLLECTION_NAME = "benchmark_vectors"
+
+# name -> (backend, options)
+CONFIGURATIONS = {
+    "chroma": ("chroma", {}),
+    "numpy_float32": ("numpy", {"dtype": "float32"}),
+    "numpy_float16": ("numpy", {"dtype": "float16"}),
+    "numpy_float16_cached": ("numpy", {"dtype": "float16", "decode_cache_mb": 1024}),
+    "numpy_int8": ("numpy", {"dtype": "int8"}),
+    "numpy_int8_coarse": ("numpy", {"dtype": "int8", "coarse_index": True, "coarse_min_vectors": 1}),
+}
+
+
+# `size` vectors around `clusters` topics, like chunks of a few hundred documents, and queries near them
+
+def make_dataset(rng, size: int, queries: int, dimensions: int, clusters: int):
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size)] + 0.8 * rng.standard_normal((size, dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    probes = vectors[rng.integers(0, size, queries)] + 0.5 * rng.standard_normal((queries, dimensions)).astype(np.float32) / np.sqrt(dimensions)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    return vectors, probes
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+
+
+def directory_size_mb(path: str) -> float:
+    total = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return round(total / (1024 * 1024), 3)
+
+
+def measure(name: str, backend: str, options: dict, vectors, queries, truth, args, workdir: str) -> dict:
+    path = os.path.join(workdir, name)
+    ids = [f"v{index}" for index in range(len(vectors))]
+
+    client = make_vector_client(backend, path, **dict(options, background_merge=False) if backend == "numpy" else {})
+    collection = client.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+
+    started = time.perf_counter()
+    for start in range(0, len(vectors), args.batch_size):
+        collection.add(
+            ids=ids[start:start + args.batch_size],
+            embeddings=vectors[start:start + args.batch_size].tolist(),
+            documents=[f"chunk {index}" for index in range(start, min(start + args.batch_size, len(vectors)))],
+            metadatas=[{"source": f"doc{index % 100}"} for index in range(start, min(start + args.batch_size, len(vectors)))]
+        )
+    if backend == "numpy":
+        collection.merge(force=True)
+    build_seconds = time.perf_counter() - started
+
+    samples = []
+    found = []
+    for query in queries:
+        started = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=args.k, include=["distances"])
+        samples.append((time.perf_counter() - started) * 1000)
+        found.append(result["ids"][0])
+
+    started = time.perf_counter()
+    collection.query(query_embeddings=queries.tolist(), n_results=args.k, include=["distances"])
+    batch_ms = (time.perf_counter() - started) * 1000
+
+    recall = np.mean([
+        len({int(chunk_id[1:]) for chunk_id in result} & set(expected.tolist())) / args.k
+        for result, expected in zip(found, truth)
+    ])
+
+    if backend == "numpy":
+        client.close()
+    del client, collection
+
+    # A new process would pay this before its first answer
+    started = time.perf_counter()
+    client = make_vector_client(backend, path, **options)
+    client.get_collection(COLLECTION_NAME).query(query_embeddings=[queries[0].tolist()], n_results=args.k)
+    reopen_ms = (time.perf_counter() - started) * 1000
+    if backend == "numpy":
+        client.close()
+
+    metrics = {
+        f"{name}_query_p50_ms": round(percentile(samples, 0.50), 3),
+        f"{name}_query_p95_ms": round(percentile(samples, 0.95), 3),
+        f"{name}_batch_ms_per_query": round(batch_ms / len(queries), 3),
+        f"{name}_build_seconds": round(build_seconds, 3),
+        f"{name}_disk_mb": directory_size_mb(path),
+        f"{name}_reopen_ms": round(reopen_ms, 3),
+    }
+    print(f" - {name}: recall@{args.k} {recall:.3f}, p50 {metrics[f'{name}_query_p50_ms']} ms, "
+          f"{metrics[f'{name}_disk_mb']} MB on disk", file=sys.stderr)
+    return {"metrics": metrics, "recall": round(float(recall), 4)}
+
+
+def run_benchmark(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    vectors, queries = make_dataset(rng, args.vectors, args.queries, args.dimensions, args.clusters)
+    truth = exact_neighbours(vectors, queries, args.k)
+
+    metrics = {}
+    recall = {}
+    workdir = tempfile.mkdtemp(prefix="glimpse-vectors-")
+    try:
+        for name in args.configurations:
+            backend, options = CONFIGURATIONS[name]
+            result = measure(name, backend, options, vectors, queries, truth, args, workdir)
+            metrics.update(result["metrics"])
+            recall[name] = result["recall"]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "glimpse-vector-store",
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "parameters": {
+            "vectors": args.vectors,
+            "queries": args.queries,
+            "dimensions": args.dimensions,
+            "clusters": args.clusters,
+            "k": args.k,
+            "configurations": args.configurations,
+        },
+        "metrics": metrics,
+        "recall": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the Glimpse vector store backends.")
+    parser.add_argument("--vectors", type=int, default=20000, help="Vectors to load")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimensions", type=int, default=768, help="Embedding dimensions (embedding-001 has 768)")
+    parser.add_argument("--clusters", type=int, default=200, help="Topics the vectors are drawn around")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Vectors per add() call")
+    parser.add_argument("--configurations", nargs="+", choices=list(CONFIGURATIONS), default=list(CONFIGURATIONS))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON result to this file as well as stdout")
+    parser.add_argument("--compare", help="Baseline JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail when a metric is worse than the baseline by more than this fraction")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    output = json.dumps(result, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions over {args.max_regression:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
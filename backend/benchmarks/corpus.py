@@ -0,0 +1,126 @@
+import os
+import random
+
+import docx
+from PIL import Image, ImageDraw
+
+
+"""
+Generates a reproducible benchmark corpus of PDF, DOCX, TXT and image files.
+"""
+
+
+VOCABULARY = (
+    "glimpse brain document invoice contract quarterly revenue forecast meeting notes roadmap "
+    "customer support latency throughput embedding vector retrieval answer question summary "
+    "design review budget hiring policy security incident report migration database cluster "
+    "storage network deployment release feature request backlog sprint milestone research paper"
+).split()
+
+
+def make_sentence(rng: random.Random, words: int = 14) -> str:
+    sentence = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+    return sentence.capitalize() + "."
+
+
+def make_paragraph(rng: random.Random, sentences: int = 6) -> str:
+    return " ".join(make_sentence(rng) for _ in range(sentences))
+
+
+# Writes a minimal, valid PDF with one Helvetica text stream per page.
+# PyPDF2 cannot lay out text itself, so the file is assembled by hand.
+
+def write_pdf(path: str, pages: list):
+    page_count = len(pages)
+    kids = " ".join(f"{4 + 2 * index} 0 R" for index in range(page_count))
+
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+
+    for index, text in enumerate(pages):
+        lines = [text[start:start + 90] for start in range(0, len(text), 90)]
+        escaped = [line.replace("\\", "").replace("(", "").replace(")", "") for line in lines]
+        stream = "BT /F1 9 Tf 36 806 Td 11 TL " + " ".join(f"({line}) '" for line in escaped) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * index} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    parts = ["%PDF-1.4\n"]
+    offsets = []
+    position = len(parts[0])
+    for number, body in enumerate(objects, start=1):
+        offsets.append(position)
+        chunk = f"{number} 0 obj\n{body}\nendobj\n"
+        parts.append(chunk)
+        position += len(chunk)
+
+    xref = [f"xref\n0 {len(objects) + 1}\n", "0000000000 65535 f \n"]
+    xref += [f"{offset:010d} 00000 n \n" for offset in offsets]
+    trailer = f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n"
+
+    with open(path, 'w', encoding='latin-1') as f:
+        f.write("".join(parts) + "".join(xref) + trailer)
+
+
+def write_docx(path: str, paragraphs: list):
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def write_txt(path: str, paragraphs: list):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n\n".join(paragraphs))
+
+
+def write_image(path: str, rng: random.Random, size: int):
+    image = Image.new('RGB', (size, size), color=(255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size), rng.randrange(size)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle([x, y, x + size // 5, y + size // 5], fill=colour)
+    image.save(path)
+
+
+# Creates `documents` files rotating through PDF, DOCX and TXT, plus `images` PNG files.
+# Returns (document_paths, image_paths).
+
+def generate_corpus(directory: str, documents: int = 9, pages: int = 10, images: int = 3,
+                    image_size: int = 1024, seed: int = 7) -> tuple:
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    document_paths = []
+    image_paths = []
+
+    for index in range(documents):
+        kind = ("pdf", "docx", "txt")[index % 3]
+        path = os.path.join(directory, f"doc_{index:03d}.{kind}")
+
+        if kind == "pdf":
+            write_pdf(path, [make_paragraph(rng, sentences=20) for _ in range(pages)])
+        elif kind == "docx":
+            write_docx(path, [make_paragraph(rng) for _ in range(pages * 3)])
+        else:
+            write_txt(path, [make_paragraph(rng) for _ in range(pages * 3)])
+
+        document_paths.append(path)
+
+    for index in range(images):
+        path = os.path.join(directory, f"image_{index:03d}.png")
+        write_image(path, rng, image_size)
+        image_paths.append(path)
+
+    return document_paths, image_paths
+
+
+def generate_queries(count: int, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    return [make_sentence(rng, words=6).rstrip(".") + "?" for _ in range(count)]
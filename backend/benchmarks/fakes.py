@@ -0,0 +1,116 @@
+import io
+import re
+import json
+import time
+import zlib
+import math
+
+from PIL import Image
+from langchain_core.embeddings import Embeddings
+
+
+"""
+Deterministic local stand-ins for the Gemini embedding, vision and generation models.
+They mimic the call signatures used by the ingestion and retrieval modules and can add
+artificial latency, so the pipeline can be benchmarked without network access.
+"""
+
+
+# Feature-hashed bag of words: texts that share words get similar unit vectors,
+# so retrieval and relevance gating behave roughly like they do with real embeddings.
+
+class FakeEmbeddings(Embeddings):
+
+    def __init__(self, dimensions: int = 768, latency: float = 0.0, per_text_latency: float = 0.0):
+        self.model = "fake-embedding"
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.calls = 0
+        self.texts = 0
+
+
+    def _embed(self, text: str) -> list:
+        vector = [0.0] * self.dimensions
+        for token in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(token.encode('utf-8')) % self.dimensions] += 1.0
+
+        norm = math.sqrt(sum(value * value for value in vector))
+        if not norm:
+            vector[0] = norm = 1.0
+        return [value / norm for value in vector]
+
+
+    def embed_documents(self, texts: list) -> list:
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+
+    def embed_query(self, text: str) -> list:
+        self.calls += 1
+        self.texts += 1
+        time.sleep(self.latency + self.per_text_latency)
+        return self._embed(text)
+
+
+    # Batched query embedding, one call for all texts like a Gemini batch request with a query task type
+
+    def embed_queries(self, texts: list) -> list:
+        return self.embed_documents(texts)
+
+
+class FakeResponse:
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeVisionModel:
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+
+    def generate_content(self, parts, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        image = parts[-1]
+        if isinstance(image, dict):
+            image = Image.open(io.BytesIO(image["data"]))
+        caption = f"A synthetic {image.width}x{image.height} benchmark image with coloured blocks."
+        return FakeResponse(json.dumps({"type": "photograph", "content": caption}))
+
+
+# Answers with the first words of the prompt's context. With stream=True it yields the answer
+# word by word, spreading the latency across the chunks.
+
+class FakeGenerationModel:
+
+    def __init__(self, latency: float = 0.0, answer_words: int = 60):
+        self.latency = latency
+        self.answer_words = answer_words
+        self.calls = 0
+
+
+    def _answer(self, prompt: str) -> list:
+        context = prompt.split("CONTEXT:", 1)[-1]
+        return re.findall(r"\w+", context)[:self.answer_words] or ["No", "context"]
+
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        self.calls += 1
+        words = self._answer(prompt)
+
+        if not stream:
+            time.sleep(self.latency)
+            return FakeResponse(" ".join(words))
+
+        def chunks():
+            for word in words:
+                time.sleep(self.latency / len(words))
+                yield FakeResponse(word + " ")
+
+        return chunks()
@@ -1,4 +1,31 @@
-from .imageEmbed import process_and_embed_image, _analyze_image_with_gemini
-from .docEmbed import process_and_embed_document, _extract_text_from_file
+import importlib
 
-print("Ingestion modules imported successfully")
\ No newline at end of file
+
+# Public names and the submodule that defines them. Submodules are imported on first access,
+# so importing one of them (e.g. ingestion.uploads) does not load all the others.
+_EXPORTS = {
+    "process_and_embed_image": ".imageEmbed",
+    "_analyze_image_with_gemini": ".imageEmbed",
+    "process_and_embed_document": ".docEmbed",
+    "embed_document_text": ".docEmbed",
+    "_extract_text_from_file": ".docEmbed",
+    "IngestionJobQueue": ".jobQueue",
+    "QueueFullError": ".jobQueue",
+    "ChunkedUploadStore": ".chunkedUploads",
+    "UploadError": ".chunkedUploads",
+    "VisionCache": ".visionCache",
+    "perceptual_hash": ".visionCache",
+    "SourceManifestStore": ".manifest",
+    "compact_collection": ".manifest",
+}
+
+__all__ = [name for name in _EXPORTS if not name.startswith("_")]
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+
+
+print("Ingestion modules imported successfully")
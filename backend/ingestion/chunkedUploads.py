@@ -0,0 +1,330 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+
+from .uploads import UploadedFile, COPY_BUFFER_SIZE
+
+
+"""
+Chunked, resumable uploads for files too large to send in one request.
+
+    POST   /api/uploads                       {filename, size, part_size?, fingerprint?} -> upload id, part layout
+    PUT    /api/uploads/<upload_id>/parts/<n> raw bytes of part n (0-based)
+    GET    /api/uploads/<upload_id>           parts received so far, to resume
+    POST   /api/uploads/<upload_id>/complete  queues the assembled file for ingestion
+    DELETE /api/uploads/<upload_id>           aborts and removes the parts
+
+Every part is written at its own offset of one preallocated file, so parts can arrive in any order and
+in parallel, and the file is already assembled when the last part lands; completing an upload hands
+that file to the ingestion queue without another copy. Received parts are appended to a log next to
+the file, so an upload resumes where it stopped after a dropped connection or a server restart.
+A client that sends the same fingerprint (e.g. name, size and modification time of the file) for
+an unfinished upload gets that upload back instead of a new one.
+"""
+
+
+UPLOAD_PART_SIZE = int(float(os.getenv("UPLOAD_PART_SIZE_MB", "8")) * 1024 * 1024)
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "1024")) * 1024 * 1024)
+UPLOAD_EXPIRY_SECONDS = float(os.getenv("UPLOAD_EXPIRY_SECONDS", str(24 * 3600)))
+
+MIN_PART_SIZE = 256 * 1024
+MAX_PART_SIZE = 64 * 1024 * 1024
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """Raised for a chunked upload request that cannot be served. Carries the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400, **details):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+class ChunkedUploadStore:
+
+    def __init__(self, root: str = "./temp_uploads/chunked", part_size: int = UPLOAD_PART_SIZE,
+                 max_bytes: int = UPLOAD_MAX_BYTES, expiry_seconds: float = UPLOAD_EXPIRY_SECONDS):
+        self.root = root
+        self.part_size = part_size
+        self.max_bytes = max_bytes
+        self.expiry_seconds = expiry_seconds
+
+        # upload_id -> state, and (collection, fingerprint) -> upload_id for resuming
+        self._uploads = {}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+        self.parts_received = 0
+        self.bytes_received = 0
+        self.resumed = 0
+        self.completed = 0
+
+        os.makedirs(root, exist_ok=True)
+        self._load_existing()
+
+
+    # Starts an upload, or returns the unfinished one with the same fingerprint for this collection
+
+    def create(self, filename: str, size: int, collection_name: str, part_size: int = None,
+               fingerprint: str = None) -> dict:
+
+        if size <= 0:
+            raise UploadError("Upload size must be positive.")
+        if size > self.max_bytes:
+            raise UploadError(f"File is larger than the {self.max_bytes // (1024 * 1024)} MB upload limit.", 413)
+
+        part_size = min(max(int(part_size or self.part_size), MIN_PART_SIZE), MAX_PART_SIZE)
+        self.expire()
+
+        with self._lock:
+            if fingerprint:
+                existing = self._uploads.get(self._fingerprints.get((collection_name, fingerprint)))
+                if existing and existing["filename"] == filename and existing["size"] == size:
+                    existing["updated_at"] = time.time()
+                    self.resumed += 1
+                    print(f" - Resuming upload {existing['upload_id']} of '{filename}' "
+                          f"({len(existing['received'])}/{existing['total_parts']} parts received).")
+                    return self._describe(existing)
+
+            upload_id = uuid.uuid4().hex
+            state = {
+                "upload_id": upload_id,
+                "filename": filename,
+                "size": size,
+                "part_size": part_size,
+                "total_parts": -(-size // part_size),
+                "collection": collection_name,
+                "fingerprint": fingerprint,
+                "created_at": time.time(),
+                "updated_at": time.time(),
+                "received": set(),
+                "completed": False,
+            }
+
+            directory = self._dir(upload_id)
+            os.makedirs(directory, exist_ok=True)
+            # Reserves the whole file up front; parts are written into it at their offsets
+            with open(self._data_path(state), 'wb') as f:
+                f.truncate(size)
+            self._save_meta(state)
+
+            self._uploads[upload_id] = state
+            if fingerprint:
+                self._fingerprints[(collection_name, fingerprint)] = upload_id
+
+        print(f" - Started upload {upload_id} of '{filename}' ({size // 1024} KB in {state['total_parts']} parts).")
+        return self._describe(state)
+
+
+    # Writes part `index` from a binary stream. `checksum` is an optional hex SHA-256 of the part.
+    # A part that was already received is acknowledged without being written again, so a retry whose
+    # first response was lost cannot damage it.
+
+    def write_part(self, upload_id: str, index: int, stream, collection_name: str, checksum: str = None) -> dict:
+        state = self._get(upload_id, collection_name)
+        if state["completed"]:
+            raise UploadError("Upload is already complete.", 409)
+        if index < 0 or index >= state["total_parts"]:
+            raise UploadError(f"Part {index} is out of range (0-{state['total_parts'] - 1}).")
+
+        with self._lock:
+            if index in state["received"]:
+                state["updated_at"] = time.time()
+                return self._describe(state)
+
+        offset = index * state["part_size"]
+        expected = min(state["part_size"], state["size"] - offset)
+        digest = hashlib.sha256() if checksum else None
+        written = 0
+
+        # Every request has its own handle; parts of one upload are written concurrently at distinct offsets
+        with open(self._data_path(state), 'r+b') as f:
+            f.seek(offset)
+            while written <= expected:
+                block = stream.read(min(COPY_BUFFER_SIZE, expected + 1 - written))
+                if not block:
+                    break
+                if written + len(block) > expected:
+                    written += len(block)
+                    break
+                f.write(block)
+                if digest:
+                    digest.update(block)
+                written += len(block)
+
+        if written != expected:
+            raise UploadError(f"Part {index} should be {expected} bytes, received {written}.",
+                              expected_bytes=expected, received_bytes=written)
+        if digest and digest.hexdigest() != checksum.lower():
+            raise UploadError(f"Checksum mismatch for part {index}.", 422)
+
+        with self._lock:
+            if index not in state["received"]:
+                state["received"].add(index)
+                # Logged only after the whole part was written
+                with open(self._parts_path(upload_id), 'a', encoding='utf-8') as log:
+                    log.write(f"{index}\n")
+            state["updated_at"] = time.time()
+            self.parts_received += 1
+            self.bytes_received += written
+            return self._describe(state)
+
+
+    def status(self, upload_id: str, collection_name: str) -> dict:
+        state = self._get(upload_id, collection_name)
+        with self._lock:
+            return self._describe(state)
+
+
+    # Hands the assembled file to `handoff(upload, directory)` and returns what it returns. `upload` is an
+    # UploadedFile over the file; the directory then belongs to the ingestion job, which removes it when
+    # the file is processed. If handoff raises (e.g. QueueFullError) the upload stays open and can be completed later.
+
+    def complete(self, upload_id: str, collection_name: str, handoff):
+        state = self._get(upload_id, collection_name)
+        with self._lock:
+            if state["completed"]:
+                raise UploadError("Upload is already complete.", 409)
+
+            missing = [index for index in range(state["total_parts"]) if index not in state["received"]]
+            if missing:
+                raise UploadError(f"{len(missing)} part(s) have not been received.", 409, missing=missing[:1000])
+
+            result = handoff(UploadedFile(state["filename"], path=self._data_path(state)), self._dir(upload_id))
+
+            state["completed"] = True
+            self._save_meta(state)
+            self._forget(state)
+            self.completed += 1
+
+        print(f" - Upload {upload_id} of '{state['filename']}' complete, handed to ingestion.")
+        return result
+
+
+    def abort(self, upload_id: str, collection_name: str):
+        state = self._get(upload_id, collection_name)
+        with self._lock:
+            self._forget(state)
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+        print(f" - Aborted upload {upload_id} of '{state['filename']}'.")
+
+
+    # Removes uploads that have not received a part for `expiry_seconds`
+
+    def expire(self) -> int:
+        cutoff = time.time() - self.expiry_seconds
+        with self._lock:
+            stale = [state for state in self._uploads.values() if state["updated_at"] < cutoff]
+            for state in stale:
+                self._forget(state)
+
+        for state in stale:
+            shutil.rmtree(self._dir(state["upload_id"]), ignore_errors=True)
+        if stale:
+            print(f" - Removed {len(stale)} expired upload(s).")
+        return len(stale)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active_uploads": len(self._uploads),
+                "parts_received": self.parts_received,
+                "bytes_received": self.bytes_received,
+                "resumed": self.resumed,
+                "completed": self.completed,
+            }
+
+
+    def _get(self, upload_id: str, collection_name: str) -> dict:
+        with self._lock:
+            state = self._uploads.get(upload_id) if _UPLOAD_ID.match(upload_id or "") else None
+        # Uploads of other users are reported as unknown
+        if state is None or state["collection"] != collection_name:
+            raise UploadError(f"Unknown upload id '{upload_id}'", 404)
+        return state
+
+
+    # Callers hold self._lock
+
+    def _forget(self, state: dict):
+        self._uploads.pop(state["upload_id"], None)
+        if state["fingerprint"]:
+            key = (state["collection"], state["fingerprint"])
+            if self._fingerprints.get(key) == state["upload_id"]:
+                del self._fingerprints[key]
+
+
+    def _describe(self, state: dict) -> dict:
+        received = sorted(state["received"])
+        return {
+            "upload_id": state["upload_id"],
+            "filename": state["filename"],
+            "size": state["size"],
+            "part_size": state["part_size"],
+            "total_parts": state["total_parts"],
+            "received_parts": received,
+            "received_bytes": sum(min(state["part_size"], state["size"] - index * state["part_size"]) for index in received),
+            "complete": len(received) == state["total_parts"],
+        }
+
+
+    def _dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, upload_id)
+
+
+    def _data_path(self, state: dict) -> str:
+        return os.path.join(self._dir(state["upload_id"]), "data" + os.path.splitext(state["filename"])[1].lower())
+
+
+    def _parts_path(self, upload_id: str) -> str:
+        return os.path.join(self._dir(upload_id), "parts.log")
+
+
+    def _save_meta(self, state: dict):
+        meta = {key: value for key, value in state.items() if key != "received"}
+        path = os.path.join(self._dir(state["upload_id"]), "upload.json")
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+
+    # Picks up unfinished uploads left by a previous run, so clients can resume them after a restart
+
+    def _load_existing(self):
+        cutoff = time.time() - self.expiry_seconds
+        for upload_id in os.listdir(self.root):
+            directory = self._dir(upload_id)
+            try:
+                with open(os.path.join(directory, "upload.json"), 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            received = set()
+            if os.path.exists(self._parts_path(upload_id)):
+                with open(self._parts_path(upload_id), 'r', encoding='utf-8') as f:
+                    received = {int(line) for line in f if line.strip().isdigit()}
+            state["received"] = received
+            if received:
+                state["updated_at"] = max(state["updated_at"], os.path.getmtime(self._parts_path(upload_id)))
+
+            # Completed uploads belong to ingestion jobs, which remove them when they finish
+            if state["completed"] or state["updated_at"] < cutoff:
+                if state["updated_at"] < cutoff:
+                    shutil.rmtree(directory, ignore_errors=True)
+                continue
+
+            self._uploads[upload_id] = state
+            if state["fingerprint"]:
+                self._fingerprints[(state["collection"], state["fingerprint"])] = upload_id
+
+        if self._uploads:
+            print(f" - Found {len(self._uploads)} unfinished upload(s) to resume.")
@@ -1,91 +1,510 @@
+import io
 import os
-import PyPDF2
-import docx
+import uuid
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.docstore.document import Document
+from langchain_core.documents import Document
+
+from rag_core.metrics import span, timed_iter
+from .manifest import (SourceManifestStore, hash_file, hash_text, make_chunk_id, existing_chunk_ids, delete_chunks,
+                       INGEST_ADDED, INGEST_UPDATED, INGEST_UNCHANGED, INGEST_REPLACED)
 
 
 """
 This  module is used to process a document file (.pdf, .docx, .txt), chunks its text,
 Create embeddings, and stores them in a specified ChromaDB collection.
+
+Documents are processed as a stream: pages or paragraphs are read one at a time, split
+incrementally and written to the vector store in fixed-size batches, so memory stays flat
+on very large files and the first chunks are searchable before the whole file is done.
+Large PDFs are extracted in page ranges on a shared process pool and reassembled in order.
+
+The parsers, the splitter and the Chroma wrapper are imported where they are used, so importing
+this module (and the app) does not pay for them until the first document is ingested.
 """
 
 
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# How much text the incremental splitter buffers before it emits chunks
+SPLIT_BUFFER_SIZE = CHUNK_SIZE * 16
+
+# Plain text files are read in blocks of this many characters
+TEXT_READ_BLOCK = 64 * 1024
+
+# PDFs with fewer pages than this are extracted serially, the pool overhead is not worth it below that
+PARALLEL_PDF_MIN_PAGES = int(os.getenv("PARALLEL_PDF_MIN_PAGES", "32"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+
+# Processes of the shared extraction pool
+EXTRACTION_WORKERS = int(os.getenv("INGEST_CPU_WORKERS", "0")) or os.cpu_count() or 1
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+
 # Splits the processed text from documents into chunks using "RecursiveCharacterTextSplitter", embeds it and stores them in ChromaDB
+# `file_path` can also be a binary stream (an upload held in memory, see ingestion.uploads); `file_name` then gives its name.
+# With a `manifest_store`, re-uploading a file only embeds the chunks that changed (see ingestion.manifest).
+# Returns the ingest status (ingestion.manifest.INGEST_*), or False when the file could not be ingested.
 
-def process_and_embed_document(file_path: str, collection_name: str, chroma_client, embedding_model):
+def process_and_embed_document(file_path, collection_name: str, chroma_client, embedding_model, vector_store=None,
+                               file_name: str = None, manifest_store: SourceManifestStore = None):
 
-    print(f"\n --- Ingesting document: {file_path} ---")
+    file_name = _source_name(file_path, file_name)
+    print(f"\n --- Ingesting document: {file_name} ---")
 
-    full_text = _extract_text_from_file(file_path)
+    content_hash = None
+    if manifest_store is not None:
+        try:
+            content_hash = hash_file(file_path)
+        except OSError as e:
+            print(f" - Could not hash '{file_name}', it will be compared chunk by chunk: {e}")
 
-    if not full_text:
-        print(f" Skipping '{file_path}' due to processing failure ot empty content.")
-        return False
-    
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    text_chunks = text_splitter.split_text(full_text)
-    print(f" - Split document into {len(text_chunks)} chunks.")
-
-    documents = [
-        Document(
-            page_content=chunk,
-            metadata = {"source": os.path.basename(file_path), "type": file_path.split('.')[-1]}
-        ) for chunk in text_chunks
-    ]
+    return embed_document_segments(
+        segments=timed_iter(_iter_text_segments(file_path, file_name), "extraction"),
+        source_name=os.path.basename(file_name),
+        file_type=file_name.split('.')[-1],
+        collection_name=collection_name,
+        chroma_client=chroma_client,
+        embedding_model=embedding_model,
+        vector_store=vector_store,
+        manifest_store=manifest_store,
+        content_hash=content_hash
+    )
 
-    try:
-        print(f" - Storing {len(documents)} chunks in collection '{collection_name}'")
 
-        Chroma.from_documents(
-            documents=documents,
-            embedding=embedding_model,
+
+# Splits already extracted text into chunks, embeds them and stores them in ChromaDB.
+# Kept separate from the extraction so the job queue can run extraction in a worker process.
+# When a long-lived `vector_store` is passed (see rag_core.engine) it is reused instead of building a new wrapper.
+
+def embed_document_text(full_text: str, source_name: str, file_type: str, collection_name: str, chroma_client, embedding_model,
+                        vector_store=None, manifest_store: SourceManifestStore = None):
+
+    return embed_document_segments(
+        segments=iter([full_text]),
+        source_name=source_name,
+        file_type=file_type,
+        collection_name=collection_name,
+        chroma_client=chroma_client,
+        embedding_model=embedding_model,
+        vector_store=vector_store,
+        manifest_store=manifest_store,
+        content_hash=hash_text(full_text)
+    )
+
+
+
+# Streams text segments through the incremental splitter and stores the chunks batch by batch.
+# Each batch is written as soon as it is full, so earlier chunks become searchable while the rest is still being read.
+# Chunk ids are derived from the source and the chunk text: chunks the collection already holds for this source
+# are not embedded again, and once the whole file went through, chunks of the previous version that are gone are deleted.
+
+def embed_document_segments(segments, source_name: str, file_type: str, collection_name: str, chroma_client, embedding_model,
+                            vector_store=None, manifest_store: SourceManifestStore = None, content_hash: str = None):
+
+    if vector_store is None:
+        from langchain_community.vectorstores import Chroma
+        vector_store = Chroma(
+            client=chroma_client,
             collection_name=collection_name,
-            client=chroma_client
+            embedding_function=embedding_model
         )
+    collection = vector_store._collection
+
+    previous = manifest_store.get(collection_name, source_name) if manifest_store is not None else None
+    if previous and content_hash and previous["content_hash"] == content_hash:
+        print(f" - '{source_name}' has not changed since it was last ingested. Nothing to do.")
+        return INGEST_UNCHANGED
+
+    chunk_ids = []
+    chunk_hashes = []
+    occurrences = {}
+    stored_chunks = 0
+    stored_batches = 0
+    kept_chunks = 0
+
+    try:
+        previous_ids = set(previous["chunk_ids"]) if previous else set()
+        previous_ids.update(existing_chunk_ids(collection, source_name))
+
+        print(f" - Streaming chunks into collection '{collection_name}' in batches of {EMBED_BATCH_SIZE}")
+
+        for batch in _iter_batches(_iter_chunks(segments), EMBED_BATCH_SIZE):
+            documents = []
+            document_ids = []
+            kept_ids = []
+            kept_metadatas = []
+
+            for chunk, page in batch:
+                chunk_hash = hash_text(chunk)
+                occurrence = occurrences.get(chunk_hash, 0)
+                occurrences[chunk_hash] = occurrence + 1
+                chunk_id = make_chunk_id(source_name, chunk_hash, occurrence)
+                metadata = _chunk_metadata(source_name, file_type, page, chunk_index=len(chunk_ids))
+
+                chunk_ids.append(chunk_id)
+                chunk_hashes.append(chunk_hash)
+
+                if chunk_id in previous_ids:
+                    kept_ids.append(chunk_id)
+                    kept_metadatas.append(metadata)
+                else:
+                    documents.append(Document(page_content=chunk, metadata=metadata))
+                    document_ids.append(chunk_id)
+
+            if documents:
+                store_documents(vector_store, documents, ids=document_ids)
+                stored_chunks += len(documents)
+                stored_batches += 1
+
+            if kept_ids:
+                # Unchanged chunks keep their vectors, only their metadata (e.g. the page) is refreshed
+                with span("vector_store_write"):
+                    collection.update(ids=kept_ids, metadatas=kept_metadatas)
+                kept_chunks += len(kept_ids)
 
-        print(f" - Successfully Stored embeddings in ChromaDB.")
-        return True
-    
     except Exception as e:
-        print(f" - Error storing the documents in ChromaDB: {e}")
+        print(f" - Error while ingesting '{source_name}' after {stored_chunks} stored chunks: {e}")
+        return False
+
+    if not chunk_ids:
+        print(f" Skipping '{source_name}' due to processing failure ot empty content.")
+        return False
+
+    stale_ids = previous_ids.difference(chunk_ids)
+    try:
+        if stale_ids:
+            with span("vector_store_write"):
+                delete_chunks(collection, stale_ids)
+        if manifest_store is not None:
+            manifest_store.put(collection_name, source_name, content_hash, chunk_ids, chunk_hashes, file_type=file_type)
+    except Exception as e:
+        print(f" - Error while removing superseded chunks of '{source_name}': {e}")
+        return False
 
+    print(f" - Successfully Stored {stored_chunks} chunks in {stored_batches} batch(es) in ChromaDB "
+          f"({kept_chunks} unchanged, {len(stale_ids)} superseded chunks removed).")
 
+    # A revision shares chunks with the version it replaces; a file without any in common is another file
+    # uploaded under the same name
+    if not previous_ids:
+        return INGEST_ADDED
+    if previous and kept_chunks == 0:
+        print(f" - Warning: '{source_name}' shares no content with the file previously stored under this name; "
+              f"its {len(stale_ids)} chunk(s) were replaced.")
+        return INGEST_REPLACED
+    return INGEST_UPDATED
+
+
+
+# Embeds the documents and writes them to the collection as two separately timed stages.
+# Equivalent to vector_store.add_documents, which does both in one call.
+
+def store_documents(vector_store, documents: list, ids: list = None) -> list:
+    texts = [document.page_content for document in documents]
+    metadatas = [document.metadata for document in documents]
+    ids = ids or [str(uuid.uuid4()) for _ in documents]
+
+    with span("embedding"):
+        embeddings = vector_store.embeddings.embed_documents(texts)
+
+    with span("vector_store_write"):
+        vector_store._collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+
+    return ids
+
+
+
+# "chunk" is the position of the chunk in its source, so neighbouring chunks can be recognized at query time
+
+def _chunk_metadata(source_name: str, file_type: str, page: int = None, chunk_index: int = None) -> dict:
+    metadata = {"source": source_name, "type": file_type}
+    # Chroma does not accept None metadata values, so only paged formats carry a page number
+    if page is not None:
+        metadata["page"] = page
+    if chunk_index is not None:
+        metadata["chunk"] = chunk_index
+    return metadata
+
+
+
+# Incremental splitter: buffers segments until there is enough text, splits the buffer and emits
+# every chunk except the last one, which is carried over so chunks keep the same size and overlap
+# as when splitting the whole text at once.
+# Segments are plain strings or (text, page_number) tuples; chunks are yielded as (chunk, page_number)
+# where the page is the one the chunk starts on.
+
+def _iter_chunks(segments, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    buffer = []
+    buffered = 0
+    # (offset in the buffer, page number) for every page that starts inside the buffer
+    page_starts = []
+
+    for segment in segments:
+        text, page = segment if isinstance(segment, tuple) else (segment, None)
+        if not text:
+            continue
+
+        if page is not None and (not page_starts or page_starts[-1][1] != page):
+            page_starts.append((buffered, page))
+        buffer.append(text)
+        buffered += len(text)
+
+        if buffered >= SPLIT_BUFFER_SIZE:
+            with span("splitting"):
+                buffer_text = "".join(buffer)
+                located = _locate_chunks(buffer_text, text_splitter.split_text(buffer_text), page_starts)
+            yield from ((chunk, page) for chunk, page, _ in located[:-1])
+
+            if located:
+                carry, carry_page, carry_offset = located[-1]
+            else:
+                carry, carry_page, carry_offset = "", None, buffered
+
+            # Re-base the page offsets on the carried-over chunk
+            later_pages = [(offset - carry_offset, page) for offset, page in page_starts if offset > carry_offset]
+            page_starts = ([(0, carry_page)] if carry_page is not None else []) + later_pages
+            buffer = [carry]
+            buffered = len(carry)
+
+    if buffered:
+        with span("splitting"):
+            buffer_text = "".join(buffer)
+            located = _locate_chunks(buffer_text, text_splitter.split_text(buffer_text), page_starts)
+        yield from ((chunk, page) for chunk, page, _ in located)
 
 
-# Extraces text from the given document (.pdf, .docx, .txt)
 
-def _extract_text_from_file(file_path: str) -> str:
-    text = ""
+# Finds where each chunk starts in the text it was split from and which page that offset belongs to.
+# Chunks overlap, so each search starts just after the previous chunk's start.
+# Returns (chunk, page_number, offset) tuples.
+
+def _locate_chunks(text: str, chunks: list, page_starts: list) -> list:
+    located = []
+    cursor = 0
+    page_index = 0
+    page = page_starts[0][1] if page_starts else None
+
+    for chunk in chunks:
+        offset = text.find(chunk, cursor)
+        if offset == -1:
+            offset = cursor
+        cursor = offset + 1
+
+        while page_index + 1 < len(page_starts) and page_starts[page_index + 1][0] <= offset:
+            page_index += 1
+            page = page_starts[page_index][1]
+
+        located.append((chunk, page, offset))
+
+    return located
+
+
+
+def _iter_batches(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+
+def _source_name(file_path, file_name: str = None) -> str:
+    if file_name:
+        return file_name
+    if isinstance(file_path, str):
+        return file_path
+    return getattr(file_path, "name", "upload")
+
+
+
+# Reads the given document (.pdf, .docx, .txt) one page, paragraph or block at a time.
+# PDF pages are yielded as (text, page_number) so chunks can carry the page they come from.
+# `file_path` is a path or a binary stream; the type is taken from `file_name` when given.
+
+def _iter_text_segments(file_path, file_name: str = None):
+
+    file_name = _source_name(file_path, file_name).lower()
+    extracted = 0
 
     try:
-        if file_path.endswith('.pdf'):
-            with open(file_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text+=page_text
-        
-        elif file_path.endswith('.docx'):
+        if file_name.endswith('.pdf'):
+            for page_number, page_text in _iter_pdf_pages(file_path):
+                if page_text:
+                    extracted += len(page_text)
+                    yield (page_text, page_number)
+
+        elif file_name.endswith('.docx'):
+            import docx
             doc = docx.Document(file_path)
             for para in doc.paragraphs:
-                text += para.text + "\n"
-        
-        elif file_path.endswith('.txt'):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-
-        if not text.strip():
-            print(f" - Warning: Extracted text is empty. It might be a scanned document.")
-            return None
-    
-        print(f" - Successfully extracted {len(text)} cgaracters from '{os.path.basename(file_path)}'.")
-        return text
-    
+                extracted += len(para.text) + 1
+                yield para.text + "\n"
+
+        elif file_name.endswith('.txt'):
+            if isinstance(file_path, str):
+                f = open(file_path, 'r', encoding='utf-8')
+            else:
+                f = io.TextIOWrapper(file_path, encoding='utf-8')
+            with f:
+                while True:
+                    block = f.read(TEXT_READ_BLOCK)
+                    if not block:
+                        break
+                    extracted += len(block)
+                    yield block
+
     except Exception as e:
         print(f" - Error extracting text from the file {e}")
+        raise
+
+    if extracted == 0:
+        print(f" - Warning: Extracted text is empty. It might be a scanned document.")
+    else:
+        print(f" - Successfully extracted {extracted} cgaracters from '{os.path.basename(file_name)}'.")
+
+
+
+# Yields (page_number, text) for every page, in order. Page numbers start at 1.
+# Small PDFs are read serially; from PARALLEL_PDF_MIN_PAGES pages on, page ranges are
+# extracted on the shared process pool. Page count, not file size, decides: a long text-only
+# PDF is often small enough to stay in memory as an upload.
+
+def _iter_pdf_pages(file_path):
+    import PyPDF2
+
+    if isinstance(file_path, str):
+        with open(file_path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            page_count = len(reader.pages)
+            if page_count < PARALLEL_PDF_MIN_PAGES:
+                for index, page in enumerate(reader.pages):
+                    yield index + 1, page.extract_text()
+                return
+    else:
+        reader = PyPDF2.PdfReader(file_path)
+        page_count = len(reader.pages)
+        if page_count < PARALLEL_PDF_MIN_PAGES:
+            for index, page in enumerate(reader.pages):
+                yield index + 1, page.extract_text()
+            return
+
+    print(f" - Extracting {page_count} pages in parallel ({PDF_PAGES_PER_TASK} pages per task).")
+    if isinstance(file_path, str):
+        yield from _iter_pdf_pages_parallel(file_path, page_count)
+        return
+
+    # Worker processes open the PDF by path, so an upload held in memory is written out once for them
+    spilled = _spill_to_temp_file(file_path, suffix=".pdf")
+    try:
+        yield from _iter_pdf_pages_parallel(spilled, page_count)
+    finally:
+        try:
+            os.remove(spilled)
+        except OSError as e:
+            print(f" - Warning: Could not delete temporary file '{spilled}': {e}")
+
+
+
+def _spill_to_temp_file(stream, suffix: str = "") -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="glimpse-extract-")
+    with os.fdopen(fd, 'wb') as f:
+        if hasattr(stream, "getbuffer"):
+            f.write(stream.getbuffer())
+        else:
+            stream.seek(0)
+            for block in iter(lambda: stream.read(1024 * 1024), b""):
+                f.write(block)
+    return path
+
+
+
+def _iter_pdf_pages_parallel(file_path: str, page_count: int):
+
+    ranges = deque((start, min(start + PDF_PAGES_PER_TASK, page_count)) for start in range(0, page_count, PDF_PAGES_PER_TASK))
+    next_page = 0
+
+    try:
+        pool = get_extraction_pool()
+        # Only keep a few ranges in flight, so memory stays bounded on very large files
+        max_in_flight = EXTRACTION_WORKERS * 2
+        futures = deque()
+
+        while ranges or futures:
+            while ranges and len(futures) < max_in_flight:
+                start, end = ranges.popleft()
+                futures.append(pool.submit(_extract_pdf_page_range, file_path, start, end))
+
+            for page_number, page_text in futures.popleft().result():
+                yield page_number, page_text
+                next_page = page_number
+
+    except BrokenProcessPool as e:
+        print(f" - Extraction pool failed ({e}), extracting the remaining pages serially.")
+        _reset_extraction_pool()
+        yield from _extract_pdf_page_range(file_path, next_page, page_count)
+
+
+
+# Runs in a worker process: opens the PDF and extracts pages [start, end)
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> list:
+    import PyPDF2
+
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [(index + 1, reader.pages[index].extract_text()) for index in range(start, end)]
+
+
+
+# Process pool shared by everything that extracts text in this process. Created on first use,
+# so importing the module never forks workers.
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    global _extraction_pool
+
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+        return _extraction_pool
+
+
+def _reset_extraction_pool():
+    global _extraction_pool
+
+    with _extraction_pool_lock:
+        if _extraction_pool is not None:
+            _extraction_pool.shutdown(wait=False)
+        _extraction_pool = None
+
+
+
+# Extraces text from the given document (.pdf, .docx, .txt)
+
+def _extract_text_from_file(file_path, file_name: str = None) -> str:
+    try:
+        text = "".join(segment[0] if isinstance(segment, tuple) else segment
+                       for segment in _iter_text_segments(file_path, file_name))
+    except Exception:
         return None
-        
+
+    if not text.strip():
+        return None
+
+    return text
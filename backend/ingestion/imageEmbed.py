@@ -1,28 +1,60 @@
 import os
+import io
 import json
-from PIL import Image
-import time
+import hashlib
 
+from langchain_core.documents import Document
 
-from langchain_community.vectorstores import Chroma
-from langchain.docstore.document import Document
+from rag_core.rate_limiter import call_with_rate_limit, is_rate_limit_error
+from rag_core.metrics import span
+from .docEmbed import store_documents
+from .visionCache import VisionCache, perceptual_hash
+from .manifest import (SourceManifestStore, hash_file, hash_text, make_chunk_id, existing_chunk_ids, delete_chunks,
+                       INGEST_ADDED, INGEST_UPDATED, INGEST_UNCHANGED, INGEST_REPLACED)
 
 
 """
 Analyzes an image file, creates an embedding from its content,
 and stores it in a specified ChromaDB collection.
+
+Images are downscaled and re-encoded as JPEG before they are sent to Gemini, and with a
+VisionCache, identical images and near-duplicates of photographs reuse an earlier analysis instead.
 """
 
+
+# Longest side sent to the vision model; larger images are downscaled, smaller ones are left as they are
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1536"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+
 # Gets the content of the image, embeds it and stores it in vector database
+# `file_path` can also be a binary stream (an upload held in memory); `file_name` then gives its name.
+# Re-uploading an image replaces the chunk stored for the previous version of that file.
+# Returns the ingest status (ingestion.manifest.INGEST_*), or False when the image could not be ingested.
+
+def process_and_embed_image(file_path, collection_name: str, chroma_client, embedding_model, vision_model,
+                            vector_store=None, vision_cache: VisionCache = None, file_name: str = None,
+                            manifest_store: SourceManifestStore = None):
+
+    file_name = file_name or (file_path if isinstance(file_path, str) else getattr(file_path, "name", "upload"))
+    source_name = os.path.basename(file_name)
+    print(f"\n--- Ingesting image: {file_name} ---")
 
-def process_and_embed_image(file_path: str, collection_name: str, chroma_client, embedding_model, vision_model):
+    content_hash = None
+    if manifest_store is not None:
+        try:
+            content_hash = hash_file(file_path)
+        except OSError as e:
+            print(f" - Could not hash '{file_name}': {e}")
 
-    print(f"\n--- Ingesting image: {file_path} ---")
+        previous = manifest_store.get(collection_name, source_name)
+        if previous and content_hash and previous["content_hash"] == content_hash:
+            print(f" - '{source_name}' has not changed since it was last ingested. Nothing to do.")
+            return INGEST_UNCHANGED
 
-    analysis_result = _analyze_image_with_gemini(file_path, vision_model)
+    analysis_result = _analyze_image_with_gemini(file_path, vision_model, vision_cache)
 
     if not analysis_result or not analysis_result.get('content'):
-        print(f" Skipping '{file_path}' due to analysis failure or empty content.")
+        print(f" Skipping '{file_name}' due to analysis failure or empty content.")
         return False
     
     content_type = analysis_result.get('type', 'image')
@@ -32,31 +64,61 @@ def process_and_embed_image(file_path: str, collection_name: str, chroma_client,
     document = Document(
         page_content=content_text,
         metadata={
-            "source": os.path.basename(file_path),
+            "source": source_name,
             "type": content_type
         }
     )
 
     try:
-        print(f" - Storing embedding for '{file_path}' in collection '{collection_name}'")
-        Chroma.from_documents(
-            documents=[document],
-            embedding=embedding_model,
-            collection_name=collection_name,
-            client=chroma_client
-        )
+        print(f" - Storing embedding for '{file_name}' in collection '{collection_name}'")
+        if vector_store is None:
+            from langchain_community.vectorstores import Chroma
+            vector_store = Chroma(
+                client=chroma_client,
+                collection_name=collection_name,
+                embedding_function=embedding_model
+            )
+        collection = vector_store._collection
+
+        chunk_hash = hash_text(content_text)
+        chunk_id = make_chunk_id(source_name, chunk_hash)
+        previous_ids = set(existing_chunk_ids(collection, source_name))
+
+        if not previous_ids:
+            status = INGEST_ADDED
+        elif chunk_id in previous_ids:
+            status = INGEST_UPDATED
+            print(" - The analysis did not change, keeping the stored embedding.")
+        else:
+            # An image has a single chunk, so any other analysis means other content under the same name
+            status = INGEST_REPLACED
+            print(f" - Warning: '{source_name}' shows something else than the image previously stored under this name; "
+                  f"it replaces it.")
+
+        if status != INGEST_UPDATED:
+            store_documents(vector_store, [document], ids=[chunk_id])
+
+        previous_ids.discard(chunk_id)
+        if previous_ids:
+            delete_chunks(collection, previous_ids)
+        if manifest_store is not None:
+            manifest_store.put(collection_name, source_name, content_hash, [chunk_id], [chunk_hash],
+                               content_type=content_type)
 
         print(f" - Successfully stored embedding in ChromaDB.")
-        return True
+        return status
     
     except Exception as e:
         print(f" - Error storing document in ChromaDB: {e}")
+        return False
 
 
 
 # Analyzes the image with help of gemini 
 
-def _analyze_image_with_gemini(image_path: str, vision_model) -> dict:
+def _analyze_image_with_gemini(image_path, vision_model, vision_cache: VisionCache = None) -> dict:
+
+    from PIL import Image
 
     img = None
     try:
@@ -66,6 +128,17 @@ def _analyze_image_with_gemini(image_path: str, vision_model) -> dict:
         return None
 
     try:
+        with span("image_preprocess"):
+            image_bytes, image_hash = _prepare_image(img)
+        content_hash = hashlib.sha256(image_bytes).hexdigest()
+
+        model_name = getattr(vision_model, "model_name", type(vision_model).__name__)
+        if vision_cache is not None:
+            cached = vision_cache.get(model_name, image_hash, content_hash)
+            if cached:
+                print(" - Reusing the analysis of an identical or near-identical image.")
+                return cached
+
         prompt = """
         Analyze the image and respond in a JSON format.
         - If it is a photograph/illustration, set 'type' to 'photograph' and 'content' to a descriptive caption.
@@ -73,39 +146,73 @@ def _analyze_image_with_gemini(image_path: str, vision_model) -> dict:
         Your entire response must be only the JSON object.
         """
 
-        max_retries = 3
-        delay = 5
-
-        for attempt in range(max_retries):
-            try:
-                response = vision_model.generate_content([prompt, img])
-                response_text = response.text.strip()
-
-                if "```json" in response_text:
-                    response_text = response_text.split("```json")[1].split("```")[0].strip()
-
-                result = json.loads(response_text)
-                return result
-            
-            except json.JSONDecodeError:
-                print(f" - JSON parsing error. Raw response: {response_text[:200]}...")
-                return None
-            
-            except Exception as e:
-                if "429" in str(e):
-                    print(f" - Rate limit hit. Retrying in {delay}s... (Attempt {attempt+1}/{max_retries})")
-                    time.sleep(delay)
-                    delay*=2
-
-                else:
-                    print(f" - An unexpected error occured during analysis: {e}")
-                    return None
-                
-        print(f" - Failed to get a response after {max_retries} attempts.")
-        return None
+        response_text = ""
+
+        try:
+            # Pacing and 429 backoff are handled by the limiter shared with embedding and generation calls
+            with span("vision"):
+                response = call_with_rate_limit(
+                    vision_model.generate_content,
+                    [prompt, {"mime_type": "image/jpeg", "data": image_bytes}]
+                )
+            response_text = response.text.strip()
+
+            if "```json" in response_text:
+                response_text = response_text.split("```json")[1].split("```")[0].strip()
+
+            result = json.loads(response_text)
+
+            if vision_cache is not None and isinstance(result, dict) and result.get('content'):
+                vision_cache.put(model_name, image_hash, result, content_hash)
+            return result
+        
+        except json.JSONDecodeError:
+            print(f" - JSON parsing error. Raw response: {response_text[:200]}...")
+            return None
+        
+        except Exception as e:
+            if is_rate_limit_error(e):
+                print(f" - Failed to get a response, rate limit retries exhausted: {e}")
+            else:
+                print(f" - An unexpected error occured during analysis: {e}")
+            return None
     
     finally:
         # Always close the image to release file handle
         if img is not None:
             img.close()
-            print(" - Image file handle closed.")
\ No newline at end of file
+            print(" - Image file handle closed.")
+
+
+
+# Returns (jpeg_bytes, perceptual_hash) for the image: applies the EXIF orientation, flattens transparency
+# onto white, downscales to VISION_MAX_SIDE and re-encodes as JPEG.
+# A PIL image opened from a file would otherwise be uploaded with its original bytes.
+
+def _prepare_image(img) -> tuple:
+    from PIL import Image, ImageOps
+
+    # Lets the JPEG decoder scale down while decoding, much cheaper than decoding at full size
+    img.draft("RGB", (VISION_MAX_SIDE, VISION_MAX_SIDE))
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        flattened = Image.new("RGB", rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.split()[-1])
+        img = flattened
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    image_hash = perceptual_hash(img)
+
+    original_size = img.size
+    if max(img.size) > VISION_MAX_SIDE:
+        img.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    image_bytes = buffer.getvalue()
+
+    print(f" - Prepared image {original_size[0]}x{original_size[1]} -> {img.size[0]}x{img.size[1]}, {len(image_bytes) // 1024} KB.")
+    return image_bytes, image_hash
@@ -0,0 +1,224 @@
+import os
+import uuid
+import time
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .docEmbed import _reset_extraction_pool
+from .uploads import UploadedFile
+from .manifest import INGEST_REPLACED, INGEST_UNCHANGED
+
+
+"""
+Runs batch ingestion in the background so upload requests can return a job id right away.
+Every file is handled on a bounded thread pool, which covers the Gemini-bound work (vision
+analysis and embedding). CPU-bound PDF text extraction is handed from there to the shared
+process pool in docEmbed, in page ranges.
+"""
+
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg']
+DOC_EXTENSIONS = ['.pdf', '.docx', '.txt']
+
+
+class QueueFullError(Exception):
+    """Raised when accepting a job would exceed the number of pending files allowed."""
+
+
+# Message for a successfully ingested file, given the ingest status returned by the engine
+
+def ingest_message(filename: str, status) -> str:
+    if status == INGEST_REPLACED:
+        return (f"File '{filename}' processed successfully. It replaced the earlier file with the same name, "
+                f"which had nothing in common with it.")
+    if status == INGEST_UNCHANGED:
+        return f"File '{filename}' is unchanged since it was last uploaded."
+    return f"File '{filename}' processed successfully."
+
+
+class IngestionJobQueue:
+
+    # `engine` is the long-lived rag_core.engine.RetrievalEngine that owns the collections and model clients
+
+    def __init__(self, engine, upload_root: str = "./temp_uploads", max_io_workers: int = 4,
+                 max_pending_files: int = 500, max_finished_jobs: int = 200):
+
+        self.engine = engine
+        self.upload_root = upload_root
+        self.max_pending_files = max_pending_files
+        self.max_finished_jobs = max_finished_jobs
+
+        self._io_pool = ThreadPoolExecutor(max_workers=max_io_workers, thread_name_prefix="ingest-io")
+
+        self._jobs = OrderedDict()
+        self._pending_files = 0
+        self._lock = threading.Lock()
+
+
+    # Reserves a directory that only belongs to this job for uploads too large to keep in memory.
+    # It is only created once something is spooled into it.
+
+    def new_job_dir(self) -> tuple:
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.upload_root, job_id)
+        return job_id, job_dir
+
+
+    # Drops a job that was never submitted (e.g. the queue was full): closes its uploads and removes its directory.
+
+    def discard_job(self, job_dir: str, saved_files: list):
+        for _, upload in saved_files:
+            if upload is not None:
+                upload.close()
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+    # Registers a job for files that were already read from the request and schedules every file on the pool.
+    # `saved_files` is a list of (filename, UploadedFile) tuples; the upload is None for files that were rejected up front.
+
+    def submit(self, job_id: str, job_dir: str, saved_files: list, collection_name: str = None) -> dict:
+
+        with self._lock:
+            if self._pending_files + len(saved_files) > self.max_pending_files:
+                raise QueueFullError(
+                    f"Ingestion queue is full ({self._pending_files} files pending). Try again later."
+                )
+            self._pending_files += len(saved_files)
+
+            job = {
+                "job_id": job_id,
+                "status": "queued",
+                "created_at": time.time(),
+                "finished_at": None,
+                "total": len(saved_files),
+                "processed": 0,
+                "successful": 0,
+                "failed": 0,
+                "results": [
+                    {"filename": filename, "status": "queued"} for filename, _ in saved_files
+                ],
+                "_dir": job_dir,
+                "_collection": collection_name,
+            }
+            self._jobs[job_id] = job
+            self._evict_finished_jobs()
+
+        print(f" - Queued ingestion job {job_id} with {len(saved_files)} file(s).")
+
+        for index, (filename, upload) in enumerate(saved_files):
+            self._io_pool.submit(self._run_file, job_id, index, filename, upload)
+
+        return self.get_job(job_id)
+
+
+    # Returns a copy of the job that is safe to serialize
+
+    def get_job(self, job_id: str) -> dict:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = {key: value for key, value in job.items() if not key.startswith("_")}
+            snapshot["results"] = [dict(result) for result in job["results"]]
+            return snapshot
+
+
+    def list_jobs(self) -> list:
+        with self._lock:
+            return [
+                {key: job[key] for key in ("job_id", "status", "created_at", "finished_at",
+                                           "total", "processed", "successful", "failed")}
+                for job in self._jobs.values()
+            ]
+
+
+    def shutdown(self, wait: bool = False):
+        self._io_pool.shutdown(wait=wait)
+        _reset_extraction_pool()
+
+
+    # Processes a single file of a job. Runs on the I/O thread pool.
+
+    def _run_file(self, job_id: str, index: int, filename: str, upload: UploadedFile):
+
+        self._update_file(job_id, index, status="processing")
+        with self._lock:
+            collection_name = self._jobs[job_id]["_collection"]
+        file_ext = os.path.splitext(filename)[1].lower()
+        success = False
+        error_message = None
+
+        try:
+            if upload is None:
+                error_message = f"Unsupported file type: {file_ext}"
+
+            elif file_ext in IMAGE_EXTENSIONS:
+                self._update_file(job_id, index, status="analyzing")
+                success = self.engine.ingest_image(upload.open_source(), collection_name=collection_name,
+                                                   file_name=filename)
+
+            elif file_ext in DOC_EXTENSIONS:
+                # Extraction and embedding are streamed; large PDFs are extracted on the process pool
+                self._update_file(job_id, index, status="ingesting")
+                success = self.engine.ingest_document(upload.open_source(), collection_name=collection_name,
+                                                      file_name=filename)
+
+            else:
+                error_message = f"Unsupported file type: {file_ext}"
+
+        except Exception as e:
+            print(f"❌ Error processing {filename}: {str(e)}")
+            error_message = str(e)
+            success = False
+
+        finally:
+            if upload is not None:
+                upload.close()
+
+        if success:
+            self._finish_file(job_id, index, status="success", ingest_status=success,
+                              message=ingest_message(filename, success))
+        else:
+            self._finish_file(job_id, index, status="failed",
+                              error=error_message or f"Failed to process '{filename}'")
+
+
+    def _update_file(self, job_id: str, index: int, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["results"][index].update(fields)
+            if job["status"] == "queued":
+                job["status"] = "running"
+
+
+    def _finish_file(self, job_id: str, index: int, **fields):
+        with self._lock:
+            self._pending_files -= 1
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+
+            job["results"][index].update(fields)
+            job["processed"] += 1
+            if fields.get("status") == "success":
+                job["successful"] += 1
+            else:
+                job["failed"] += 1
+
+            if job["processed"] == job["total"]:
+                job["status"] = "completed" if job["failed"] == 0 else "completed_with_errors"
+                job["finished_at"] = time.time()
+                shutil.rmtree(job["_dir"], ignore_errors=True)
+                print(f" - Ingestion job {job_id} finished: {job['successful']} succeeded, {job['failed']} failed.")
+
+
+    # Keeps the job table bounded by dropping the oldest finished jobs
+
+    def _evict_finished_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        while len(self._jobs) > self.max_finished_jobs and finished:
+            self._jobs.pop(finished.pop(0), None)
@@ -0,0 +1,386 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+"""
+Per-source manifests for incremental re-ingestion.
+A manifest records, for every (collection, source file), the hash of the file's content and the
+ids and hashes of the chunks it produced. Chunk ids are derived from the source and the chunk text,
+so re-uploading a revised document only embeds the chunks that changed and deletes the ones that
+are gone. compact_collection() cleans up duplicates left in a collection from before manifests existed.
+
+A source is identified by its file name within a collection, so uploading a different file under the name of
+an earlier one replaces it. Ingestion reports that as INGEST_REPLACED (no chunk in common with the previous
+version) rather than as a revision, and logs a warning.
+
+Every collection also has a version in the manifest database, bumped by every write. Processes that cache
+answers (every server worker) compare it to the version they last saw, so a write made by another process,
+e.g. `python manage.py compact`, invalidates their caches too.
+
+The manifests double as the metadata index of a collection. They hold the file type, media (document or
+image), content type and upload time of every source; the content type is the `type` metadata written on
+the chunks (the file type of a document, `photograph` or `document` for an analysed image). From them
+resolve_filters() turns a query's source/type/upload-time filters into the ids of the chunks to search,
+and describe_sources() lists the sources, without touching the vector store.
+"""
+
+
+# Chroma caps how many ids one get/delete call should carry
+ID_BATCH_SIZE = 500
+
+IMAGE_FILE_TYPES = ("png", "jpg", "jpeg")
+
+# Query filters understood by resolve_filters(); sources and types are lists, the times epoch seconds
+FILTER_KEYS = ("sources", "types", "uploaded_after", "uploaded_before")
+
+# What ingesting a file did to the collection, returned by the ingestion functions on success
+INGEST_ADDED = "added"
+INGEST_UPDATED = "updated"
+INGEST_UNCHANGED = "unchanged"
+INGEST_REPLACED = "replaced"
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# Stable id of a chunk: the same text from the same source always gets the same id.
+# `occurrence` separates identical chunks that appear more than once in one source.
+
+def make_chunk_id(source_name: str, chunk_hash: str, occurrence: int = 0) -> str:
+    chunk_id = f"{hash_text(source_name)[:16]}-{chunk_hash[:40]}"
+    return f"{chunk_id}-{occurrence}" if occurrence else chunk_id
+
+
+# Hash of a whole file, given as a path or a binary stream (the stream is rewound afterwards)
+
+def hash_file(file_path) -> str:
+    digest = hashlib.sha256()
+
+    if isinstance(file_path, str):
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    if hasattr(file_path, "getbuffer"):
+        digest.update(file_path.getbuffer())
+        return digest.hexdigest()
+
+    position = file_path.tell()
+    for block in iter(lambda: file_path.read(1024 * 1024), b""):
+        digest.update(block)
+    file_path.seek(position)
+    return digest.hexdigest()
+
+
+
+class SourceManifestStore:
+
+    def __init__(self, path: str = "./source_manifests.sqlite3"):
+        self.path = path
+
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS manifests (
+                collection TEXT NOT NULL,
+                source TEXT NOT NULL,
+                content_hash TEXT,
+                chunk_ids TEXT NOT NULL,
+                chunk_hashes TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (collection, source)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS collection_versions (collection TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        self._migrate()
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_manifests_uploaded ON manifests(collection, uploaded_at)")
+        self._conn.commit()
+
+
+    # Index columns added after the first release; existing rows are filled in from what they already hold.
+    # An image's content type only comes from its analysis, so it stays empty until the image is re-ingested or compacted.
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(manifests)")}
+        added = []
+        for column, column_type in (("file_type", "TEXT"), ("media", "TEXT"), ("chunk_count", "INTEGER"),
+                                    ("uploaded_at", "REAL"), ("content_type", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE manifests ADD COLUMN {column} {column_type}")
+                added.append(column)
+        if not added:
+            return
+
+        if "file_type" in added:
+            rows = self._conn.execute("SELECT collection, source, chunk_ids, updated_at FROM manifests").fetchall()
+            self._conn.executemany(
+                "UPDATE manifests SET file_type = ?, media = ?, chunk_count = ?, uploaded_at = ? WHERE collection = ? AND source = ?",
+                [
+                    (file_type_of(source), media_of(file_type_of(source)), len(json.loads(chunk_ids)), updated_at, collection, source)
+                    for collection, source, chunk_ids, updated_at in rows
+                ]
+            )
+        # Chunks of a document carry its file type as their `type`
+        self._conn.execute("UPDATE manifests SET content_type = file_type WHERE content_type IS NULL AND media = 'document'")
+        print(f" - Added the metadata index column(s) {', '.join(added)} to the source manifests.")
+
+
+    # Returns {"content_hash", "chunk_ids", "chunk_hashes", "updated_at"} or None
+
+    def get(self, collection_name: str, source_name: str) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, chunk_ids, chunk_hashes, updated_at FROM manifests WHERE collection = ? AND source = ?",
+                (collection_name, source_name)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return {
+            "content_hash": row[0],
+            "chunk_ids": json.loads(row[1]),
+            "chunk_hashes": json.loads(row[2]),
+            "updated_at": row[3],
+        }
+
+
+    # `file_type` defaults to the source name's extension, `content_type` to the file type for documents.
+    # The upload time is kept when the manifest is only rebuilt (no content hash, see compact_collection).
+
+    def put(self, collection_name: str, source_name: str, content_hash: str, chunk_ids: list, chunk_hashes: list,
+            file_type: str = None, content_type: str = None):
+
+        file_type = (file_type or file_type_of(source_name) or "").lower() or None
+        if content_type is None and media_of(file_type) == "document":
+            content_type = file_type
+        content_type = (content_type or "").lower() or None
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO manifests (collection, source, content_hash, chunk_ids, chunk_hashes, updated_at,
+                                       file_type, media, content_type, chunk_count, uploaded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(collection, source) DO UPDATE SET
+                    content_hash = excluded.content_hash,
+                    chunk_ids = excluded.chunk_ids,
+                    chunk_hashes = excluded.chunk_hashes,
+                    updated_at = excluded.updated_at,
+                    file_type = COALESCE(excluded.file_type, manifests.file_type),
+                    media = COALESCE(excluded.media, manifests.media),
+                    content_type = COALESCE(excluded.content_type, manifests.content_type),
+                    chunk_count = excluded.chunk_count,
+                    uploaded_at = CASE WHEN excluded.content_hash IS NULL AND manifests.uploaded_at IS NOT NULL
+                                       THEN manifests.uploaded_at ELSE excluded.uploaded_at END
+                """,
+                (collection_name, source_name, content_hash, json.dumps(chunk_ids), json.dumps(chunk_hashes), now,
+                 file_type, media_of(file_type), content_type, len(chunk_ids), now)
+            )
+            self._conn.commit()
+
+
+    def delete(self, collection_name: str, source_name: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM manifests WHERE collection = ? AND source = ?", (collection_name, source_name))
+            self._conn.commit()
+
+
+    def list_sources(self, collection_name: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source FROM manifests WHERE collection = ? ORDER BY source", (collection_name,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+    # Returns [{"source", "type", "media", "content_type", "chunks", "uploaded_at"}] of the sources matching `filters`
+
+    def describe_sources(self, collection_name: str, filters: dict = None) -> list:
+        clause, params = _filter_clause(filters or {})
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT source, file_type, media, content_type, chunk_count, uploaded_at FROM manifests "
+                f"WHERE collection = ?{clause} ORDER BY source", [collection_name] + params
+            ).fetchall()
+
+        return [
+            {"source": source, "type": file_type, "media": media, "content_type": content_type,
+             "chunks": chunk_count, "uploaded_at": uploaded_at}
+            for source, file_type, media, content_type, chunk_count, uploaded_at in rows
+        ]
+
+
+    # Returns {"sources": [...], "chunk_ids": [...]} of the sources matching `filters` (see FILTER_KEYS)
+
+    def resolve_filters(self, collection_name: str, filters: dict) -> dict:
+        clause, params = _filter_clause(filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT source, chunk_ids FROM manifests WHERE collection = ?{clause} ORDER BY source",
+                [collection_name] + params
+            ).fetchall()
+
+        chunk_ids = []
+        for _, ids in rows:
+            chunk_ids.extend(json.loads(ids))
+        return {"sources": [source for source, _ in rows], "chunk_ids": chunk_ids}
+
+
+    # Shared across processes through the database, see the module docstring
+
+    def version(self, collection_name: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM collection_versions WHERE collection = ?", (collection_name,)
+            ).fetchone()
+        return row[0] if row else 0
+
+
+    def bump_version(self, collection_name: str) -> int:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO collection_versions (collection, version) VALUES (?, 1)
+                ON CONFLICT(collection) DO UPDATE SET version = collection_versions.version + 1
+                """,
+                (collection_name,)
+            )
+            self._conn.commit()
+            return self._conn.execute(
+                "SELECT version FROM collection_versions WHERE collection = ?", (collection_name,)
+            ).fetchone()[0]
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+
+def file_type_of(source_name: str) -> str:
+    _, extension = os.path.splitext(source_name or "")
+    return extension[1:].lower() or None
+
+
+def media_of(file_type: str) -> str:
+    return "image" if file_type in IMAGE_FILE_TYPES else "document"
+
+
+
+# SQL condition (and its parameters) for the filters; a type matches the file type, the media or the
+# content type, so "document" also finds screenshots the vision model read as documents
+
+def _filter_clause(filters: dict):
+    conditions = []
+    params = []
+
+    if filters.get("sources"):
+        conditions.append(f"source IN ({','.join('?' * len(filters['sources']))})")
+        params.extend(filters["sources"])
+    if filters.get("types"):
+        types = [file_type.lower().lstrip(".") for file_type in filters["types"]]
+        placeholders = ",".join("?" * len(types))
+        conditions.append(f"(file_type IN ({placeholders}) OR media IN ({placeholders}) OR content_type IN ({placeholders}))")
+        params.extend(types * 3)
+    if filters.get("uploaded_after") is not None:
+        conditions.append("uploaded_at >= ?")
+        params.append(filters["uploaded_after"])
+    if filters.get("uploaded_before") is not None:
+        conditions.append("uploaded_at < ?")
+        params.append(filters["uploaded_before"])
+
+    return "".join(f" AND {condition}" for condition in conditions), params
+
+
+
+# Ids of every chunk a collection holds for one source, including chunks stored before manifests existed
+
+def existing_chunk_ids(collection, source_name: str) -> list:
+    return collection.get(where={"source": source_name}, include=[])["ids"]
+
+
+def delete_chunks(collection, chunk_ids) -> int:
+    chunk_ids = list(chunk_ids)
+    for start in range(0, len(chunk_ids), ID_BATCH_SIZE):
+        collection.delete(ids=chunk_ids[start:start + ID_BATCH_SIZE])
+    return len(chunk_ids)
+
+
+
+# Maintenance: removes chunks whose (source, text) already exists under another id and rebuilds
+# the manifests from what is left. With `dry_run` it only reports what it would delete.
+# The content hash of rebuilt manifests is cleared, so the next upload of each file is compared chunk by chunk.
+
+def compact_collection(collection, manifest_store: SourceManifestStore = None, dry_run: bool = False,
+                       page_size: int = 1000) -> dict:
+
+    collection_name = collection.name
+    print(f"\n --- Compacting collection '{collection_name}' ---")
+
+    seen = {}
+    duplicates = []
+    kept = {}
+    content_types = {}
+    scanned = 0
+    offset = 0
+
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        ids = page["ids"]
+        if not ids:
+            break
+
+        for chunk_id, text, metadata in zip(ids, page["documents"], page["metadatas"]):
+            source_name = (metadata or {}).get("source") or ""
+            chunk_hash = hash_text(text or "")
+            key = (source_name, chunk_hash, (metadata or {}).get("page"))
+
+            if key in seen:
+                duplicates.append(chunk_id)
+                continue
+            seen[key] = chunk_id
+            kept.setdefault(source_name, []).append((chunk_id, chunk_hash))
+            content_types.setdefault(source_name, (metadata or {}).get("type"))
+
+        scanned += len(ids)
+        offset += len(ids)
+
+    print(f" - Scanned {scanned} chunks from {len(kept)} source(s), found {len(duplicates)} duplicate(s).")
+
+    if not dry_run:
+        delete_chunks(collection, duplicates)
+
+        if manifest_store is not None:
+            # Running servers drop their cached answers, which may cite the deleted chunks
+            manifest_store.bump_version(collection_name)
+            for source_name, chunks in kept.items():
+                if source_name:
+                    manifest_store.put(collection_name, source_name, None,
+                                       [chunk_id for chunk_id, _ in chunks],
+                                       [chunk_hash for _, chunk_hash in chunks],
+                                       content_type=content_types.get(source_name))
+
+        print(f" - Deleted {len(duplicates)} duplicate chunk(s).")
+
+    return {
+        "collection": collection_name,
+        "scanned": scanned,
+        "sources": len(kept),
+        "duplicates": len(duplicates),
+        "deleted": 0 if dry_run else len(duplicates),
+        "dry_run": dry_run,
+    }
@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import tempfile
+
+
+"""
+Holds uploaded files for ingestion without going through a shared temp folder.
+Uploads up to UPLOAD_SPOOL_THRESHOLD bytes stay in memory and are parsed from a buffer;
+larger ones are spooled to a uniquely named temp file, so concurrent same-named uploads never collide.
+"""
+
+
+UPLOAD_SPOOL_THRESHOLD = int(float(os.getenv("UPLOAD_SPOOL_THRESHOLD_MB", "4")) * 1024 * 1024)
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class UploadedFile:
+
+    def __init__(self, filename: str, data: bytes = None, path: str = None):
+        self.filename = filename
+        self.data = data
+        self.path = path
+
+
+    # Takes the content of a werkzeug FileStorage. It has to be read while the request is still open.
+
+    @classmethod
+    def from_storage(cls, file_storage, filename: str, spool_dir: str, threshold: int = UPLOAD_SPOOL_THRESHOLD):
+        return cls.from_stream(file_storage.stream, filename, spool_dir, threshold)
+
+
+    # Same for any binary stream, e.g. the file of a Starlette UploadFile in the ASGI app
+
+    @classmethod
+    def from_stream(cls, stream, filename: str, spool_dir: str, threshold: int = UPLOAD_SPOOL_THRESHOLD):
+        head = stream.read(threshold + 1)
+
+        if len(head) <= threshold:
+            return cls(filename, data=head)
+
+        os.makedirs(spool_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=spool_dir, suffix=os.path.splitext(filename)[1].lower())
+        with os.fdopen(fd, 'wb') as f:
+            f.write(head)
+            shutil.copyfileobj(stream, f, COPY_BUFFER_SIZE)
+
+        print(f" - Spooled '{filename}' to disk ({os.path.getsize(path) // 1024} KB).")
+        return cls(filename, path=path)
+
+
+    @property
+    def extension(self) -> str:
+        return os.path.splitext(self.filename)[1].lower()
+
+
+    @property
+    def size(self) -> int:
+        if self.path:
+            return os.path.getsize(self.path)
+        return len(self.data or b"")
+
+
+    # What the extractors read from: the spooled file's path, or a fresh binary stream over the buffer
+
+    def open_source(self):
+        if self.path:
+            return self.path
+        return io.BytesIO(self.data or b"")
+
+
+    # Releases the buffer and removes the spooled file. A file that cannot be removed right away
+    # (e.g. still locked on Windows) is left to the cleanup of its job directory.
+
+    def close(self):
+        self.data = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print(f" - Warning: Could not delete temporary file '{self.path}': {e}")
+            self.path = None
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+
+
+"""
+Persistent cache of vision analysis results, one per image content (the SHA-256 of the prepared image bytes).
+Re-uploads of the same image get their earlier analysis back instead of another Gemini call, and so
+do near-duplicates of a photograph (a re-saved or slightly resized photo), found by the perceptual hash.
+
+A `document` result holds the text read from that one image. Two screenshots of the same app or template
+with different text are near-duplicates, often with the very same perceptual hash, so document results
+are only reused for an image with the same content hash. Entries are evicted least recently used first.
+"""
+
+
+# Result types whose analysis still describes a near-duplicate image
+NEAR_DUPLICATE_TYPES = ("photograph",)
+
+
+# dHash: the image is reduced to a (hash_size + 1) x hash_size grayscale thumbnail and every
+# bit records whether a pixel is brighter than its right-hand neighbour. Returns hash_size^2 bits as bytes.
+
+def perceptual_hash(image, hash_size: int = 16) -> bytes:
+    from PIL import Image
+
+    thumbnail = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits.flatten()).tobytes()
+
+
+class VisionCache:
+
+    def __init__(self, path: str = "./vision_cache.sqlite3", max_distance: int = 8, max_entries: int = 100000):
+        self.path = path
+        # Largest Hamming distance (out of the hash's bits) that still counts as the same image
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.near_hits = 0
+        self.near_rejected = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vision_entries (
+                model TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                result TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, content_hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vision_entries_hash ON vision_entries (model, hash)")
+        self._migrate_results_table()
+        self._conn.commit()
+
+        # Entries are kept in memory per model, so near-duplicate lookups are one vectorized scan
+        self._hashes = {}
+        self._content_hashes = {}
+        self._results = {}
+        self._last_used = {}
+        self._content_positions = {}
+        self._matrices = {}
+        for model, content_hash, hash_bytes, result, last_used in self._conn.execute(
+            "SELECT model, content_hash, hash, result, last_used FROM vision_entries ORDER BY last_used"
+        ):
+            self._remember(model, content_hash, hash_bytes, json.loads(result), last_used)
+
+
+    # Caches written before results were keyed by content hash used the table vision_results, keyed by
+    # (model, perceptual hash). Its rows are copied over; rows without a content hash get one derived from
+    # the perceptual hash, which no image lookup matches, so their document results are still not reused.
+
+    def _migrate_results_table(self):
+        tables = {row[0] for row in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "vision_results" not in tables:
+            return
+
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(vision_results)")}
+        content_hash = "content_hash" if "content_hash" in columns else "NULL"
+        self._conn.execute(
+            f"""
+            INSERT OR IGNORE INTO vision_entries (model, content_hash, hash, result, last_used)
+            SELECT model, COALESCE({content_hash}, 'dhash:' || lower(hex(hash))), hash, result, created_at
+            FROM vision_results
+            """
+        )
+        self._conn.execute("DROP TABLE vision_results")
+
+
+    # Results stored without a content hash are keyed by their perceptual hash instead
+
+    def _entry_key(self, hash_bytes: bytes, content_hash: str = None) -> str:
+        return content_hash or f"dhash:{hash_bytes.hex()}"
+
+
+    def _remember(self, model: str, content_hash: str, hash_bytes: bytes, result: dict, last_used: float):
+        keys = self._hashes.setdefault(model, [])
+        content_hashes = self._content_hashes.setdefault(model, [])
+        results = self._results.setdefault(model, [])
+        last_used_times = self._last_used.setdefault(model, [])
+        content_positions = self._content_positions.setdefault(model, {})
+
+        index = content_positions.get(content_hash)
+        if index is None:
+            content_positions[content_hash] = len(keys)
+            keys.append(hash_bytes)
+            content_hashes.append(content_hash)
+            results.append(result)
+            last_used_times.append(last_used)
+        else:
+            keys[index] = hash_bytes
+            results[index] = result
+            last_used_times[index] = last_used
+        self._matrices.pop(model, None)
+
+
+    # Marks an entry as used, so eviction keeps the results that keep being reused
+
+    def _touch(self, model: str, index: int):
+        now = time.time()
+        self._last_used[model][index] = now
+        self._conn.execute(
+            "UPDATE vision_entries SET last_used = ? WHERE model = ? AND content_hash = ?",
+            (now, model, self._content_hashes[model][index])
+        )
+        self._conn.commit()
+
+
+    # Returns the cached result for the image, or None. An image with the same content hash gets its result
+    # whatever its type; otherwise the closest photograph within `max_distance` is used.
+
+    def get(self, model: str, hash_bytes: bytes, content_hash: str = None):
+        with self._lock:
+            keys = self._hashes.get(model)
+            if not keys:
+                self.misses += 1
+                return None
+
+            index = self._content_positions[model].get(content_hash) if content_hash else None
+            if index is not None:
+                self.hits += 1
+                self._touch(model, index)
+                return dict(self._results[model][index])
+
+            cached = self._matrices.get(model)
+            if cached is None:
+                matrix = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(len(keys), -1)
+                reusable = np.array([result.get("type") in NEAR_DUPLICATE_TYPES for result in self._results[model]])
+                cached = self._matrices[model] = (matrix, reusable)
+            matrix, reusable = cached
+
+            query = np.frombuffer(hash_bytes, dtype=np.uint8)
+            if query.shape[0] != matrix.shape[1]:
+                self.misses += 1
+                return None
+
+            distances = np.unpackbits(matrix ^ query, axis=1).sum(axis=1)
+            near = distances <= self.max_distance
+            if not np.any(near & reusable):
+                # Counts lookups that only found documents close by, whose text belongs to another image
+                if np.any(near):
+                    self.near_rejected += 1
+                self.misses += 1
+                return None
+
+            distances = np.where(reusable, distances, matrix.shape[1] * 8 + 1)
+            best = int(np.argmin(distances))
+            if distances[best] == 0:
+                self.hits += 1
+            else:
+                self.near_hits += 1
+            self._touch(model, best)
+            return dict(self._results[model][best])
+
+
+    def put(self, model: str, hash_bytes: bytes, result: dict, content_hash: str = None):
+        content_hash = self._entry_key(hash_bytes, content_hash)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vision_entries (model, content_hash, hash, result, last_used) VALUES (?, ?, ?, ?, ?)",
+                (model, content_hash, hash_bytes, json.dumps(result), now)
+            )
+            self._remember(model, content_hash, hash_bytes, result, now)
+            self._evict_if_needed(model)
+            self._conn.commit()
+
+
+    # Drops the least recently used results of a model once it holds more than `max_entries`, down to 90% of it
+
+    def _evict_if_needed(self, model: str):
+        keys = self._hashes[model]
+        if len(keys) <= self.max_entries:
+            return
+
+        excess = len(keys) - int(self.max_entries * 0.9)
+        content_hashes = self._content_hashes[model]
+        evicted = set(np.argsort(np.array(self._last_used[model]), kind="stable")[:excess].tolist())
+        self._conn.executemany(
+            "DELETE FROM vision_entries WHERE model = ? AND content_hash = ?",
+            [(model, content_hashes[index]) for index in evicted]
+        )
+
+        kept = [index for index in range(len(keys)) if index not in evicted]
+        self._hashes[model] = [keys[index] for index in kept]
+        self._content_hashes[model] = [content_hashes[index] for index in kept]
+        self._results[model] = [self._results[model][index] for index in kept]
+        self._last_used[model] = [self._last_used[model][index] for index in kept]
+        self._content_positions[model] = {
+            content_hash: index for index, content_hash in enumerate(self._content_hashes[model])
+        }
+        self._matrices.pop(model, None)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": sum(len(keys) for keys in self._hashes.values()),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "near_rejected": self.near_rejected,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+                "max_distance": self.max_distance,
+            }
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,52 @@
+import os
+import json
+import argparse
+
+from rag_core.vector_store import make_vector_client, VECTOR_STORE_BACKENDS
+from ingestion.manifest import SourceManifestStore, compact_collection
+
+
+"""
+Maintenance commands for the Glimpse backend. Run from the backend directory:
+
+    python manage.py compact --collection default_brain --dry-run
+
+Compaction bumps the collection's version in the manifest database, so a server running against the same
+--manifest-path drops its cached answers on the next query to that collection; no restart is needed.
+"""
+
+
+# Deletes duplicate chunks (same source and text) from a collection and rebuilds its source manifests
+
+def compact(args):
+    vector_client = make_vector_client(args.backend, args.store_path)
+    collection = vector_client.get_collection(args.collection)
+    manifest_store = SourceManifestStore(args.manifest_path)
+
+    try:
+        report = compact_collection(collection, manifest_store=manifest_store, dry_run=args.dry_run)
+    finally:
+        manifest_store.close()
+
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Glimpse maintenance commands.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="Remove duplicate chunks from a collection")
+    compact_parser.add_argument("--collection", default="default_brain")
+    compact_parser.add_argument("--backend", choices=VECTOR_STORE_BACKENDS, default=os.getenv("VECTOR_STORE_BACKEND", "chroma"))
+    compact_parser.add_argument("--store-path", "--chroma-path", dest="store_path", default=os.getenv("VECTOR_STORE_PATH"),
+                                help="Vector store directory (default: the backend's default path)")
+    compact_parser.add_argument("--manifest-path", default=os.getenv("SOURCE_MANIFEST_PATH", "./source_manifests.sqlite3"))
+    compact_parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    compact_parser.set_defaults(func=compact)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,37 @@
-from .retrieval import get_rag_answer
\ No newline at end of file
+import importlib
+
+
+# Public names and the submodule that defines them, imported on first access
+_EXPORTS = {
+    "get_rag_answer": ".retrieval",
+    "get_rag_result": ".retrieval",
+    "stream_rag_answer": ".retrieval",
+    "get_rag_results_batch": ".retrieval",
+    "iter_rag_results_batch": ".retrieval",
+    "QueryCache": ".retrieval",
+    "mmr_select": ".retrieval",
+    "EmbeddingCache": ".embedding_cache",
+    "CachedEmbeddings": ".embedding_cache",
+    "AdaptiveRateLimiter": ".rate_limiter",
+    "BatchedEmbeddings": ".rate_limiter",
+    "get_rate_limiter": ".rate_limiter",
+    "call_with_rate_limit": ".rate_limiter",
+    "RetrievalEngine": ".engine",
+    "MetricsRegistry": ".metrics",
+    "SamplingProfiler": ".metrics",
+    "get_metrics": ".metrics",
+    "span": ".metrics",
+    "LazyObject": ".lazy",
+    "preload": ".lazy",
+    "make_vector_client": ".vector_store",
+    "NumpyVectorClient": ".numpy_store",
+    "ConversationStore": ".conversation",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
@@ -0,0 +1,258 @@
+import os
+import re
+import math
+
+
+"""
+Packs retrieved chunks into the CONTEXT part of the prompt under a token budget.
+
+Neighbouring chunks of a document share up to CHUNK_OVERLAP characters (see ingestion.docEmbed), and the
+same passage is often stored more than once (re-uploads under another name, repeated boilerplate).
+The packer merges chunks of the same source that are adjacent (by their "chunk" position) or whose text
+overlaps into one snippet, drops chunks that are near-duplicates of a better-scoring one, orders what is
+left by score and stops at the budget. The report tells how many
+prompt tokens that saved compared to sending every chunk as it is.
+"""
+
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+
+# Share of a chunk's word trigrams already present in a kept snippet above which the chunk is dropped
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.85"))
+
+# Shortest suffix/prefix match treated as splitter overlap rather than a coincidence, and the longest one
+# looked for. The splitter overlap is CHUNK_OVERLAP (100) characters but ends on a separator, so allow slack.
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 400
+
+# A snippet that does not fit is cut down to the remaining budget only if at least this much is left
+MIN_SNIPPET_TOKENS = 64
+
+# Rough size of a Gemini token for English text; good enough for budgeting without a tokenizer call
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+
+# Returns {"context": prompt text, "snippets": [{"source", "page", "score", "text"}], "report": {...}}.
+# `scored_docs` are (Document, relevance score) pairs; `token_counter` maps a string to its token count.
+
+def pack_context(scored_docs: list, token_budget: int = CONTEXT_TOKEN_BUDGET, token_counter=estimate_tokens,
+                 duplicate_threshold: float = NEAR_DUPLICATE_THRESHOLD) -> dict:
+
+    chunks = [
+        {
+            "source": doc.metadata.get('source'),
+            "page": doc.metadata.get('page'),
+            "score": score,
+            "text": doc.page_content,
+            # Range of chunk positions a snippet covers; chunks stored before positions were recorded have none
+            "first": doc.metadata.get('chunk'),
+            "last": doc.metadata.get('chunk'),
+        }
+        for doc, score in scored_docs
+    ]
+
+    # What the prompt would have cost with every chunk as its own snippet
+    tokens_in = sum(token_counter(format_snippet(i, chunk)) for i, chunk in enumerate(chunks))
+
+    chunks.sort(key=lambda chunk: chunk["score"], reverse=True)
+    merged_chunks, merged = _merge_overlapping(chunks)
+    unique_chunks, duplicates = _drop_near_duplicates(merged_chunks, duplicate_threshold)
+
+    snippets = []
+    parts = []
+    tokens_packed = 0
+    over_budget = 0
+    truncated = 0
+
+    for chunk in unique_chunks:
+        part = format_snippet(len(snippets), chunk)
+        tokens = token_counter(part)
+
+        if tokens_packed + tokens > token_budget:
+            remaining = token_budget - tokens_packed
+            if remaining < MIN_SNIPPET_TOKENS:
+                over_budget += 1
+                continue
+            chunk = dict(chunk, text=_truncate(chunk["text"], remaining - (tokens - token_counter(chunk["text"])), token_counter))
+            part = format_snippet(len(snippets), chunk)
+            tokens = token_counter(part)
+            truncated += 1
+
+        snippets.append(chunk)
+        parts.append(part)
+        tokens_packed += tokens
+
+    return {
+        "context": "".join(parts),
+        "snippets": snippets,
+        "report": {
+            "token_budget": token_budget,
+            "tokens_in": tokens_in,
+            "tokens_packed": tokens_packed,
+            "tokens_saved": max(0, tokens_in - tokens_packed),
+            "chunks_in": len(chunks),
+            "snippets": len(snippets),
+            "merged": merged,
+            "duplicates_dropped": duplicates,
+            "over_budget_dropped": over_budget,
+            "truncated": truncated,
+        },
+    }
+
+
+
+def format_snippet(index: int, chunk: dict) -> str:
+    return (
+        f" --- Context Snippet {index + 1} ---\n"
+        f"Source: {chunk['source']}\n"
+        f"Content: {chunk['text']}\n\n"
+    )
+
+
+
+# Folds each chunk into an already kept chunk of the same source when they are neighbours, their texts overlap
+# or one contains the other. Chunks arrive best first, so a merged snippet keeps the score of its best part.
+
+def _merge_overlapping(chunks: list):
+    kept = []
+    merged = 0
+
+    for chunk in chunks:
+        target = next((existing for existing in kept
+                       if existing["source"] == chunk["source"] and _merge_into(existing, chunk)), None)
+        if target is None:
+            kept.append(dict(chunk))
+            continue
+        merged += 1
+
+        # The grown snippet may now touch another one of the same source (a chunk bridging two others)
+        for other in list(kept):
+            if other is target or other["source"] != target["source"]:
+                continue
+            first, second = sorted((target, other), key=kept.index)
+            if _merge_into(first, second):
+                kept.remove(second)
+                merged += 1
+                target = first
+
+    return kept, merged
+
+
+
+def _merge_into(existing: dict, chunk: dict) -> bool:
+    if existing["first"] is not None and chunk["first"] is not None:
+        if chunk["last"] + 1 == existing["first"]:
+            existing["text"] = _join_texts(chunk["text"], existing["text"])
+            existing["first"] = chunk["first"]
+            return True
+        if existing["last"] + 1 == chunk["first"]:
+            existing["text"] = _join_texts(existing["text"], chunk["text"])
+            existing["last"] = chunk["last"]
+            return True
+
+    combined = _merge_texts(existing["text"], chunk["text"])
+    if combined is None:
+        return False
+    existing["text"] = combined
+    return True
+
+
+
+# Neighbouring chunks: drop the overlap the splitter repeated; without one they are separate paragraphs
+
+def _join_texts(first: str, second: str) -> str:
+    overlap = _overlap_length(first, second)
+    if overlap:
+        return first + second[overlap:]
+    return first + "\n" + second
+
+
+
+def _merge_texts(first: str, second: str):
+    if second in first:
+        return first
+    if first in second:
+        return second
+
+    overlap = _overlap_length(first, second)
+    if overlap:
+        return first + second[overlap:]
+
+    overlap = _overlap_length(second, first)
+    if overlap:
+        return second + first[overlap:]
+
+    return None
+
+
+
+# Length of the longest suffix of `left` that is also a prefix of `right`, or 0 below MIN_OVERLAP_CHARS
+
+def _overlap_length(left: str, right: str) -> int:
+    if len(right) < MIN_OVERLAP_CHARS:
+        return 0
+
+    tail = left[-MAX_OVERLAP_CHARS:]
+    probe = right[:MIN_OVERLAP_CHARS]
+
+    # Candidate starts are the places the probe occurs; the earliest one that matches is the longest overlap
+    start = tail.find(probe)
+    while start != -1:
+        if right.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+
+def _drop_near_duplicates(chunks: list, threshold: float):
+    kept = []
+    kept_shingles = []
+    dropped = 0
+
+    for chunk in chunks:
+        shingles = _shingles(chunk["text"])
+        if shingles and any(len(shingles & other) / len(shingles) >= threshold for other in kept_shingles):
+            dropped += 1
+            continue
+        kept.append(chunk)
+        kept_shingles.append(shingles)
+
+    return kept, dropped
+
+
+
+# Word trigrams of the lower-cased text; short texts fall back to their words
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < 3:
+        return set(words)
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+
+# Cuts `text` to about `max_tokens`, preferring to end on a sentence or word boundary
+
+def _truncate(text: str, max_tokens: int, token_counter) -> str:
+    max_tokens -= token_counter(" ...")
+    if max_tokens <= 0:
+        return ""
+
+    limit = len(text)
+    while limit > 0 and token_counter(text[:limit]) > max_tokens:
+        # Shrink proportionally; token counts are close to linear in the length
+        limit = min(limit - 1, int(limit * max_tokens / token_counter(text[:limit])))
+
+    cut = text[:limit]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary < limit // 2:
+        boundary = cut.rfind(" ")
+    if boundary > limit // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + " ..."
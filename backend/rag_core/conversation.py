@@ -0,0 +1,411 @@
+import os
+import re
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .rate_limiter import call_with_rate_limit
+from .context import estimate_tokens, CHARS_PER_TOKEN
+from .metrics import get_metrics, span
+
+
+"""
+Server-side conversation sessions, so follow-up questions are answered in the context of the chat
+without the client resending its history.
+
+Every turn:
+  1. A follow-up ("what about the second one?") is rewritten into a standalone question against the
+     conversation, and that question is what gets embedded and searched.
+  2. The prompt gets a history block of at most `history_token_budget` tokens: a rolling summary of the
+     older turns plus the last few turns verbatim.
+  3. The chunk ids the answer was generated from are kept with the turn. The next turn scores them
+     against its own query next to the search results, so a follow-up can keep using them.
+
+When a turn no longer fits the verbatim window it is folded into the summary with one small LLM call on
+a background thread, after the answer was returned. Only the turns that drop out are summarized, never
+the whole history, and the summary is held to `summary_token_budget`, so the cost of a turn and the size
+of its prompt stay flat however long the chat runs.
+
+Sessions live in memory, in a bounded LRU that drops conversations idle for longer than `idle_timeout`.
+"""
+
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("CONVERSATION_HISTORY_TOKENS", "1024"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "384"))
+MAX_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", "3"))
+
+# "auto" rewrites questions that look like follow-ups, "always" every question after the first, "never" none
+REWRITE_MODE = os.getenv("CONVERSATION_REWRITE", "auto")
+
+# Per-turn records (question, rewritten question, chunk ids, sources) kept for GET /api/conversations/<id>
+MAX_TURN_LOG = 50
+
+# How long a turn waits for another turn of the same conversation to finish
+TURN_WAIT_SECONDS = 120
+
+# Pronouns and ordinals that point back at an earlier turn
+_REFERENCES = frozenset("""
+    it its they them their theirs this that these those he she him his her hers one ones
+    former latter above previous same another other first second third last
+""".split())
+
+# Openers of a follow-up ("and the price?", "what about the second one?")
+_FOLLOW_UP_OPENER = re.compile(r"^\s*(and|but|so|also|then|what about|how about|why not)\b", re.IGNORECASE)
+
+# Words that do not name anything on their own: question words, auxiliaries, prepositions and the
+# generic verbs of requests. A question with any other word of three letters or more names its subject.
+_FUNCTION_WORDS = frozenset("""
+    a an the and or but so also then than too very just only not no yes ok okay please thanks
+    what which who whom whose when where why how whats hows
+    is are was were be been being am do does did done doing has have had having can could will would
+    shall should may might must
+    i me my we us our you your
+    of in on at to for from with about into over under by as if there here
+    more most less else again instead other others any some all both each such
+    say says said mean means meant tell explain show give describe compare list summarize summarise
+    elaborate expand continue happen happened work works make made get got use used write wrote written
+    mention mentioned include includes need needs cost costs go goes went know
+""".split())
+
+
+class UnknownConversationError(Exception):
+    """Raised for a conversation id that does not exist, has expired or belongs to another collection."""
+
+
+class ConversationBusyError(Exception):
+    """Raised when another turn of the same conversation is still running."""
+
+
+class ConversationStore:
+
+    def __init__(self, text_generation_model, history_token_budget: int = HISTORY_TOKEN_BUDGET,
+                 summary_token_budget: int = SUMMARY_TOKEN_BUDGET, max_recent_turns: int = MAX_RECENT_TURNS,
+                 rewrite_mode: str = REWRITE_MODE, max_conversations: int = 1000, idle_timeout: float = 3600.0):
+
+        self.text_generation_model = text_generation_model
+        self.history_token_budget = history_token_budget
+        self.summary_token_budget = min(summary_token_budget, history_token_budget // 2)
+        self.max_recent_turns = max_recent_turns
+        self.rewrite_mode = rewrite_mode
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+
+        # conversation id -> state, least recently used first
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+        self.turns = 0
+        self.rewrites = 0
+        self.folds = 0
+        self.expired = 0
+
+
+    def create(self, collection_name: str) -> dict:
+        conversation = {
+            "conversation_id": uuid.uuid4().hex,
+            "collection": collection_name,
+            "created_at": time.time(),
+            "last_used": time.monotonic(),
+            "turn_count": 0,
+            "summary": "",
+            # Turns still in the prompt verbatim: {"query", "answer", "tokens"}
+            "recent": deque(),
+            "turns": deque(maxlen=MAX_TURN_LOG),
+            "folding": None,
+            # Held for a whole turn (see begin_turn)
+            "lock": threading.Lock(),
+            # Guards summary, recent and turns, which the summary pool updates while describe() may read them
+            "state_lock": threading.Lock(),
+        }
+        with self._lock:
+            self._expire(time.monotonic())
+            self._conversations[conversation["conversation_id"]] = conversation
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self.expired += 1
+        return self.describe(conversation["conversation_id"], collection_name)
+
+
+    # The summary, the verbatim turns and the per-turn records, for clients and debugging
+
+    def describe(self, conversation_id: str, collection_name: str) -> dict:
+        conversation = self._get(conversation_id, collection_name)
+        with conversation["state_lock"]:
+            described = {
+                "conversation_id": conversation["conversation_id"],
+                "created_at": conversation["created_at"],
+                "turn_count": conversation["turn_count"],
+                "summary": conversation["summary"],
+                "recent_turns": [{"query": turn["query"], "answer": turn["answer"]} for turn in conversation["recent"]],
+                "turns": [dict(turn) for turn in conversation["turns"]],
+            }
+        described["history_tokens"] = self._history_tokens(conversation)
+        return described
+
+
+    def delete(self, conversation_id: str, collection_name: str):
+        self._get(conversation_id, collection_name)
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+
+    # Holds the conversation for one turn. Turns of a conversation run one at a time, and a turn starts
+    # only once the summary fold left by the previous one has finished.
+
+    @contextmanager
+    def turn(self, conversation_id: str, collection_name: str):
+        conversation = self.begin_turn(conversation_id, collection_name)
+        try:
+            yield conversation
+        finally:
+            self.end_turn(conversation)
+
+
+    # turn() for callers that cannot hold a with block, e.g. a generator that may be abandoned. Pair with end_turn().
+
+    def begin_turn(self, conversation_id: str, collection_name: str) -> dict:
+        conversation = self._get(conversation_id, collection_name)
+        if not conversation["lock"].acquire(timeout=TURN_WAIT_SECONDS):
+            raise ConversationBusyError("Another question of this conversation is still being answered.")
+
+        folding = conversation["folding"]
+        if folding is not None:
+            try:
+                with span("conversation_summary_wait"):
+                    folding.result()
+            except Exception as e:
+                print(f" - Conversation summary update failed, keeping the previous summary: {e}")
+            conversation["folding"] = None
+        return conversation
+
+
+    def end_turn(self, conversation: dict):
+        conversation["last_used"] = time.monotonic()
+        conversation["lock"].release()
+
+
+    # The question to search with: the query itself, or a standalone rewrite when it refers back to the conversation
+
+    def rewrite(self, conversation: dict, query: str) -> str:
+        if not self._needs_rewrite(conversation, query):
+            return query
+
+        prompt = f"""
+        Rewrite the follow-up question so it can be understood without the conversation, replacing pronouns and
+        references like "the second one" with what they refer to. Keep the meaning and the language of the question.
+        Reply with the rewritten question only.
+
+        CONVERSATION:
+        {self.history_block(conversation)}
+
+        FOLLOW-UP QUESTION:
+        {query}
+
+        STANDALONE QUESTION:
+        """
+        try:
+            with span("query_rewrite"):
+                response = call_with_rate_limit(self.text_generation_model.generate_content, prompt)
+            rewritten = response.text.strip().splitlines()[0].strip().strip('"') if response.text.strip() else ""
+        except Exception as e:
+            print(f" - Could not rewrite the follow-up question, searching with it as it is: {e}")
+            return query
+
+        # A rewrite that came back empty or rambling is worse than the original question
+        if not rewritten or len(rewritten) > max(200, 4 * len(query)):
+            return query
+
+        with self._lock:
+            self.rewrites += 1
+        print(f" - Rewrote follow-up '{query}' as '{rewritten}'.")
+        return rewritten
+
+
+    # The bounded history that goes into the answer prompt, or None before the first turn.
+    # Its size is counted in glimpse_context_tokens_total{kind="history"}.
+
+    def prompt_history(self, conversation: dict):
+        history = self.history_block(conversation)
+        if history:
+            get_metrics().inc("glimpse_context_tokens_total", estimate_tokens(history), kind="history")
+        return history
+
+
+    def history_block(self, conversation: dict):
+        with conversation["state_lock"]:
+            summary = conversation["summary"]
+            recent = list(conversation["recent"])
+
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{summary}")
+        if recent:
+            parts.append("\n".join(_format_turn(turn) for turn in recent))
+        return "\n\n".join(parts) if parts else None
+
+
+    # Chunk ids of the previous turn, to be scored again by the next one
+
+    def carry_ids(self, conversation: dict):
+        with conversation["state_lock"]:
+            if not conversation["turns"]:
+                return None
+            return list(conversation["turns"][-1]["chunk_ids"]) or None
+
+
+    # Records a finished turn. Turns that no longer fit the verbatim window are folded into the summary
+    # on the summary pool; the next turn of this conversation waits for that.
+
+    def record_turn(self, conversation: dict, query: str, standalone_query: str, result: dict):
+        recent_budget = self.history_token_budget - self.summary_token_budget
+
+        # A single long answer never takes more than half of the verbatim window
+        answer = _clip(result.get("answer") or "", recent_budget // 2)
+        turn = {"query": query, "answer": answer}
+        turn["tokens"] = estimate_tokens(_format_turn(turn))
+
+        evicted = []
+        with conversation["state_lock"]:
+            conversation["recent"].append(turn)
+            conversation["turn_count"] += 1
+            conversation["turns"].append({
+                "index": conversation["turn_count"],
+                "query": query,
+                "standalone_query": standalone_query,
+                "chunk_ids": list(result.get("chunk_ids") or []),
+                "sources": list(result.get("sources") or []),
+                "gated": bool(result.get("gated")),
+                "created_at": time.time(),
+            })
+
+            while len(conversation["recent"]) > 1 and (
+                    len(conversation["recent"]) > self.max_recent_turns
+                    or sum(item["tokens"] for item in conversation["recent"]) > recent_budget):
+                evicted.append(conversation["recent"].popleft())
+
+        if evicted:
+            conversation["folding"] = self._summary_pool.submit(self._fold, conversation, evicted)
+
+        with self._lock:
+            self.turns += 1
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "turns": self.turns,
+                "rewrites": self.rewrites,
+                "summary_folds": self.folds,
+                "expired": self.expired,
+            }
+
+
+    def _get(self, conversation_id: str, collection_name: str) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            conversation = self._conversations.get(conversation_id or "")
+            # Conversations of other users are reported as unknown
+            if conversation is None or conversation["collection"] != collection_name:
+                raise UnknownConversationError(f"Unknown conversation id '{conversation_id}'")
+            conversation["last_used"] = now
+            self._conversations.move_to_end(conversation_id)
+            return conversation
+
+
+    # Callers hold self._lock
+
+    def _expire(self, now: float):
+        while self._conversations:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if now - conversation["last_used"] <= self.idle_timeout:
+                break
+            self._conversations.popitem(last=False)
+            self.expired += 1
+
+
+    # In "auto" mode only questions that cannot stand on their own pay for a rewrite: no word that names a
+    # subject, and a pronoun or ordinal ("what does it cost?", "compare the second one"), a follow-up
+    # opener ("and then?") or a bare fragment ("why?", "tell me more").
+
+    def _needs_rewrite(self, conversation: dict, query: str) -> bool:
+        with conversation["state_lock"]:
+            has_history = bool(conversation["recent"] or conversation["summary"])
+        if self.rewrite_mode == "never" or not has_history:
+            return False
+        if self.rewrite_mode == "always":
+            return True
+
+        words = re.findall(r"[a-z0-9]+", query.lower().replace("'", ""))
+        if not words:
+            return False
+        if any(len(word) > 2 and word not in _FUNCTION_WORDS and word not in _REFERENCES for word in words):
+            return False
+
+        refers_back = any(word in _REFERENCES for word in words) or bool(_FOLLOW_UP_OPENER.match(query))
+        fragment = len(words) <= 3 or query.rstrip().endswith(("...", "…"))
+        return refers_back or fragment
+
+
+    def _history_tokens(self, conversation: dict) -> int:
+        return estimate_tokens(self.history_block(conversation) or "")
+
+
+    # Merges the evicted turns into the rolling summary. Runs on the summary pool.
+
+    def _fold(self, conversation: dict, evicted: list):
+        with conversation["state_lock"]:
+            previous = conversation["summary"]
+        turns_text = "\n".join(_format_turn(turn) for turn in evicted)
+        max_words = self.summary_token_budget * 3 // 4
+
+        prompt = f"""
+        Update the summary of a conversation between a user and an assistant that answers from the user's documents.
+        Merge the new turns into the current summary. Keep the topics, documents and facts the user asked about and
+        what the answers said, most recent last. Use at most {max_words} words and reply with the summary only.
+
+        CURRENT SUMMARY:
+        {previous or "(empty)"}
+
+        NEW TURNS:
+        {turns_text}
+
+        UPDATED SUMMARY:
+        """
+        try:
+            with span("conversation_summary"):
+                response = call_with_rate_limit(self.text_generation_model.generate_content, prompt)
+            summary = _clip(response.text.strip(), self.summary_token_budget)
+        except Exception as e:
+            # Keeps the gist without the LLM: the questions asked, oldest dropped first
+            print(f" - Could not update the conversation summary, keeping the questions only: {e}")
+            lines = [line for line in previous.splitlines() if line.strip()]
+            lines += [f"- The user asked: {turn['query']}" for turn in evicted]
+            summary = _clip("\n".join(lines), self.summary_token_budget, keep_end=True)
+
+        with conversation["state_lock"]:
+            conversation["summary"] = summary or previous
+        with self._lock:
+            self.folds += 1
+
+
+
+def _format_turn(turn: dict) -> str:
+    return f"User: {turn['query']}\nAssistant: {turn['answer']}"
+
+
+
+# Cuts `text` down to about `max_tokens`, keeping its start (or its end, to keep the most recent lines)
+
+def _clip(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, max_tokens * CHARS_PER_TOKEN - 3)
+    if keep_end:
+        return "..." + text[-max_chars:]
+    return text[:max_chars].rstrip() + "..."
@@ -0,0 +1,236 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+
+"""
+Persistent, content-addressed cache for embedding vectors.
+Entries are keyed by a hash of the embedding model name, the kind of embedding
+(document or query) and the text, so unchanged chunks are never sent to the API twice.
+"""
+
+
+class EmbeddingCache:
+
+    def __init__(self, path: str = "./embedding_cache.sqlite3", max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+
+    @staticmethod
+    def make_key(model_name: str, kind: str, text: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model_name, kind, text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+
+    # Returns a dict of key -> vector for every key that is cached, and marks them as recently used
+
+    def get_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look keys up in slices
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        return found
+
+
+    def put_many(self, model_name: str, items: dict):
+        if not items:
+            return
+
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = array('f', vector).tobytes()
+            rows.append((key, model_name, blob, len(blob), now))
+
+        with self._lock:
+            for key, _, blob, size, _ in rows:
+                previous = self._conn.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+                self._total_bytes += size - (previous[0] if previous else 0)
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict_if_needed()
+            self._conn.commit()
+
+
+    # Drops the least recently used entries until the cache is back under 90% of its size limit
+
+    def _evict_if_needed(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_access ASC LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                self._total_bytes -= size
+                if self._total_bytes <= target:
+                    break
+
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+
+# Drop-in replacement for an embedding model that checks the cache before calling the API.
+# Ingestion (through Chroma.from_documents) and retrieval (through the retriever) both go through it.
+
+class CachedEmbeddings(Embeddings):
+
+    def __init__(self, embedding_model, cache: EmbeddingCache, model_name: str = None):
+        self.embedding_model = embedding_model
+        self.cache = cache
+        self.model_name = model_name or getattr(embedding_model, "model", None) or type(embedding_model).__name__
+
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [EmbeddingCache.make_key(self.model_name, "document", text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Only texts that are not cached are sent to the API, each unique text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embedding_model.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+
+    def embed_query(self, text: str) -> list:
+        key = EmbeddingCache.make_key(self.model_name, "query", text)
+        cached = self.cache.get_many([key])
+        if key in cached:
+            return cached[key]
+
+        vector = self.embedding_model.embed_query(text)
+        self.cache.put_many(self.model_name, {key: vector})
+        return vector
+
+
+    # Several queries at once: cached ones are looked up together, the rest go out in one batched request
+
+    def embed_queries(self, texts: list) -> list:
+        keys = [EmbeddingCache.make_key(self.model_name, "query", text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = embed_queries(self.embedding_model, list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+
+
+# Embeds a list of queries with the model's batched query call when it has one, one call per query otherwise
+
+def embed_queries(embedding_model, texts: list) -> list:
+    if not texts:
+        return []
+    batch_embed = getattr(embedding_model, "embed_queries", None)
+    if batch_embed is not None:
+        return batch_embed(texts)
+    return [embedding_model.embed_query(text) for text in texts]
@@ -0,0 +1,458 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from .retrieval import get_rag_result, stream_rag_answer, get_rag_results_batch, iter_rag_results_batch, QueryCache, BATCH_CONCURRENCY, ERROR_ANSWER
+from .conversation import ConversationBusyError
+
+
+"""
+Long-lived retrieval and indexing engine. It is created once at startup and keeps the
+Chroma collection wrappers, retrievers and model clients around, so requests do not
+rebuild them every time.
+
+Every user gets their own collection. Collection handles are opened on first access and kept
+in a bounded LRU; handles that stay idle longer than `idle_timeout` are dropped.
+"""
+
+
+class RetrievalEngine:
+
+    def __init__(self, chroma_client, embedding_model, text_generation_model=None, vision_model=None,
+                 default_collection: str = "default_brain", k: int = 5, query_cache: QueryCache = None,
+                 relevance_threshold: float = None, vision_cache=None, manifest_store=None,
+                 max_open_collections: int = 64, idle_timeout: float = 900.0,
+                 batch_concurrency: int = BATCH_CONCURRENCY, conversations=None):
+
+        self.chroma_client = chroma_client
+        self.embedding_model = embedding_model
+        self.text_generation_model = text_generation_model
+        self.vision_model = vision_model
+        self.default_collection = default_collection
+        self.k = k
+        self.query_cache = query_cache
+        self.relevance_threshold = relevance_threshold
+        self.vision_cache = vision_cache
+        # Per-source manifests (ingestion.manifest.SourceManifestStore) for incremental re-ingestion
+        self.manifest_store = manifest_store
+        # Answers generated in parallel for one batch query
+        self.batch_concurrency = batch_concurrency
+        # Multi-turn sessions (rag_core.conversation.ConversationStore) for converse() and stream_converse()
+        self.conversations = conversations
+
+        self.started_at = time.time()
+        self.warmed_up = False
+
+        self.max_open_collections = max_open_collections
+        self.idle_timeout = idle_timeout
+        self.evictions = 0
+
+        # collection name -> {"vector_store", "retriever", "last_used"}, least recently used first
+        self._handles = OrderedDict()
+        # collection name -> shared collection version last seen (see _sync_external_changes)
+        self._seen_versions = {}
+        self._lock = threading.Lock()
+
+
+    # Name of the collection that holds a user's documents. Requests without a user use the default collection.
+
+    def collection_for_user(self, user_id: str = None) -> str:
+        if not user_id:
+            return self.default_collection
+        # Chroma names: 3-63 characters from [a-zA-Z0-9._-], starting and ending with a letter or digit
+        safe_id = re.sub(r"[^a-zA-Z0-9_-]", "-", str(user_id)).strip("-_")[:56]
+        return f"user-{safe_id}" if safe_id else self.default_collection
+
+
+    # Returns the open handle of a collection, opening it on first access.
+    # Every access also closes the handles that went idle and, past `max_open_collections`, the least recently used.
+
+    def _get_handle(self, collection_name: str) -> dict:
+        now = time.monotonic()
+
+        with self._lock:
+            handle = self._handles.get(collection_name)
+            if handle is None:
+                # Imported on first use so that importing the engine does not load chromadb
+                from langchain_community.vectorstores import Chroma
+                vector_store = Chroma(
+                    client=self.chroma_client,
+                    collection_name=collection_name,
+                    embedding_function=self.embedding_model
+                )
+                handle = {"vector_store": vector_store, "retriever": None, "last_used": now}
+                self._handles[collection_name] = handle
+
+            handle["last_used"] = now
+            self._handles.move_to_end(collection_name)
+            self._evict_handles(now, keep=collection_name)
+            return handle
+
+
+    # Drops handles from the least recently used end. The LRU order puts idle handles first,
+    # so the sweep stops at the first handle that is recent and within the bound.
+    # Must be called with self._lock held.
+
+    def _evict_handles(self, now: float, keep: str = None):
+        while self._handles:
+            name, handle = next(iter(self._handles.items()))
+            if name == keep:
+                break
+            idle = now - handle["last_used"] > self.idle_timeout
+            if not idle and len(self._handles) <= self.max_open_collections:
+                break
+            self._handles.popitem(last=False)
+            self.evictions += 1
+
+
+    # Closes idle handles without opening one, so a quiet server does not hold them until the next request.
+
+    def sweep_idle_handles(self) -> int:
+        with self._lock:
+            before = self.evictions
+            self._evict_handles(time.monotonic())
+            return self.evictions - before
+
+
+    # Returns the LangChain Chroma wrapper for a collection, creating it only the first time
+
+    def get_vector_store(self, collection_name: str = None):
+        collection_name = collection_name or self.default_collection
+        return self._get_handle(collection_name)["vector_store"]
+
+
+    def get_retriever(self, collection_name: str = None):
+        collection_name = collection_name or self.default_collection
+        self._sync_external_changes(collection_name)
+        handle = self._get_handle(collection_name)
+
+        with self._lock:
+            if handle["retriever"] is None:
+                handle["retriever"] = handle["vector_store"].as_retriever(search_kwargs={"k": self.k})
+            return handle["retriever"]
+
+
+    # Returns {"answer", "sources", "scores", "gated", "cached"}.
+    # `filters` scope the search to some sources, see resolve_filters().
+
+    def answer(self, query: str, collection_name: str = None, filters: dict = None) -> dict:
+        collection_name = collection_name or self.default_collection
+        return get_rag_result(
+            query=query,
+            collection_name=collection_name,
+            chroma_client=self.chroma_client,
+            embedding_model=self.embedding_model,
+            text_generation_model=self.text_generation_model,
+            retriever=self.get_retriever(collection_name),
+            query_cache=self.query_cache,
+            relevance_threshold=self.relevance_threshold,
+            candidate_ids=self.resolve_filters(collection_name, filters)
+        )
+
+
+    def stream_answer(self, query: str, collection_name: str = None, filters: dict = None):
+        collection_name = collection_name or self.default_collection
+        return stream_rag_answer(
+            query=query,
+            collection_name=collection_name,
+            chroma_client=self.chroma_client,
+            embedding_model=self.embedding_model,
+            text_generation_model=self.text_generation_model,
+            retriever=self.get_retriever(collection_name),
+            query_cache=self.query_cache,
+            relevance_threshold=self.relevance_threshold,
+            candidate_ids=self.resolve_filters(collection_name, filters)
+        )
+
+
+    # Many questions against one collection with one embedding call and one vector search.
+    # Returns {"results": [...in query order], "count", "timings"}.
+
+    def answer_batch(self, queries: list, collection_name: str = None, filters: dict = None) -> dict:
+        collection_name = collection_name or self.default_collection
+        return get_rag_results_batch(
+            queries=queries,
+            collection_name=collection_name,
+            chroma_client=self.chroma_client,
+            embedding_model=self.embedding_model,
+            text_generation_model=self.text_generation_model,
+            retriever=self.get_retriever(collection_name),
+            query_cache=self.query_cache,
+            relevance_threshold=self.relevance_threshold,
+            max_concurrency=self.batch_concurrency,
+            candidate_ids=self.resolve_filters(collection_name, filters)
+        )
+
+
+    # Yields a "result" event per query as it finishes, then "done"
+
+    def stream_answer_batch(self, queries: list, collection_name: str = None, filters: dict = None):
+        collection_name = collection_name or self.default_collection
+        return iter_rag_results_batch(
+            queries=queries,
+            collection_name=collection_name,
+            chroma_client=self.chroma_client,
+            embedding_model=self.embedding_model,
+            text_generation_model=self.text_generation_model,
+            retriever=self.get_retriever(collection_name),
+            query_cache=self.query_cache,
+            relevance_threshold=self.relevance_threshold,
+            max_concurrency=self.batch_concurrency,
+            candidate_ids=self.resolve_filters(collection_name, filters)
+        )
+
+
+    # One turn of a conversation: the question is rewritten against the conversation when it is a follow-up,
+    # answered with the bounded history in the prompt, and recorded with the ids of the chunks it used.
+    # Returns the answer() dict plus "conversation_id" and "standalone_query".
+
+    def converse(self, conversation_id: str, query: str, collection_name: str = None, filters: dict = None) -> dict:
+        collection_name = collection_name or self.default_collection
+        candidate_ids = self.resolve_filters(collection_name, filters)
+
+        with self.conversations.turn(conversation_id, collection_name) as conversation:
+            standalone_query = self.conversations.rewrite(conversation, query)
+            result = get_rag_result(
+                query=standalone_query,
+                collection_name=collection_name,
+                chroma_client=self.chroma_client,
+                embedding_model=self.embedding_model,
+                text_generation_model=self.text_generation_model,
+                retriever=self.get_retriever(collection_name),
+                query_cache=self.query_cache,
+                relevance_threshold=self.relevance_threshold,
+                candidate_ids=candidate_ids,
+                history=self.conversations.prompt_history(conversation),
+                carry_ids=self.conversations.carry_ids(conversation)
+            )
+            if result["answer"] != ERROR_ANSWER:
+                self.conversations.record_turn(conversation, query, standalone_query, result)
+
+        result["conversation_id"] = conversation_id
+        result["standalone_query"] = standalone_query
+        return result
+
+
+    # Streaming converse(): a "conversation" event with the standalone question, then the stream_answer() events.
+    # The conversation is checked before anything is streamed, so an unknown id fails the request itself.
+
+    def stream_converse(self, conversation_id: str, query: str, collection_name: str = None, filters: dict = None):
+        collection_name = collection_name or self.default_collection
+        candidate_ids = self.resolve_filters(collection_name, filters)
+        self.conversations.describe(conversation_id, collection_name)
+        return self._stream_turn(conversation_id, query, collection_name, candidate_ids)
+
+
+    def _stream_turn(self, conversation_id: str, query: str, collection_name: str, candidate_ids):
+        try:
+            conversation = self.conversations.begin_turn(conversation_id, collection_name)
+        except ConversationBusyError as e:
+            # The response has started already, so this is reported in the stream
+            yield {"event": "error", "data": {"error": str(e)}}
+            return
+
+        try:
+            standalone_query = self.conversations.rewrite(conversation, query)
+            yield {"event": "conversation", "data": {"conversation_id": conversation_id, "standalone_query": standalone_query}}
+
+            events = stream_rag_answer(
+                query=standalone_query,
+                collection_name=collection_name,
+                chroma_client=self.chroma_client,
+                embedding_model=self.embedding_model,
+                text_generation_model=self.text_generation_model,
+                retriever=self.get_retriever(collection_name),
+                query_cache=self.query_cache,
+                relevance_threshold=self.relevance_threshold,
+                candidate_ids=candidate_ids,
+                history=self.conversations.prompt_history(conversation),
+                carry_ids=self.conversations.carry_ids(conversation)
+            )
+
+            result = None
+            answer_parts = []
+            for event in events:
+                if event["event"] == "sources":
+                    result = dict(event["data"])
+                elif event["event"] == "token":
+                    answer_parts.append(event["data"]["text"])
+                elif event["event"] == "done" and result is not None:
+                    # Recorded before "done" goes out, so a follow-up sent right after it sees this turn
+                    result["answer"] = "".join(answer_parts)
+                    self.conversations.record_turn(conversation, query, standalone_query, result)
+                yield event
+        finally:
+            self.conversations.end_turn(conversation)
+
+
+    # Ids of the chunks a query with `filters` ({"sources", "types", "uploaded_after", "uploaded_before"})
+    # may search, looked up in the source manifests; None when there are no filters.
+
+    def resolve_filters(self, collection_name: str, filters: dict = None):
+        if not filters:
+            return None
+        if self.manifest_store is None:
+            raise ValueError("Query filters need the source manifests (manifest_store)")
+
+        resolved = self.manifest_store.resolve_filters(collection_name, filters)
+        print(f" - Filters matched {len(resolved['sources'])} source(s) with {len(resolved['chunk_ids'])} chunk(s).")
+        return resolved["chunk_ids"]
+
+
+    # The sources of a collection with their type, media, chunk count and upload time, from the manifests
+
+    def list_sources(self, collection_name: str = None, filters: dict = None) -> list:
+        collection_name = collection_name or self.default_collection
+        if self.manifest_store is None:
+            return []
+        return self.manifest_store.describe_sources(collection_name, filters)
+
+
+    # `file_path` is a path or a binary stream with its name in `file_name` (see ingestion.uploads).
+    # The ingest methods return the ingest status (ingestion.manifest.INGEST_*), or False on failure.
+
+    def ingest_document(self, file_path, collection_name: str = None, file_name: str = None):
+        # Imported here because the ingestion package itself depends on rag_core
+        from ingestion.docEmbed import process_and_embed_document
+
+        collection_name = collection_name or self.default_collection
+        success = process_and_embed_document(
+            file_path=file_path,
+            collection_name=collection_name,
+            chroma_client=self.chroma_client,
+            embedding_model=self.embedding_model,
+            vector_store=self.get_vector_store(collection_name),
+            file_name=file_name,
+            manifest_store=self.manifest_store
+        )
+        self.collection_changed(collection_name)
+        return success
+
+
+    def ingest_document_text(self, full_text: str, source_name: str, file_type: str, collection_name: str = None):
+        from ingestion.docEmbed import embed_document_text
+
+        collection_name = collection_name or self.default_collection
+        success = embed_document_text(
+            full_text=full_text,
+            source_name=source_name,
+            file_type=file_type,
+            collection_name=collection_name,
+            chroma_client=self.chroma_client,
+            embedding_model=self.embedding_model,
+            vector_store=self.get_vector_store(collection_name),
+            manifest_store=self.manifest_store
+        )
+        self.collection_changed(collection_name)
+        return success
+
+
+    def ingest_image(self, file_path, collection_name: str = None, file_name: str = None):
+        from ingestion.imageEmbed import process_and_embed_image
+
+        collection_name = collection_name or self.default_collection
+        success = process_and_embed_image(
+            file_path=file_path,
+            collection_name=collection_name,
+            chroma_client=self.chroma_client,
+            embedding_model=self.embedding_model,
+            vision_model=self.vision_model,
+            vector_store=self.get_vector_store(collection_name),
+            vision_cache=self.vision_cache,
+            file_name=file_name,
+            manifest_store=self.manifest_store
+        )
+        self.collection_changed(collection_name)
+        return success
+
+
+    # Deletes duplicate chunks from a collection and rebuilds its source manifests (see ingestion.manifest)
+
+    def compact(self, collection_name: str = None, dry_run: bool = False) -> dict:
+        from ingestion.manifest import compact_collection
+
+        collection_name = collection_name or self.default_collection
+        report = compact_collection(
+            self.get_vector_store(collection_name)._collection,
+            manifest_store=self.manifest_store,
+            dry_run=dry_run
+        )
+        if not dry_run:
+            self.collection_changed(collection_name)
+        return report
+
+
+    # Called after anything writes to a collection, so cached answers never outlive the data they came from.
+    # The shared version in the manifest database tells other processes about the write.
+
+    def collection_changed(self, collection_name: str):
+        if self.query_cache is not None:
+            self.query_cache.invalidate(collection_name)
+        if self.manifest_store is not None:
+            version = self.manifest_store.bump_version(collection_name)
+            with self._lock:
+                self._seen_versions[collection_name] = version
+
+
+    # Drops the cached answers of a collection that another process (another worker, manage.py compact)
+    # wrote to since this one last looked
+
+    def _sync_external_changes(self, collection_name: str):
+        if self.manifest_store is None or self.query_cache is None:
+            return
+        version = self.manifest_store.version(collection_name)
+        with self._lock:
+            seen = self._seen_versions.get(collection_name)
+            self._seen_versions[collection_name] = version
+        if seen is not None and seen != version:
+            print(f" - Collection '{collection_name}' was changed by another process, dropping its cached answers.")
+            self.query_cache.invalidate(collection_name)
+
+
+    # Opens the default collection and builds its retriever ahead of traffic.
+    # With `embed=True` it also sends one query embedding so the client connection is established.
+
+    def warm_up(self, embed: bool = False) -> dict:
+        started = time.perf_counter()
+
+        self.get_retriever(self.default_collection)
+        count = self.get_vector_store(self.default_collection)._collection.count()
+
+        if embed:
+            self.embedding_model.embed_query("warm-up")
+
+        self.warmed_up = True
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        print(f" - Retrieval engine warmed up in {elapsed_ms} ms ({count} chunks in '{self.default_collection}').")
+        return {"collection": self.default_collection, "chunks": count, "elapsed_ms": elapsed_ms}
+
+
+    def health(self) -> dict:
+        self.sweep_idle_handles()
+        status = {
+            "status": "ok",
+            "warmed_up": self.warmed_up,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "open_collections": len(self._handles),
+            "max_open_collections": self.max_open_collections,
+            "collection_evictions": self.evictions,
+        }
+
+        try:
+            self.chroma_client.heartbeat()
+            status["chroma"] = "ok"
+            status["default_collection_chunks"] = self.get_vector_store(self.default_collection)._collection.count()
+        except Exception as e:
+            status["status"] = "degraded"
+            status["chroma"] = f"error: {e}"
+
+        status["models"] = {
+            "embedding": self.embedding_model is not None,
+            "text_generation": self.text_generation_model is not None,
+            "vision": self.vision_model is not None,
+        }
+        if not all(status["models"].values()):
+            status["status"] = "degraded"
+
+        return status
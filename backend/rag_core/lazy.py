@@ -0,0 +1,73 @@
+import time
+import threading
+import importlib
+
+
+"""
+Deferred construction of expensive clients (Chroma, Gemini models, Firestore).
+A LazyObject stands in for the real object and builds it on first use, so importing the app
+stays fast; preload() builds everything ahead of traffic.
+"""
+
+
+class LazyObject:
+
+    def __init__(self, factory, name: str = None):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_name", name or getattr(factory, "__name__", "object"))
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+
+    # Builds the wrapped object the first time anything asks for it; concurrent callers wait for the same instance
+
+    def resolve(self):
+        instance = self._instance
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if self._instance is None:
+                started = time.perf_counter()
+                instance = self._factory()
+                object.__setattr__(self, "_instance", instance)
+                print(f" - Initialized {self._name} in {(time.perf_counter() - started) * 1000:.0f} ms.")
+            return self._instance
+
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyObject {self._name} ({state})>"
+
+
+
+# Imports the given modules and resolves the given lazy objects. Returns how long each one took in milliseconds.
+
+def preload(objects: dict = None, modules: list = None) -> dict:
+    timings = {}
+
+    for module_name in modules or []:
+        started = time.perf_counter()
+        importlib.import_module(module_name)
+        timings[module_name] = round((time.perf_counter() - started) * 1000, 2)
+
+    for name, lazy in (objects or {}).items():
+        started = time.perf_counter()
+        if isinstance(lazy, LazyObject):
+            lazy.resolve()
+        timings[name] = round((time.perf_counter() - started) * 1000, 2)
+
+    return timings
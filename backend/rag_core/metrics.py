@@ -0,0 +1,329 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+"""
+In-process metrics for the ingestion and query pipeline.
+Every stage (upload save, extraction, splitting, vision, embedding, vector store write,
+retrieval, prompt build, generation) is timed with span() and exported together with the
+counters in the Prometheus text format on /api/metrics.
+A sampling profiler can be switched on with GLIMPSE_PROFILE=1 to see where the time goes inside a stage.
+"""
+
+
+# Upper bounds in seconds, from cache lookups to slow Gemini calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_METRIC = "glimpse_stage_duration_seconds"
+STAGE_ERRORS_METRIC = "glimpse_stage_errors_total"
+
+
+class _Histogram:
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+    # Approximate quantile from the bucket counts (the upper bound of the bucket it falls in)
+
+    def quantile(self, fraction: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+
+class MetricsRegistry:
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+
+    # Times the wrapped block as one observation of `stage`. Failed blocks are timed too and counted as errors.
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(STAGE_ERRORS_METRIC, stage=stage)
+            raise
+        finally:
+            self.observe(STAGE_METRIC, time.perf_counter() - started, stage=stage)
+
+
+    # Adds the time spent inside the iterator's next() calls to `stage`, observed once the iterator is exhausted.
+    # Used for lazy readers, where the work is interleaved with whatever consumes them.
+
+    def timed_iter(self, iterable, stage: str):
+        elapsed = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - started
+                    break
+                except BaseException:
+                    elapsed += time.perf_counter() - started
+                    self.inc(STAGE_ERRORS_METRIC, stage=stage)
+                    raise
+                elapsed += time.perf_counter() - started
+                yield item
+        finally:
+            self.observe(STAGE_METRIC, elapsed, stage=stage)
+
+
+    # `collector` is called on every export and returns (name, type, help, labels, value) tuples.
+    # It lets components that already keep their own counters (caches, the rate limiter) be exported as they are.
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+
+    # Per-stage count, total and approximate percentiles in milliseconds
+
+    def stage_summary(self) -> dict:
+        with self._lock:
+            summary = {}
+            for (name, labels), histogram in self._histograms.items():
+                if name != STAGE_METRIC:
+                    continue
+                stage = dict(labels).get("stage")
+                summary[stage] = {
+                    "count": histogram.count,
+                    "total_ms": round(histogram.sum * 1000, 3),
+                    "mean_ms": round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0,
+                    "p50_ms": histogram.quantile(0.50) * 1000,
+                    "p95_ms": histogram.quantile(0.95) * 1000,
+                }
+            return summary
+
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+    # Prometheus text exposition format (version 0.0.4)
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            collectors = list(self._collectors)
+
+        lines = []
+        described = set()
+
+        def header(name, metric_type, help_text=None):
+            if name in described:
+                return
+            described.add(name)
+            help_text = help_text or self._help.get(name)
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f" - Metrics collector failed: {e}")
+                continue
+            for name, metric_type, help_text, labels, value in samples:
+                header(name, metric_type, help_text)
+                lines.append(f"{name}{_format_labels(_label_key(labels or {}))} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+
+_default_registry = MetricsRegistry()
+
+_default_registry.describe(STAGE_METRIC, "Time spent in each pipeline stage.")
+_default_registry.describe(STAGE_ERRORS_METRIC, "Pipeline stage executions that raised an error.")
+_default_registry.describe("glimpse_gemini_requests_total", "Gemini API calls, including retries.")
+_default_registry.describe("glimpse_gemini_rate_limited_total", "Gemini API calls answered with 429 / ResourceExhausted.")
+_default_registry.describe("glimpse_gemini_retries_total", "Gemini API calls retried after a 429.")
+_default_registry.describe("glimpse_gemini_errors_total", "Gemini API calls that failed with anything other than a 429.")
+_default_registry.describe("glimpse_gemini_limiter_wait_seconds", "Time spent waiting for the shared rate limiter.")
+_default_registry.describe("glimpse_retrievals_total", "Queries by outcome: answered from cache, gated for low relevance, or retrieved.")
+_default_registry.describe("glimpse_context_tokens_total", "Estimated prompt context tokens, sent (packed) and avoided by merging and dedup (saved).")
+
+
+# Returns the registry shared by the whole process
+
+def get_metrics() -> MetricsRegistry:
+    return _default_registry
+
+
+def span(stage: str):
+    return _default_registry.span(stage)
+
+
+def timed_iter(iterable, stage: str):
+    return _default_registry.timed_iter(iterable, stage)
+
+
+
+# Sampling profiler: a background thread records the stack of every other thread every `interval`
+# seconds and aggregates them as folded stacks ("outer;inner;leaf count"), the input format of
+# flamegraph tools. It only reads frames, so the overhead is one stack walk per thread per sample.
+
+class SamplingProfiler:
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        print(f" - Sampling profiler started ({self.interval * 1000:.0f} ms interval).")
+
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+
+    def _run(self):
+        own_id = threading.get_ident()
+
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            folded = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                folded.append(";".join(reversed(stack)))
+
+            with self._lock:
+                self.samples += 1
+                self._stacks.update(folded)
+
+
+    # Returns the `top` most sampled stacks in folded format, busiest first
+
+    def report(self, top: int = None) -> str:
+        with self._lock:
+            stacks = self._stacks.most_common(top)
+        return "\n".join(f"{stack} {count}" for stack, count in stacks) + "\n"
+
+
+    def reset(self):
+        with self._lock:
+            self.samples = 0
+            self._stacks.clear()
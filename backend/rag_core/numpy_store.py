@@ -0,0 +1,1118 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+"""
+Built-in vector store backend on NumPy, a drop-in for chromadb.PersistentClient (see rag_core.vector_store).
+
+Every collection is a directory with:
+  - append-only segments: the unit-length embeddings, quantized to float16 or int8 (with a per-vector scale),
+    their norms and, with the coarse index, their cluster, each in a .npy file opened memory-mapped;
+  - records.sqlite3: id, segment, row, document text and metadata of every live chunk;
+  - collection.json: the collection metadata and the list of segments.
+
+Writes append a new segment; an upsert or delete only moves or drops the record, leaving a dead row behind.
+Small segments and dead rows are merged away on a background thread. Search is an exact, batched
+dot-product scan over all live rows. With `coarse_index=True`, collections above `coarse_min_vectors` get
+a k-means coarse quantizer and queries only scan the rows of the `nprobe` closest clusters.
+
+int8 stores a 768-dimensional embedding in 772 bytes (a fifth of Chroma's float32) and scans as fast as
+float32; float16 keeps more precision but decodes slowly unless `decode_cache_mb` holds the decoded rows.
+"""
+
+
+SEGMENT_DTYPES = ("float32", "float16", "int8")
+
+# Number of segments above which a collection is merged, and the share of dead rows that triggers a merge
+MAX_SEGMENTS = int(os.getenv("VECTOR_STORE_MAX_SEGMENTS", "8"))
+MAX_DEAD_FRACTION = 0.25
+
+# Rows dequantized at once during a scan. Small enough for the float32 copy to stay in cache
+# (1024 x 768 floats = 3 MB): with 8192-row blocks an int8 scan of 20k vectors took 30 ms instead of 12 ms.
+SCAN_BLOCK_ROWS = 1024
+
+# Decoded float32 blocks kept in memory, shared by the collections of a client. NumPy converts float16
+# slowly (a 20k x 768 float16 scan takes about 60 ms against 12 ms for int8), so it pays off mostly there.
+DECODE_CACHE_MB = int(os.getenv("VECTOR_STORE_DECODE_CACHE_MB", "0"))
+
+COARSE_MIN_VECTORS = 20000
+COARSE_TRAINING_SAMPLE = 50000
+COARSE_ITERATIONS = 10
+
+_NAME_PATTERN = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9._-]{1,510}[a-zA-Z0-9]$")
+
+
+
+class NumpyVectorClient:
+
+    def __init__(self, path: str = "./vector_store", dtype: str = "int8", coarse_index: bool = False,
+                 nprobe: int = 16, coarse_min_vectors: int = COARSE_MIN_VECTORS, max_segments: int = MAX_SEGMENTS,
+                 background_merge: bool = True, decode_cache_mb: int = DECODE_CACHE_MB):
+
+        if dtype not in SEGMENT_DTYPES:
+            raise ValueError(f"Unsupported vector dtype '{dtype}'. Expected one of {', '.join(SEGMENT_DTYPES)}.")
+
+        self.path = path
+        self.dtype = dtype
+        self.coarse_index = coarse_index
+        self.nprobe = nprobe
+        self.coarse_min_vectors = coarse_min_vectors
+        self.max_segments = max_segments
+        self.background_merge = background_merge
+        self.decode_cache_bytes = decode_cache_mb * 1024 * 1024
+
+        os.makedirs(path, exist_ok=True)
+        self._collections = {}
+        self._lock = threading.Lock()
+
+        # Collections waiting for a merge; one daemon thread works through them
+        self._merge_queue = []
+        self._merge_wakeup = threading.Condition(self._lock)
+        self._merger = None
+
+        # (segment, first row) -> decoded float32 block, least recently used first
+        self._decoded = OrderedDict()
+        self._decoded_bytes = 0
+        self._decoded_lock = threading.Lock()
+
+
+    # Same contract as chromadb's heartbeat: nanoseconds, raises when the store is unusable
+
+    def heartbeat(self) -> int:
+        if not os.path.isdir(self.path):
+            raise RuntimeError(f"Vector store directory '{self.path}' is missing")
+        return time.time_ns()
+
+
+    def get_or_create_collection(self, name: str, embedding_function=None, metadata: dict = None, **kwargs):
+        return self._open(name, metadata=metadata, create=True)
+
+
+    def create_collection(self, name: str, embedding_function=None, metadata: dict = None, **kwargs):
+        if os.path.isdir(self._collection_path(name)):
+            raise ValueError(f"Collection {name} already exists")
+        return self._open(name, metadata=metadata, create=True)
+
+
+    def get_collection(self, name: str, embedding_function=None, **kwargs):
+        return self._open(name, create=False)
+
+
+    def list_collections(self) -> list:
+        names = sorted(
+            entry for entry in os.listdir(self.path)
+            if os.path.isfile(os.path.join(self.path, entry, "collection.json"))
+        )
+        return [self._open(name, create=False) for name in names]
+
+
+    def delete_collection(self, name: str):
+        import shutil
+
+        with self._lock:
+            collection = self._collections.pop(name, None)
+        if collection is not None:
+            collection.close()
+        elif not os.path.isdir(self._collection_path(name)):
+            raise ValueError(f"Collection {name} does not exist.")
+        shutil.rmtree(self._collection_path(name), ignore_errors=True)
+
+
+    def close(self):
+        with self._lock:
+            collections = list(self._collections.values())
+            self._collections.clear()
+            self._merge_queue.clear()
+            self._merge_wakeup.notify_all()
+        for collection in collections:
+            collection.close()
+
+
+    def _collection_path(self, name: str) -> str:
+        if not _NAME_PATTERN.match(name or "") or ".." in name:
+            raise ValueError(
+                f"Expected a collection name containing 3-512 characters from [a-zA-Z0-9._-], "
+                f"starting and ending with a character in [a-zA-Z0-9]. Got: {name}"
+            )
+        return os.path.join(self.path, name)
+
+
+    def _open(self, name: str, metadata: dict = None, create: bool = True):
+        path = self._collection_path(name)
+
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is not None:
+                return collection
+
+            if not create and not os.path.isfile(os.path.join(path, "collection.json")):
+                raise ValueError(f"Collection {name} does not exist.")
+
+            collection = NumpyCollection(self, name, path, metadata=metadata)
+            self._collections[name] = collection
+            return collection
+
+
+    # Called after every write. Merges right away without the background thread.
+
+    def _schedule_merge(self, collection):
+        if not self.background_merge:
+            collection.merge()
+            return
+
+        with self._lock:
+            if collection not in self._merge_queue:
+                self._merge_queue.append(collection)
+            if self._merger is None:
+                self._merger = threading.Thread(target=self._run_merges, name="vector-store-merger", daemon=True)
+                self._merger.start()
+            self._merge_wakeup.notify()
+
+
+    def _run_merges(self):
+        while True:
+            with self._lock:
+                while not self._merge_queue:
+                    self._merge_wakeup.wait()
+                collection = self._merge_queue.pop(0)
+            try:
+                collection.merge()
+            except Exception as e:
+                print(f" - Error while merging segments of '{collection.name}': {e}")
+
+
+    # Segment.decode() of a contiguous block, from the decode cache when it has room
+
+    def _decoded_block(self, segment, rows: slice) -> np.ndarray:
+        if self.decode_cache_bytes <= 0 or segment.vectors.dtype == np.float32:
+            return segment.decode(rows)
+
+        key = (segment, rows.start)
+        with self._decoded_lock:
+            block = self._decoded.get(key)
+            if block is not None:
+                self._decoded.move_to_end(key)
+                return block
+
+        block = segment.decode(rows)
+        with self._decoded_lock:
+            if key not in self._decoded and block.nbytes <= self.decode_cache_bytes:
+                self._decoded[key] = block
+                self._decoded_bytes += block.nbytes
+                while self._decoded_bytes > self.decode_cache_bytes:
+                    _, evicted = self._decoded.popitem(last=False)
+                    self._decoded_bytes -= evicted.nbytes
+        return block
+
+
+    def _forget_segments(self, segments):
+        with self._decoded_lock:
+            for key in [key for key in self._decoded if key[0] in segments]:
+                self._decoded_bytes -= self._decoded.pop(key).nbytes
+
+
+
+class _Segment:
+
+    def __init__(self, segment_id: int, vectors, norms, scales=None, lists=None):
+        self.id = segment_id
+        self.vectors = vectors
+        self.norms = norms
+        self.scales = scales
+        self.lists = lists
+        self.alive = np.zeros(len(norms), dtype=bool)
+
+
+    @property
+    def size(self) -> int:
+        return len(self.norms)
+
+
+    @property
+    def live(self) -> int:
+        return int(np.count_nonzero(self.alive))
+
+
+    # float32 unit vectors of the given rows (a slice or an index array)
+
+    def unit_vectors(self, rows) -> np.ndarray:
+        block = self.decode(rows)
+        if self.scales is not None:
+            block *= self.scales[rows][:, None]
+        return block
+
+
+    # The stored rows as float32, without the int8 scales; scans apply those to the dot products instead
+
+    def decode(self, rows) -> np.ndarray:
+        return np.asarray(self.vectors[rows], dtype=np.float32)
+
+
+
+class NumpyCollection:
+
+    def __init__(self, client: NumpyVectorClient, name: str, path: str, metadata: dict = None):
+        self.client = client
+        self.name = name
+        self.path = path
+
+        self._lock = threading.RLock()
+        # Serializes merges of this collection; writes only wait for the short swap at the end
+        self._merge_lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        config_path = os.path.join(path, "collection.json")
+        if os.path.isfile(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                self._config = json.load(f)
+        else:
+            self._config = {
+                "name": name,
+                # Cosine unless asked otherwise; Chroma collections created by LangChain default to l2
+                "metadata": metadata or {"hnsw:space": "cosine"},
+                "dtype": client.dtype,
+                "dimensions": None,
+                "segments": [],
+                "next_segment": 1,
+            }
+            self._save_config()
+
+        self._conn = sqlite3.connect(os.path.join(path, "records.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                id TEXT PRIMARY KEY,
+                segment INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                document TEXT,
+                metadata TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_records_location ON records(segment, row)")
+        self._conn.commit()
+
+        self._centroids = None
+        centroids_path = os.path.join(path, "coarse.npy")
+        if os.path.isfile(centroids_path):
+            self._centroids = np.load(centroids_path)
+
+        self._segments = {}
+        for segment_id in self._config["segments"]:
+            self._segments[segment_id] = self._load_segment(segment_id)
+        for segment_id, row in self._conn.execute("SELECT segment, row FROM records"):
+            segment = self._segments.get(segment_id)
+            if segment is not None:
+                segment.alive[row] = True
+
+        self._remove_orphan_files()
+
+
+    @property
+    def metadata(self) -> dict:
+        return self._config["metadata"]
+
+
+    @property
+    def space(self) -> str:
+        return (self._config["metadata"] or {}).get("hnsw:space", "l2")
+
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+
+    # ---- Writes ----
+
+    def add(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        ids = _as_list(ids)
+        with self._lock:
+            existing = set(self._lookup_locations(ids))
+        keep = [index for index, chunk_id in enumerate(ids) if chunk_id not in existing]
+        if len(keep) != len(ids):
+            print(f" - Skipping {len(ids) - len(keep)} ids that already exist in '{self.name}'.")
+        if keep:
+            self.upsert(
+                ids=[ids[index] for index in keep],
+                embeddings=[embeddings[index] for index in keep],
+                metadatas=[metadatas[index] for index in keep] if metadatas is not None else None,
+                documents=[documents[index] for index in keep] if documents is not None else None
+            )
+
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        ids = _as_list(ids)
+        if not ids:
+            return
+        if embeddings is None:
+            raise ValueError("The numpy vector store needs embeddings; it does not embed documents itself")
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError(f"Expected {len(ids)} embeddings, got an array of shape {vectors.shape}")
+        metadatas = _as_list(metadatas) if metadatas is not None else [None] * len(ids)
+        documents = _as_list(documents) if documents is not None else [None] * len(ids)
+
+        # Within one call the last occurrence of an id wins
+        last = {chunk_id: index for index, chunk_id in enumerate(ids)}
+        if len(last) != len(ids):
+            order = sorted(last.values())
+            ids = [ids[index] for index in order]
+            vectors = vectors[order]
+            metadatas = [metadatas[index] for index in order]
+            documents = [documents[index] for index in order]
+
+        with self._lock:
+            self._check_dimensions(vectors.shape[1])
+            segment = self._write_segment(vectors)
+
+            # Segment files, then the segment list, then the records: a crash in between leaves dead rows only
+            self._config["segments"].append(segment.id)
+            self._save_config()
+
+            self._mark_dead(self._lookup_locations(ids).values())
+            self._conn.executemany(
+                """
+                INSERT INTO records (id, segment, row, document, metadata) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET segment = excluded.segment, row = excluded.row,
+                                              document = excluded.document, metadata = excluded.metadata
+                """,
+                [
+                    (chunk_id, segment.id, row, document, _dump_metadata(metadata))
+                    for row, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas))
+                ]
+            )
+            self._conn.commit()
+            segment.alive[:] = True
+            self._segments[segment.id] = segment
+
+        if self._needs_merge():
+            self.client._schedule_merge(self)
+
+
+    # Like Chroma: metadata keys are merged into the stored metadata (a None value removes the key).
+    # New embeddings are appended like an upsert.
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        ids = _as_list(ids)
+        if not ids:
+            return
+
+        with self._lock:
+            stored = self._fetch_records(ids)
+            missing = [chunk_id for chunk_id in ids if chunk_id not in stored]
+            if missing:
+                print(f" - Ignoring update of {len(missing)} ids that do not exist in '{self.name}'.")
+
+            if embeddings is not None:
+                present = [index for index, chunk_id in enumerate(ids) if chunk_id in stored]
+                new_metadatas = []
+                for index in present:
+                    metadata = stored[ids[index]]["metadata"]
+                    if metadatas is not None:
+                        metadata = _merge_metadata(metadata, metadatas[index])
+                    new_metadatas.append(metadata)
+                self.upsert(
+                    ids=[ids[index] for index in present],
+                    embeddings=[embeddings[index] for index in present],
+                    metadatas=new_metadatas,
+                    documents=[documents[index] if documents is not None else stored[ids[index]]["document"]
+                               for index in present]
+                )
+                return
+
+            rows = []
+            for index, chunk_id in enumerate(ids):
+                if chunk_id not in stored:
+                    continue
+                metadata = stored[chunk_id]["metadata"]
+                if metadatas is not None:
+                    metadata = _merge_metadata(metadata, metadatas[index])
+                document = documents[index] if documents is not None else stored[chunk_id]["document"]
+                rows.append((document, _dump_metadata(metadata), chunk_id))
+
+            self._conn.executemany("UPDATE records SET document = ?, metadata = ? WHERE id = ?", rows)
+            self._conn.commit()
+
+
+    def delete(self, ids=None, where: dict = None, where_document: dict = None, **kwargs):
+        with self._lock:
+            if ids is not None:
+                ids = _as_list(ids)
+                if where is not None or where_document is not None:
+                    ids = self.get(ids=ids, where=where, where_document=where_document, include=[])["ids"]
+            elif where is not None or where_document is not None:
+                ids = self.get(where=where, where_document=where_document, include=[])["ids"]
+            else:
+                return
+
+            locations = self._lookup_locations(ids)
+            self._mark_dead(locations.values())
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                self._conn.execute(f"DELETE FROM records WHERE id IN ({','.join('?' * len(batch))})", batch)
+            self._conn.commit()
+
+        if self._needs_merge():
+            self.client._schedule_merge(self)
+
+
+    # ---- Reads ----
+
+    def get(self, ids=None, where: dict = None, limit: int = None, offset: int = None,
+            include=("metadatas", "documents"), where_document: dict = None, **kwargs) -> dict:
+
+        include = list(include)
+        filtered = where is not None or where_document is not None
+        with self._lock:
+            if ids is not None:
+                ids = _as_list(ids)
+                stored = self._fetch_records(ids)
+                records = [dict(stored[chunk_id], id=chunk_id) for chunk_id in dict.fromkeys(ids) if chunk_id in stored]
+            elif not filtered:
+                query = "SELECT id, segment, row, document, metadata FROM records ORDER BY rowid"
+                params = []
+                if limit is not None or offset:
+                    query += " LIMIT ? OFFSET ?"
+                    params = [limit if limit is not None else -1, offset or 0]
+                records = [_record_from_row(row) for row in self._conn.execute(query, params)]
+            else:
+                records = [_record_from_row(row) for row in self._conn.execute(
+                    "SELECT id, segment, row, document, metadata FROM records ORDER BY rowid"
+                )]
+
+            if where is not None:
+                records = [record for record in records if _matches(record["metadata"] or {}, where)]
+            if where_document is not None:
+                records = [record for record in records if _matches_document(record["document"], where_document)]
+            if (ids is not None or filtered) and (limit is not None or offset):
+                start = offset or 0
+                records = records[start:start + limit if limit is not None else None]
+
+            segments = dict(self._segments)
+
+        return {
+            "ids": [record["id"] for record in records],
+            "documents": [record["document"] for record in records] if "documents" in include else None,
+            "metadatas": [record["metadata"] for record in records] if "metadatas" in include else None,
+            "embeddings": self._embeddings_of(records, segments) if "embeddings" in include else None,
+            "include": include,
+        }
+
+
+    # Exact nearest neighbours of every query vector over the live rows (or the rows of the probed clusters),
+    # restricted to `ids`, `where` and `where_document` when given.
+    # Distances follow the collection space like Chroma: 1 - cosine, 1 - inner product, or squared L2.
+
+    def query(self, query_embeddings, n_results: int = 10, where: dict = None, where_document: dict = None,
+              include=("metadatas", "documents", "distances"), ids=None, **kwargs) -> dict:
+
+        if n_results < 1:
+            raise ValueError(f"Number of requested results {n_results}, cannot be negative, or zero.")
+
+        include = list(include)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+
+        query_norms = np.linalg.norm(queries, axis=1)
+        unit_queries = queries / np.where(query_norms == 0, 1.0, query_norms)[:, None]
+
+        with self._lock:
+            segments = [segment for segment in self._segments.values() if segment.size]
+            filtered = where is not None or where_document is not None or ids is not None
+            allowed = self._rows_matching(where, ids, where_document) if filtered else None
+            centroids = self._centroids
+
+        probes = None
+        if centroids is not None and all(segment.lists is not None for segment in segments):
+            nprobe = min(self.client.nprobe, len(centroids))
+            probes = np.unique(np.argsort(-(unit_queries @ centroids.T), axis=1)[:, :nprobe])
+
+        count = len(queries)
+        # Top n of every query per scanned block: scores, segment ids and rows, one row per query
+        candidates = []
+
+        for segment in segments:
+            if allowed is not None and segment.id not in allowed:
+                continue
+            mask = segment.alive.copy()
+            if allowed is not None:
+                segment_mask = np.zeros(segment.size, dtype=bool)
+                segment_mask[allowed.get(segment.id, [])] = True
+                mask &= segment_mask
+            if probes is not None:
+                mask &= np.isin(segment.lists, probes)
+            if not mask.any():
+                continue
+
+            full = mask.all()
+            rows_to_scan = None if full else np.flatnonzero(mask)
+            total = segment.size if full else len(rows_to_scan)
+
+            for start in range(0, total, SCAN_BLOCK_ROWS):
+                rows = slice(start, min(start + SCAN_BLOCK_ROWS, total)) if full else rows_to_scan[start:start + SCAN_BLOCK_ROWS]
+                block = self.client._decoded_block(segment, rows) if full else segment.decode(rows)
+                cosine = unit_queries @ block.T
+                if segment.scales is not None:
+                    cosine *= segment.scales[rows]
+                scores = self._scores(cosine, segment.norms[rows], query_norms)
+                row_ids = np.arange(rows.start, rows.stop) if full else rows
+
+                if scores.shape[1] > n_results:
+                    top = np.argpartition(-scores, n_results - 1, axis=1)[:, :n_results]
+                    scores = np.take_along_axis(scores, top, axis=1)
+                    row_ids = row_ids[top]
+                else:
+                    row_ids = np.broadcast_to(row_ids, scores.shape)
+                candidates.append((scores, np.full(scores.shape, segment.id), row_ids))
+
+                if len(candidates) >= 256:
+                    candidates = [_top_candidates(candidates, n_results)]
+
+        if candidates:
+            best_scores, best_segments, best_rows = _top_candidates(candidates, n_results)
+        else:
+            best_scores = best_segments = best_rows = np.empty((count, 0))
+
+        ranked = []
+        for position in range(count):
+            order = np.argsort(-best_scores[position], kind="stable")
+            locations = list(zip(best_segments[position][order].tolist(), best_rows[position][order].tolist()))
+            ranked.append((locations, best_scores[position][order]))
+
+        # One lookup for the whole batch. Rows moved by a merge that finished meanwhile are not found;
+        # such a query returns fewer results rather than stale ones.
+        with self._lock:
+            stored = self._records_at([location for locations, _ in ranked for location in locations])
+
+        results = {"ids": [], "distances": [], "documents": [], "metadatas": [], "embeddings": [], "include": include}
+        for position, (locations, scores) in enumerate(ranked):
+            found = [index for index, location in enumerate(locations) if location in stored]
+            records = [stored[locations[index]] for index in found]
+
+            results["ids"].append([record["id"] for record in records])
+            results["distances"].append([self._distance(float(scores[index]), float(query_norms[position])) for index in found])
+            results["documents"].append([record["document"] for record in records])
+            results["metadatas"].append([record["metadata"] for record in records])
+            if "embeddings" in include:
+                results["embeddings"].append(self._embeddings_of(records, {segment.id: segment for segment in segments}))
+
+        for field in ("distances", "documents", "metadatas", "embeddings"):
+            if field not in include:
+                results[field] = None
+        return results
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            segments = list(self._segments.values())
+            size = sum(segment.size for segment in segments)
+            live = sum(segment.live for segment in segments)
+            disk_bytes = sum(
+                os.path.getsize(os.path.join(self.path, entry)) for entry in os.listdir(self.path)
+                if os.path.isfile(os.path.join(self.path, entry))
+            )
+            return {
+                "name": self.name,
+                "dtype": self._config["dtype"],
+                "dimensions": self._config["dimensions"],
+                "segments": len(segments),
+                "rows": size,
+                "live_rows": live,
+                "dead_rows": size - live,
+                "coarse_clusters": len(self._centroids) if self._centroids is not None else 0,
+                "disk_bytes": disk_bytes,
+            }
+
+
+    # ---- Merging ----
+
+    def _needs_merge(self) -> bool:
+        with self._lock:
+            segments = list(self._segments.values())
+            if len(segments) > self.client.max_segments:
+                return True
+            size = sum(segment.size for segment in segments)
+            dead = size - sum(segment.live for segment in segments)
+            if size and dead / size > MAX_DEAD_FRACTION:
+                return True
+            return self._wants_coarse_index(size - dead)
+
+
+    def _wants_coarse_index(self, live: int) -> bool:
+        return self.client.coarse_index and self._centroids is None and live >= self.client.coarse_min_vectors
+
+
+    # Copies the live rows of the selected segments into one new segment and swaps it in.
+    # Rows are copied in their quantized form, so merging never loses precision.
+
+    def merge(self, force: bool = False) -> dict:
+        with self._merge_lock:
+            if not force and not self._needs_merge():
+                return {"merged_segments": 0}
+
+            started = time.perf_counter()
+            with self._lock:
+                sources = self._merge_sources(force)
+                if not sources:
+                    return {"merged_segments": 0}
+
+                snapshot = {segment.id: np.flatnonzero(segment.alive) for segment in sources}
+                if not any(len(rows) for rows in snapshot.values()):
+                    # Nothing left alive: drop the segments without writing a new one
+                    self._drop_segments({segment.id for segment in sources})
+                    return {"merged_segments": len(sources), "rows": 0, "live_rows": 0}
+
+                live = sum(segment.live for segment in self._segments.values())
+                rebuild_coarse = (self.client.coarse_index and live >= self.client.coarse_min_vectors
+                                  and (self._centroids is None or len(sources) == len(self._segments)))
+                segment_id = self._config["next_segment"]
+                self._config["next_segment"] += 1
+                self._save_config()
+
+            vectors = np.concatenate([np.asarray(segment.vectors[snapshot[segment.id]]) for segment in sources])
+            norms = np.concatenate([np.asarray(segment.norms[snapshot[segment.id]]) for segment in sources])
+            scales = None
+            if sources[0].scales is not None:
+                scales = np.concatenate([np.asarray(segment.scales[snapshot[segment.id]]) for segment in sources])
+
+            centroids = self._centroids
+            if rebuild_coarse:
+                centroids = _train_coarse(_dequantize(vectors, scales))
+            lists = _assign_lists(_dequantize(vectors, scales), centroids) if centroids is not None else None
+
+            merged = self._save_segment(segment_id, vectors, norms, scales, lists)
+
+            with self._lock:
+                # List the new segment before pointing records at it (see upsert)
+                self._config["segments"].append(segment_id)
+                self._save_config()
+
+                moves = []
+                offset = 0
+                for segment in sources:
+                    rows = snapshot[segment.id]
+                    moves.extend(
+                        (segment_id, offset + index, segment.id, int(row)) for index, row in enumerate(rows)
+                    )
+                    offset += len(rows)
+                # Records written or deleted during the merge no longer point at the old rows and stay untouched
+                self._conn.executemany("UPDATE records SET segment = ?, row = ? WHERE segment = ? AND row = ?", moves)
+                self._conn.commit()
+
+                for (row,) in self._conn.execute("SELECT row FROM records WHERE segment = ?", (segment_id,)):
+                    merged.alive[row] = True
+                self._segments[segment_id] = merged
+
+                if rebuild_coarse:
+                    np.save(os.path.join(self.path, "coarse.npy"), centroids)
+                    self._centroids = centroids
+                    # Segments written during the merge were assigned to the old clusters
+                    for segment in self._segments.values():
+                        if segment.id != segment_id and segment not in sources:
+                            segment.lists = self._write_lists(segment.id, _assign_lists(segment.unit_vectors(slice(None)), centroids))
+
+                self._drop_segments({segment.id for segment in sources})
+
+            report = {
+                "merged_segments": len(sources),
+                "rows": merged.size,
+                "live_rows": merged.live,
+                "coarse_clusters": len(centroids) if centroids is not None else 0,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+            print(f" - Merged {len(sources)} segments of '{self.name}' into one with {merged.size} rows in {report['elapsed_ms']} ms.")
+            return report
+
+
+    def _drop_segments(self, segment_ids: set):
+        self._config["segments"] = [sid for sid in self._config["segments"] if sid not in segment_ids]
+        self._save_config()
+        dropped = [self._segments.pop(sid) for sid in segment_ids if sid in self._segments]
+        self.client._forget_segments(dropped)
+        for sid in segment_ids:
+            self._remove_segment_files(sid)
+
+
+    # Merges everything, except a large and mostly live segment that would only be copied again
+
+    def _merge_sources(self, force: bool) -> list:
+        segments = sorted(self._segments.values(), key=lambda segment: segment.size)
+        if not segments:
+            return []
+
+        largest, others = segments[-1], segments[:-1]
+        if (not force and others
+                and largest.live >= (1 - MAX_DEAD_FRACTION) * largest.size
+                and largest.size > 4 * sum(segment.size for segment in others)
+                and not self._wants_coarse_index(sum(segment.live for segment in segments))):
+            return others
+        return segments
+
+
+    # ---- Storage ----
+
+    def _segment_file(self, segment_id: int, kind: str) -> str:
+        return os.path.join(self.path, f"seg-{segment_id:06d}.{kind}.npy")
+
+
+    def _write_segment(self, vectors: np.ndarray) -> _Segment:
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        unit = vectors / np.where(norms == 0, 1.0, norms)[:, None]
+        quantized, scales = _quantize(unit, self._config["dtype"])
+        lists = _assign_lists(unit, self._centroids) if self._centroids is not None else None
+
+        segment_id = self._config["next_segment"]
+        self._config["next_segment"] += 1
+        return self._save_segment(segment_id, quantized, norms, scales, lists)
+
+
+    def _save_segment(self, segment_id: int, vectors, norms, scales=None, lists=None) -> _Segment:
+        _save_array(self._segment_file(segment_id, "vectors"), vectors)
+        _save_array(self._segment_file(segment_id, "norms"), norms)
+        if scales is not None:
+            _save_array(self._segment_file(segment_id, "scales"), scales)
+        segment = self._load_segment(segment_id)
+        if lists is not None:
+            segment.lists = self._write_lists(segment_id, lists)
+        return segment
+
+
+    def _write_lists(self, segment_id: int, lists: np.ndarray):
+        _save_array(self._segment_file(segment_id, "lists"), lists)
+        return np.load(self._segment_file(segment_id, "lists"), mmap_mode="r")
+
+
+    def _load_segment(self, segment_id: int) -> _Segment:
+        def load(kind):
+            path = self._segment_file(segment_id, kind)
+            return np.load(path, mmap_mode="r") if os.path.isfile(path) else None
+
+        lists = load("lists") if self._centroids is not None else None
+        return _Segment(segment_id, load("vectors"), load("norms"), scales=load("scales"), lists=lists)
+
+
+    def _remove_segment_files(self, segment_id: int):
+        for kind in ("vectors", "norms", "scales", "lists"):
+            path = self._segment_file(segment_id, kind)
+            try:
+                if os.path.isfile(path):
+                    os.remove(path)
+            except OSError as e:
+                # Still mapped by a running query on Windows; removed as an orphan on the next start
+                print(f" - Warning: Could not delete segment file '{path}': {e}")
+
+
+    # Files of segments that are not listed, left over from an interrupted write or merge
+
+    def _remove_orphan_files(self):
+        listed = set(self._config["segments"])
+        for entry in os.listdir(self.path):
+            match = re.match(r"^seg-(\d+)\.\w+\.npy(\.tmp)?$", entry)
+            if match and int(match.group(1)) not in listed:
+                try:
+                    os.remove(os.path.join(self.path, entry))
+                except OSError:
+                    pass
+
+
+    def _save_config(self):
+        path = os.path.join(self.path, "collection.json")
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self._config, f)
+        os.replace(path + ".tmp", path)
+
+
+    def _check_dimensions(self, dimensions: int):
+        if self._config["dimensions"] is None:
+            self._config["dimensions"] = int(dimensions)
+        elif self._config["dimensions"] != dimensions:
+            raise ValueError(f"Collection '{self.name}' expects embeddings of dimension "
+                             f"{self._config['dimensions']}, got {dimensions}")
+
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self.client._forget_segments(list(self._segments.values()))
+            self._segments.clear()
+
+
+    # ---- Records ----
+
+    def _lookup_locations(self, ids: list) -> dict:
+        locations = {}
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            for chunk_id, segment_id, row in self._conn.execute(
+                f"SELECT id, segment, row FROM records WHERE id IN ({','.join('?' * len(batch))})", batch
+            ):
+                locations[chunk_id] = (segment_id, row)
+        return locations
+
+
+    def _fetch_records(self, ids: list) -> dict:
+        records = {}
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            for row in self._conn.execute(
+                f"SELECT id, segment, row, document, metadata FROM records WHERE id IN ({','.join('?' * len(batch))})", batch
+            ):
+                record = _record_from_row(row)
+                records[record["id"]] = record
+        return records
+
+
+    def _records_at(self, locations: list) -> dict:
+        records = {}
+        by_segment = {}
+        for segment_id, row in locations:
+            by_segment.setdefault(segment_id, []).append(row)
+
+        for segment_id, rows in by_segment.items():
+            for start in range(0, len(rows), 500):
+                batch = rows[start:start + 500]
+                for row in self._conn.execute(
+                    f"SELECT id, segment, row, document, metadata FROM records "
+                    f"WHERE segment = ? AND row IN ({','.join('?' * len(batch))})", [segment_id] + batch
+                ):
+                    record = _record_from_row(row)
+                    records[(record["segment"], record["row"])] = record
+        return records
+
+
+    # segment id -> row indexes of the records whose metadata matches `where` and whose document matches
+    # `where_document`, among `ids` when given
+
+    def _rows_matching(self, where: dict = None, ids=None, where_document: dict = None) -> dict:
+        if ids is None:
+            rows = self._conn.execute("SELECT segment, row, metadata, document FROM records")
+        else:
+            ids = _as_list(ids)
+            rows = []
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows.extend(self._conn.execute(
+                    f"SELECT segment, row, metadata, document FROM records WHERE id IN ({','.join('?' * len(batch))})", batch
+                ))
+
+        allowed = {}
+        for segment_id, row, metadata, document in rows:
+            if where is not None and not _matches(json.loads(metadata) if metadata else {}, where):
+                continue
+            if where_document is not None and not _matches_document(document, where_document):
+                continue
+            allowed.setdefault(segment_id, []).append(row)
+        return {segment_id: np.asarray(rows, dtype=np.int64) for segment_id, rows in allowed.items()}
+
+
+    def _mark_dead(self, locations):
+        for segment_id, row in locations:
+            segment = self._segments.get(segment_id)
+            if segment is not None:
+                segment.alive[row] = False
+
+
+    def _embeddings_of(self, records: list, segments: dict) -> list:
+        embeddings = []
+        for record in records:
+            segment = segments.get(record["segment"]) or self._segments.get(record["segment"])
+            row = record["row"]
+            vector = segment.unit_vectors(slice(row, row + 1))[0] * segment.norms[row]
+            embeddings.append(vector)
+        return embeddings
+
+
+    # Ranking score per collection space; higher is closer
+
+    def _scores(self, cosine: np.ndarray, norms: np.ndarray, query_norms: np.ndarray) -> np.ndarray:
+        space = self.space
+        if space == "cosine":
+            return cosine
+        if space == "ip":
+            return cosine * norms[None, :] * query_norms[:, None]
+        # Negative squared L2 distance
+        return 2.0 * cosine * norms[None, :] * query_norms[:, None] - norms[None, :] ** 2 - query_norms[:, None] ** 2
+
+
+    def _distance(self, score: float, query_norm: float) -> float:
+        if self.space in ("cosine", "ip"):
+            return 1.0 - score
+        return max(0.0, -score)
+
+
+
+# Keeps the best `n` of the concatenated (scores, segment ids, rows) candidates of every query
+
+def _top_candidates(candidates: list, n: int):
+    scores, segments, rows = (np.concatenate(parts, axis=1) for parts in zip(*candidates))
+    if scores.shape[1] > n:
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        scores, segments, rows = (np.take_along_axis(array, top, axis=1) for array in (scores, segments, rows))
+    return scores, segments, rows
+
+
+
+def _quantize(unit: np.ndarray, dtype: str):
+    if dtype == "float32":
+        return unit.astype(np.float32), None
+    if dtype == "float16":
+        return unit.astype(np.float16), None
+
+    # int8 with one scale per vector: the largest component maps onto 127
+    peaks = np.abs(unit).max(axis=1)
+    scales = np.where(peaks == 0, 1.0, peaks / 127.0).astype(np.float32)
+    quantized = np.clip(np.rint(unit / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales
+
+
+def _dequantize(vectors: np.ndarray, scales: np.ndarray = None) -> np.ndarray:
+    unit = np.asarray(vectors, dtype=np.float32)
+    if scales is not None:
+        unit = unit * scales[:, None]
+    return unit
+
+
+
+# Spherical k-means on a sample of the vectors; about sqrt(n) clusters
+
+def _train_coarse(unit: np.ndarray, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    clusters = int(min(4096, max(16, np.sqrt(len(unit)))))
+    sample = unit[rng.choice(len(unit), size=min(len(unit), COARSE_TRAINING_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=clusters, replace=False)].copy()
+
+    for _ in range(COARSE_ITERATIONS):
+        assignment = _assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=clusters) == 0
+        # Empty clusters restart from random sample points
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms == 0, 1.0, norms)
+
+    return centroids.astype(np.float32)
+
+
+def _assign_lists(unit: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    lists = np.empty(len(unit), dtype=np.int32)
+    for start in range(0, len(unit), SCAN_BLOCK_ROWS):
+        block = unit[start:start + SCAN_BLOCK_ROWS]
+        lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return lists
+
+
+def _save_array(path: str, array: np.ndarray):
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(path + ".tmp", path)
+
+
+def _as_list(values) -> list:
+    if isinstance(values, (str, dict)):
+        return [values]
+    return list(values)
+
+
+def _dump_metadata(metadata) -> str:
+    return json.dumps(metadata) if metadata else None
+
+
+def _merge_metadata(stored: dict, update: dict) -> dict:
+    merged = dict(stored or {})
+    for key, value in (update or {}).items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = value
+    return merged or None
+
+
+def _record_from_row(row) -> dict:
+    chunk_id, segment_id, row_index, document, metadata = row
+    return {
+        "id": chunk_id,
+        "segment": segment_id,
+        "row": row_index,
+        "document": document,
+        "metadata": json.loads(metadata) if metadata else None,
+    }
+
+
+
+# Chroma's metadata filter language: {"key": value}, {"key": {"$op": value}} with $eq, $ne, $gt, $gte, $lt,
+# $lte, $in and $nin, and {"$and": [...]} / {"$or": [...]}
+
+def _matches(metadata: dict, where: dict) -> bool:
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            if not all(_compare(metadata.get(key), operator, operand) for operator, operand in condition.items()):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _compare(value, operator: str, operand) -> bool:
+    if operator == "$eq":
+        return value == operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if value is None:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    raise ValueError(f"Unsupported filter operator '{operator}'")
+
+
+
+# Chroma's document filter language: {"$contains": text}, {"$not_contains": text}, {"$regex": pattern},
+# {"$not_regex": pattern}, and {"$and": [...]} / {"$or": [...]}. Substring matches are case-sensitive like Chroma's.
+
+def _matches_document(document, where_document: dict) -> bool:
+    document = document or ""
+    for operator, operand in where_document.items():
+        if operator == "$and":
+            matched = all(_matches_document(document, clause) for clause in operand)
+        elif operator == "$or":
+            matched = any(_matches_document(document, clause) for clause in operand)
+        elif operator == "$contains":
+            matched = operand in document
+        elif operator == "$not_contains":
+            matched = operand not in document
+        elif operator == "$regex":
+            matched = re.search(operand, document) is not None
+        elif operator == "$not_regex":
+            matched = re.search(operand, document) is None
+        else:
+            raise ValueError(f"Unsupported document filter operator '{operator}'")
+        if not matched:
+            return False
+    return True
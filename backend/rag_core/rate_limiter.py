@@ -0,0 +1,340 @@
+import os
+import re
+import time
+import queue
+import random
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from .metrics import get_metrics
+
+
+"""
+Process-wide rate limiting for every Gemini call (vision, embedding and text generation).
+A token bucket paces requests, slows down when the API answers with 429 and speeds back up
+while calls succeed. BatchedEmbeddings groups chunk embeddings from concurrent ingests into
+maximum-size batch requests on top of it.
+"""
+
+
+# Gemini task type of query embeddings (what embed_query uses by default)
+QUERY_TASK_TYPE = "retrieval_query"
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(self, rate: float = 5.0, burst: float = 10.0, min_rate: float = 0.1, max_rate: float = None,
+                 increase_step: float = 0.05, decrease_factor: float = 0.5, cooldown: float = 5.0):
+
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.retries = 0
+
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+    # Blocks until `cost` tokens are available
+
+    def acquire(self, cost: float = 1.0):
+        cost = min(cost, self.burst)
+
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= cost:
+                    self._tokens -= cost
+                    self.requests += 1
+                    return
+                else:
+                    wait = (cost - self._tokens) / self.rate
+
+                self._cond.wait(wait)
+
+
+    # Additive increase: every successful call nudges the rate back up towards the maximum
+
+    def on_success(self):
+        with self._cond:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+
+    def record_retry(self):
+        with self._cond:
+            self.retries += 1
+
+
+    # Multiplicative decrease: a 429 halves the rate and pauses every caller for a cooldown
+
+    def on_rate_limited(self, retry_after: float = None):
+        with self._cond:
+            self.rate_limited += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + (retry_after or self.cooldown))
+            self._cond.notify_all()
+
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "rate_per_second": round(self.rate, 3),
+                "max_rate_per_second": self.max_rate,
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+            }
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+# Returns the limiter shared by every Gemini call in this process
+
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    global _default_limiter
+
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = AdaptiveRateLimiter(
+                rate=float(os.getenv("GEMINI_REQUESTS_PER_SECOND", "5")),
+                burst=float(os.getenv("GEMINI_BURST", "10"))
+            )
+        return _default_limiter
+
+
+_HTTP_429 = re.compile(r"(?<!\d)429(?!\d)")
+
+
+# True only for HTTP 429 / ResourceExhausted, the errors a retry can fix.
+# Other quota errors (e.g. a billing quota or a disabled API) mention "quota" too but fail the same way on
+# every retry, so they are raised straight away.
+
+def is_rate_limit_error(error: Exception) -> bool:
+    if "ResourceExhausted" in type(error).__name__:
+        return True
+    code = getattr(error, "code", None)
+    if code is not None and not callable(code):
+        return getattr(code, "value", code) == 429
+    return _HTTP_429.search(str(error)) is not None
+
+
+# Calls `func` under the shared limiter and retries with exponential backoff when the API answers 429.
+# Any other error is raised straight away.
+
+def call_with_rate_limit(func, *args, limiter: AdaptiveRateLimiter = None, cost: float = 1.0,
+                         max_retries: int = 5, base_delay: float = 2.0, **kwargs):
+
+    limiter = limiter or get_rate_limiter()
+    metrics = get_metrics()
+    delay = base_delay
+
+    for attempt in range(max_retries):
+        started = time.perf_counter()
+        limiter.acquire(cost)
+        metrics.observe("glimpse_gemini_limiter_wait_seconds", time.perf_counter() - started)
+        metrics.inc("glimpse_gemini_requests_total")
+        try:
+            result = func(*args, **kwargs)
+            limiter.on_success()
+            return result
+
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                metrics.inc("glimpse_gemini_errors_total")
+                raise
+
+            metrics.inc("glimpse_gemini_rate_limited_total")
+
+            # Jitter keeps concurrent callers from retrying in lockstep
+            wait = delay * (1 + random.random() * 0.25)
+            limiter.on_rate_limited(retry_after=wait)
+            if attempt == max_retries - 1:
+                print(f" - Rate limit hit. Giving up after {max_retries} attempts.")
+                raise
+
+            print(f" - Rate limit hit. Retrying in {wait:.1f}s... (Attempt {attempt+1}/{max_retries})")
+            limiter.record_retry()
+            metrics.inc("glimpse_gemini_retries_total")
+            delay *= 2
+
+
+class _EmbeddingRequest:
+
+    __slots__ = ("texts", "results", "next_index", "remaining", "future")
+
+    def __init__(self, texts: list):
+        self.texts = texts
+        self.results = [None] * len(texts)
+        self.next_index = 0
+        self.remaining = len(texts)
+        self.future = Future()
+
+
+
+# Embedding model wrapper that funnels embed_documents calls from every thread through one dispatcher.
+# The dispatcher waits up to `max_wait` seconds to fill a batch of `max_batch_size` texts, so
+# small concurrent ingests share API requests and large ones are split into maximum-size batches.
+# Up to `max_concurrency` batch requests are in flight at once; the shared limiter still paces them.
+
+class BatchedEmbeddings(Embeddings):
+
+    def __init__(self, embedding_model, limiter: AdaptiveRateLimiter = None,
+                 max_batch_size: int = 100, max_wait: float = 0.05, max_concurrency: int = 4):
+
+        self.embedding_model = embedding_model
+        self.limiter = limiter or get_rate_limiter()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+
+        self.batches = 0
+        self.texts_embedded = 0
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        # Bounds the batches in flight; the dispatcher blocks on it before handing out the next one
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._senders = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding-sender")
+        self._worker = threading.Thread(target=self._run, name="embedding-dispatcher", daemon=True)
+        self._worker.start()
+
+
+    # Read through, so a lazily created model is not built just to look up its name
+
+    @property
+    def model(self):
+        return getattr(self.embedding_model, "model", None)
+
+
+    def embed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+
+        request = _EmbeddingRequest(list(texts))
+        self._queue.put(request)
+        return request.future.result()
+
+
+    def embed_query(self, text: str) -> list:
+        return call_with_rate_limit(self.embedding_model.embed_query, text, limiter=self.limiter)
+
+
+    # Query batches skip the dispatcher: they already arrive as one list, so they are only split into
+    # maximum-size requests. Gemini embeds them as queries (task type "retrieval_query"), like embed_query does.
+
+    def embed_queries(self, texts: list) -> list:
+        vectors = []
+        for start in range(0, len(texts), self.max_batch_size):
+            batch = list(texts[start:start + self.max_batch_size])
+            vectors.extend(call_with_rate_limit(self._embed_query_batch, batch, limiter=self.limiter))
+
+        with self._stats_lock:
+            self.batches += (len(texts) + self.max_batch_size - 1) // self.max_batch_size
+            self.texts_embedded += len(texts)
+        return vectors
+
+
+    def _embed_query_batch(self, texts: list) -> list:
+        batch_embed = getattr(self.embedding_model, "embed_queries", None)
+        if batch_embed is not None:
+            return batch_embed(texts)
+        return self.embedding_model.embed_documents(texts, task_type=QUERY_TASK_TYPE)
+
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "texts": self.texts_embedded,
+            "average_batch_size": round(self.texts_embedded / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+    def _run(self):
+        pending = deque()
+
+        while True:
+            if not pending:
+                pending.append(self._queue.get())
+
+            # Wait for a free slot first, so callers that arrive meanwhile still join this batch
+            self._slots.acquire()
+
+            # Give concurrent callers a short window to join the batch
+            deadline = time.monotonic() + self.max_wait
+            while sum(len(request.texts) - request.next_index for request in pending) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            batch = []
+            while pending and len(batch) < self.max_batch_size:
+                request = pending[0]
+                take = min(self.max_batch_size - len(batch), len(request.texts) - request.next_index)
+                batch.extend((request, index) for index in range(request.next_index, request.next_index + take))
+                request.next_index += take
+                if request.next_index == len(request.texts):
+                    pending.popleft()
+
+            self._senders.submit(self._send, batch)
+
+            # Requests whose earlier batch failed are not sent any further
+            pending = deque(request for request in pending if not request.future.done())
+
+
+    # Runs on the sender pool: one API request for a batch of (request, index) pairs
+
+    def _send(self, batch: list):
+        try:
+            vectors = call_with_rate_limit(
+                self.embedding_model.embed_documents,
+                [request.texts[index] for request, index in batch],
+                limiter=self.limiter
+            )
+        except Exception as e:
+            for request, _ in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        with self._stats_lock:
+            self.batches += 1
+            self.texts_embedded += len(batch)
+
+            # Batches of one request can finish out of order, so completion is counted under the lock
+            for (request, index), vector in zip(batch, vectors):
+                request.results[index] = vector
+                request.remaining -= 1
+                if request.remaining == 0 and not request.future.done():
+                    request.future.set_result(request.results)
@@ -1,49 +1,843 @@
-from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-import google.generativeai as genai
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from langchain_core.documents import Document
+
+from .rate_limiter import call_with_rate_limit
+from .embedding_cache import embed_queries
+from .context import pack_context
+from .metrics import get_metrics, span, timed_iter
 
 
 """
 Performs the full RAG pipeline: retrieves context, then generates an answer.
 """
 
-def get_rag_answer(query: str, collection_name: str, chroma_client, embedding_model, text_generation_model):
+
+NO_CONTEXT_ANSWER = "I could not any relevant information in the knowledge base to answer your question."
+ERROR_ANSWER = "Sorry, an error occured while trying to answer your question."
+
+# Retrieval settings. Chunks scoring below RELEVANCE_THRESHOLD (cosine similarity) are never sent to the LLM,
+# and chunks more than RELEVANCE_MARGIN below the best hit are dropped, so k adapts to the query.
+DEFAULT_K = 5
+CANDIDATE_K = int(os.getenv("RETRIEVAL_CANDIDATE_K", "40"))
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.5"))
+RELEVANCE_MARGIN = float(os.getenv("RELEVANCE_MARGIN", "0.15"))
+
+# Maximal marginal relevance over the CANDIDATE_K candidates: every pick trades relevance against similarity
+# to the chunks picked before it, so near-identical hits (re-uploads, repeated sections) do not fill all k slots.
+# MMR_LAMBDA = 1 is plain relevance order.
+MMR_ENABLED = os.getenv("RETRIEVAL_MMR", "1") == "1"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# Answers generated at the same time for one batch query request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_QUERY_CONCURRENCY", "4"))
+
+
+
+# Two-tier cache for repeated questions.
+# Tier 1 is an exact-match LRU from the normalized query text to its embedding.
+# Tier 2 is a per-collection semantic cache that returns a stored answer when a new query
+# embedding is within `similarity_threshold` (cosine) of one that was already answered.
+# Tier 2 must be invalidated whenever ingestion changes the collection.
+
+class QueryCache:
+
+    def __init__(self, max_embeddings: int = 1024, max_answers: int = 512,
+                 similarity_threshold: float = 0.95, answer_ttl: float = 3600.0):
+
+        self.max_embeddings = max_embeddings
+        self.max_answers = max_answers
+        self.similarity_threshold = similarity_threshold
+        self.answer_ttl = answer_ttl
+
+        self._embeddings = OrderedDict()
+        self._answers = {}
+        self._matrices = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+        self.embedding_hits = 0
+        self.embedding_misses = 0
+        self.answer_hits = 0
+        self.answer_misses = 0
+        self.invalidations = 0
+
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+
+    def get_embedding(self, query: str):
+        key = self.normalize(query)
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is None:
+                self.embedding_misses += 1
+                return None
+            self._embeddings.move_to_end(key)
+            self.embedding_hits += 1
+            return embedding
+
+
+    def put_embedding(self, query: str, embedding: list):
+        key = self.normalize(query)
+        with self._lock:
+            self._embeddings[key] = embedding
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.max_embeddings:
+                self._embeddings.popitem(last=False)
+
+
+    # Returns the cached {"answer", "sources", "scores", "chunk_ids"} entry closest to `embedding`, if it is similar enough
+
+    def get_answer(self, collection_name: str, embedding: list):
+        with self._lock:
+            entries = self._answers.get(collection_name)
+            if not entries:
+                self.answer_misses += 1
+                return None
+
+            now = time.time()
+            fresh = [entry for entry in entries if now - entry["created_at"] <= self.answer_ttl]
+            if len(fresh) != len(entries):
+                self._answers[collection_name] = entries = fresh
+                self._matrices.pop(collection_name, None)
+                if not entries:
+                    self.answer_misses += 1
+                    return None
+
+            matrix = self._matrices.get(collection_name)
+            if matrix is None:
+                matrix = np.vstack([entry["vector"] for entry in entries])
+                self._matrices[collection_name] = matrix
+
+            similarities = matrix @ _unit_vector(embedding)
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.similarity_threshold:
+                self.answer_misses += 1
+                return None
+
+            self.answer_hits += 1
+            entry = entries[best]
+            return {
+                "answer": entry["answer"],
+                "sources": entry["sources"],
+                "scores": entry["scores"],
+                "chunk_ids": entry["chunk_ids"],
+                "similarity": float(similarities[best]),
+            }
+
+
+    # Incremented by every invalidation; answers generated against an older version are not stored
+
+    def version(self, collection_name: str) -> int:
+        with self._lock:
+            return self._versions.get(collection_name, 0)
+
+
+    def put_answer(self, collection_name: str, embedding: list, answer: str, sources: list,
+                   version: int = None, scores: list = None, chunk_ids: list = None):
+        with self._lock:
+            if version is not None and version != self._versions.get(collection_name, 0):
+                return
+            entries = self._answers.setdefault(collection_name, [])
+            entries.append({
+                "vector": _unit_vector(embedding),
+                "answer": answer,
+                "sources": sources,
+                "scores": scores or [],
+                "chunk_ids": chunk_ids or [],
+                "created_at": time.time(),
+            })
+            if len(entries) > self.max_answers:
+                del entries[:len(entries) - self.max_answers]
+            self._matrices.pop(collection_name, None)
+
+
+    # Drops every cached answer of a collection. Query embeddings stay valid because they do not depend on it.
+
+    def invalidate(self, collection_name: str):
+        with self._lock:
+            self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+            if self._answers.pop(collection_name, None):
+                self.invalidations += 1
+            self._matrices.pop(collection_name, None)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            embedding_lookups = self.embedding_hits + self.embedding_misses
+            answer_lookups = self.answer_hits + self.answer_misses
+            return {
+                "embedding_entries": len(self._embeddings),
+                "embedding_hits": self.embedding_hits,
+                "embedding_misses": self.embedding_misses,
+                "embedding_hit_rate": round(self.embedding_hits / embedding_lookups, 4) if embedding_lookups else 0.0,
+                "answer_entries": sum(len(entries) for entries in self._answers.values()),
+                "answer_hits": self.answer_hits,
+                "answer_misses": self.answer_misses,
+                "answer_hit_rate": round(self.answer_hits / answer_lookups, 4) if answer_lookups else 0.0,
+                "invalidations": self.invalidations,
+                "similarity_threshold": self.similarity_threshold,
+            }
+
+
+def _unit_vector(embedding: list) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# `retriever` can be passed by a long-lived engine (see rag_core.engine); otherwise one is built for this call.
+# With a `query_cache`, repeated and near-identical questions skip the embedding and generation calls.
+# `candidate_ids` restricts the search to those chunks (see ingestion.manifest.resolve_filters); scoped
+# queries bypass the semantic answer cache, whose answers were produced from the whole collection.
+
+def get_rag_answer(query: str, collection_name: str, chroma_client, embedding_model, text_generation_model,
+                   retriever=None, query_cache: QueryCache = None, relevance_threshold: float = None,
+                   candidate_ids: list = None):
+
+    return get_rag_result(
+        query=query,
+        collection_name=collection_name,
+        chroma_client=chroma_client,
+        embedding_model=embedding_model,
+        text_generation_model=text_generation_model,
+        retriever=retriever,
+        query_cache=query_cache,
+        relevance_threshold=relevance_threshold,
+        candidate_ids=candidate_ids
+    )["answer"]
+
+
+
+# Runs the RAG pipeline and returns the answer together with its sources, retrieval scores and the ids of
+# the chunks it was generated from. When no chunk scores above `relevance_threshold`, the canned answer is
+# returned without calling the LLM.
+# A conversation turn (see rag_core.conversation) passes the bounded `history` text, which goes into the prompt,
+# and `carry_ids`, the chunks of the previous turn, which compete with the search results for the k slots.
+# Such turns bypass the semantic answer cache, like scoped queries.
+
+def get_rag_result(query: str, collection_name: str, chroma_client, embedding_model, text_generation_model,
+                   retriever=None, query_cache: QueryCache = None, relevance_threshold: float = None,
+                   candidate_ids: list = None, history: str = None, carry_ids: list = None) -> dict:
 
     print(f"\n Querying collection '{collection_name}' with: '{query}'")
 
     try:
+        retrieval = _retrieve(query, collection_name, chroma_client, embedding_model, retriever,
+                              query_cache, relevance_threshold, candidate_ids, history, carry_ids)
+
+        if retrieval["cached"] or retrieval["gated"]:
+            return _result_from_retrieval(retrieval)
+
+        print(f" - Found {len(retrieval['docs'])} relevant context snippets.")
+        print(" - Synthesis final answer with Gemini")
+
+        return _generate_answer(query, collection_name, retrieval, text_generation_model, query_cache)
+
+    except Exception as e:
+        print(f" - An error occured during the RAG process: {e}")
+        return _error_result()
+
+
+
+# Answers many questions against one collection in a single pass. Uncached queries are embedded with one
+# batched call and searched with one multi-query Chroma request; answers are then generated on up to
+# `max_concurrency` threads. Yields a "result" event per query as soon as it is ready (in completion order,
+# each carrying its `index` in `queries`), then a "done" event with the timings of the shared stages.
+
+def iter_rag_results_batch(queries: list, collection_name: str, chroma_client, embedding_model, text_generation_model,
+                           retriever=None, query_cache: QueryCache = None, relevance_threshold: float = None,
+                           max_concurrency: int = BATCH_CONCURRENCY, candidate_ids: list = None):
+
+    print(f"\n Batch querying collection '{collection_name}' with {len(queries)} queries")
+    started = time.perf_counter()
+
+    try:
+        retrievals, timings = _retrieve_batch(queries, collection_name, chroma_client, embedding_model, retriever,
+                                              query_cache, relevance_threshold, candidate_ids)
+    except Exception as e:
+        print(f" - An error occured during the batch retrieval: {e}")
+        for index, query in enumerate(queries):
+            yield {"event": "result", "data": _batch_entry(index, query, _error_result(), started)}
+        yield {"event": "done", "data": {"count": len(queries), "timings": _elapsed_timings({}, started)}}
+        return
+
+    # Cached and gated queries are complete already
+    pending = []
+    for index, retrieval in enumerate(retrievals):
+        if retrieval["cached"] or retrieval["gated"]:
+            yield {"event": "result", "data": _batch_entry(index, queries[index], _result_from_retrieval(retrieval), started)}
+        else:
+            pending.append(index)
+
+    if pending:
+        print(f" - Generating {len(pending)} answers with up to {max_concurrency} in parallel")
+        generation_started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending))), thread_name_prefix="batch-generation")
+
+        try:
+            futures = {
+                pool.submit(_generate_timed, queries[index], collection_name, retrievals[index],
+                            text_generation_model, query_cache): index
+                for index in pending
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                result, generation_ms = future.result()
+                entry = _batch_entry(index, queries[index], result, started)
+                entry["timings"]["generation_ms"] = generation_ms
+                yield {"event": "result", "data": entry}
+        finally:
+            # A client that disconnects mid-stream does not keep the remaining generations running
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        timings["generation_ms"] = round((time.perf_counter() - generation_started) * 1000, 2)
+
+    yield {"event": "done", "data": {"count": len(queries), "timings": _elapsed_timings(timings, started)}}
+
+
+
+# Collects iter_rag_results_batch into {"results": [...in query order], "count", "timings"}
+
+def get_rag_results_batch(queries: list, collection_name: str, chroma_client, embedding_model, text_generation_model,
+                          retriever=None, query_cache: QueryCache = None, relevance_threshold: float = None,
+                          max_concurrency: int = BATCH_CONCURRENCY, candidate_ids: list = None) -> dict:
+
+    results = [None] * len(queries)
+    summary = {}
+
+    for event in iter_rag_results_batch(queries, collection_name, chroma_client, embedding_model, text_generation_model,
+                                        retriever, query_cache, relevance_threshold, max_concurrency, candidate_ids):
+        if event["event"] == "result":
+            results[event["data"]["index"]] = event["data"]
+        else:
+            summary = event["data"]
+
+    return {"results": results, "count": len(queries), "timings": summary.get("timings", {})}
+
+
+
+def _generate_timed(query: str, collection_name: str, retrieval: dict, text_generation_model, query_cache: QueryCache):
+    started = time.perf_counter()
+    try:
+        result = _generate_answer(query, collection_name, retrieval, text_generation_model, query_cache)
+    except Exception as e:
+        print(f" - An error occured while answering '{query}': {e}")
+        result = _error_result()
+    return result, round((time.perf_counter() - started) * 1000, 2)
+
+
+
+def _batch_entry(index: int, query: str, result: dict, started: float) -> dict:
+    entry = {"index": index, "query": query}
+    entry.update(result)
+    entry["timings"] = {"total_ms": round((time.perf_counter() - started) * 1000, 2)}
+    return entry
+
+
+
+def _elapsed_timings(timings: dict, started: float) -> dict:
+    timings = dict(timings)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return timings
+
+
+
+# Prompt and generation for a retrieval that found relevant chunks. Stores the answer in the semantic cache.
+
+def _generate_answer(query: str, collection_name: str, retrieval: dict, text_generation_model,
+                     query_cache: QueryCache = None) -> dict:
+
+    with span("prompt_build"):
+        prompt = _build_prompt(query, retrieval)
+
+    with span("generation"):
+        answer_response = call_with_rate_limit(text_generation_model.generate_content, prompt)
+    retrieval["answer"] = answer_response.text
+
+    if query_cache is not None and _uses_answer_cache(retrieval):
+        query_cache.put_answer(collection_name, retrieval["embedding"], answer_response.text,
+                               retrieval["sources"], version=retrieval["cache_version"],
+                               scores=retrieval["scores"], chunk_ids=retrieval["chunk_ids"])
+
+    return _result_from_retrieval(retrieval)
+
+
+
+def _error_result() -> dict:
+    return {"answer": ERROR_ANSWER, "sources": [], "scores": [], "chunk_ids": [], "gated": False, "cached": False}
+
+
+
+# Same pipeline as get_rag_result, but yields events as soon as they are available:
+# one "sources" event after retrieval, a "token" event per generated text chunk, then "done".
+
+def stream_rag_answer(query: str, collection_name: str, chroma_client, embedding_model, text_generation_model,
+                      retriever=None, query_cache: QueryCache = None, relevance_threshold: float = None,
+                      candidate_ids: list = None, history: str = None, carry_ids: list = None):
+
+    print(f"\n Streaming answer from collection '{collection_name}' for: '{query}'")
+
+    try:
+        retrieval = _retrieve(query, collection_name, chroma_client, embedding_model, retriever,
+                              query_cache, relevance_threshold, candidate_ids, history, carry_ids)
+
+        prompt = None
+        if not (retrieval["cached"] or retrieval["gated"]):
+            print(f" - Found {len(retrieval['docs'])} relevant context snippets.")
+            with span("prompt_build"):
+                prompt = _build_prompt(query, retrieval)
+
+        result = _result_from_retrieval(retrieval)
+        answer = result.pop("answer")
+        yield {"event": "sources", "data": result}
+
+        if prompt is None:
+            yield {"event": "token", "data": {"text": answer}}
+            yield {"event": "done", "data": {}}
+            return
+
+        print(" - Streaming final answer from Gemini")
+
+        # Only the time spent waiting on Gemini counts as generation, not the time the client takes to read the tokens
+        response_stream = timed_iter(_generate_stream(text_generation_model, prompt), "generation")
+
+        answer_parts = []
+        for chunk in response_stream:
+            text = getattr(chunk, "text", "")
+            if text:
+                answer_parts.append(text)
+                yield {"event": "token", "data": {"text": text}}
+
+        if query_cache is not None and answer_parts and _uses_answer_cache(retrieval):
+            query_cache.put_answer(collection_name, retrieval["embedding"], "".join(answer_parts),
+                                   retrieval["sources"], version=retrieval["cache_version"],
+                                   scores=retrieval["scores"], chunk_ids=retrieval["chunk_ids"])
+
+        yield {"event": "done", "data": {}}
+
+    except Exception as e:
+        print(f" - An error occured during the streaming RAG process: {e}")
+        yield {"event": "error", "data": {"error": ERROR_ANSWER}}
+
+
+
+def _generate_stream(text_generation_model, prompt: str):
+    response_stream = call_with_rate_limit(text_generation_model.generate_content, prompt, stream=True)
+    yield from response_stream
+
+
+
+# Everything that happens before generation: query embedding, semantic cache lookup,
+# scored vector search and relevance gating. Returns a dict describing the outcome.
+
+def _retrieve(query: str, collection_name: str, chroma_client, embedding_model, retriever,
+              query_cache: QueryCache, relevance_threshold: float, candidate_ids: list = None,
+              history: str = None, carry_ids: list = None) -> dict:
+
+    retrieval = _new_retrieval()
+    retrieval["scoped"] = candidate_ids is not None
+    retrieval["history"] = history
 
-        vector_store = Chroma(
-            client=chroma_client,
-            collection_name=collection_name,
-            embedding_function=embedding_model
-        )
+    query_embedding = _embed_query(query, embedding_model, query_cache)
+    retrieval["embedding"] = query_embedding
 
-        retriever = vector_store.as_retriever(search_kwargs={"k":5})
+    if _uses_answer_cache(retrieval) and _lookup_cached_answer(retrieval, collection_name, query_cache):
+        return retrieval
 
-        relevant_docs = retriever.get_relevant_documents(query)
+    with span("retrieval"):
+        scored_docs, vectors = _retrieve_scored_docs(query_embedding, collection_name, chroma_client, embedding_model,
+                                                     retriever, candidate_ids, carry_ids)
 
-        if not relevant_docs:
-            return "I could not any relevant information in the knowledge base to answer your question."
-        
-        print(f" - Found {len(relevant_docs)} relevant context snippets.")
+    _apply_relevance_gate(retrieval, scored_docs, retriever, relevance_threshold, vectors)
+    return retrieval
 
 
-        context_str = ""
-        sources = set()
 
-        for i, doc in enumerate(relevant_docs):
-            context_str += f" --- Context Snippet {i+1} ---\n"
-            context_str += f"Source: {doc.metadata.get('source')}\n"
-            context_str += f"Content: {doc.page_content}\n\n"
+# _retrieve for a list of queries with one embedding call and one vector search for all of them.
+# Returns the retrieval dicts in query order and the time spent on the shared stages.
 
-        prompt = f"""
+def _retrieve_batch(queries: list, collection_name: str, chroma_client, embedding_model, retriever,
+                    query_cache: QueryCache, relevance_threshold: float, candidate_ids: list = None):
+
+    retrievals = [_new_retrieval() for _ in queries]
+    for retrieval in retrievals:
+        retrieval["scoped"] = candidate_ids is not None
+    timings = {}
+
+    started = time.perf_counter()
+    query_embeddings = _embed_queries(queries, embedding_model, query_cache)
+    timings["embedding_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    to_search = []
+    for index, (retrieval, query_embedding) in enumerate(zip(retrievals, query_embeddings)):
+        retrieval["embedding"] = query_embedding
+        if retrieval["scoped"] or not _lookup_cached_answer(retrieval, collection_name, query_cache):
+            to_search.append(index)
+
+    if to_search:
+        started = time.perf_counter()
+        with span("retrieval"):
+            scored_batch = _retrieve_scored_docs_batch([query_embeddings[index] for index in to_search], collection_name,
+                                                       chroma_client, embedding_model, retriever, candidate_ids)
+        timings["retrieval_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+        for index, (scored_docs, vectors) in zip(to_search, scored_batch):
+            _apply_relevance_gate(retrievals[index], scored_docs, retriever, relevance_threshold, vectors)
+
+    return retrievals, timings
+
+
+
+def _new_retrieval() -> dict:
+    return {
+        "embedding": None, "docs": [], "scored_docs": [], "sources": [], "scores": [], "chunk_ids": [],
+        "answer": None, "cached": False, "gated": False, "cache_version": None, "context": None, "scoped": False,
+        "history": None,
+    }
+
+
+
+# Cached answers were generated from the whole collection without conversation history, so scoped queries
+# and conversation turns neither read nor write the semantic answer cache
+
+def _uses_answer_cache(retrieval: dict) -> bool:
+    return not retrieval["scoped"] and retrieval["history"] is None
+
+
+
+# Tier 2 of the query cache. Fills `retrieval` and returns True when a stored answer is close enough.
+
+def _lookup_cached_answer(retrieval: dict, collection_name: str, query_cache: QueryCache) -> bool:
+    if query_cache is None:
+        return False
+
+    retrieval["cache_version"] = query_cache.version(collection_name)
+    cached = query_cache.get_answer(collection_name, retrieval["embedding"])
+    if not cached:
+        return False
+
+    print(f" - Answer served from the semantic cache (similarity {cached['similarity']:.3f}).")
+    get_metrics().inc("glimpse_retrievals_total", outcome="cached")
+    retrieval.update(answer=cached["answer"], sources=cached["sources"],
+                     scores=cached["scores"], chunk_ids=cached["chunk_ids"], cached=True)
+    return True
+
+
+
+# Keeps the relevant chunks of a search, or marks the retrieval as gated when none passes the threshold.
+# `vectors` are the stored embeddings of `scored_docs`, row by row, used for MMR.
+
+def _apply_relevance_gate(retrieval: dict, scored_docs: list, retriever, relevance_threshold: float, vectors=None):
+    threshold = RELEVANCE_THRESHOLD if relevance_threshold is None else relevance_threshold
+    k = retriever.search_kwargs.get("k", DEFAULT_K) if retriever is not None else DEFAULT_K
+
+    selected = _select_relevant(scored_docs, threshold, k, vectors)
+    retrieval["scores"] = [_score_entry(doc, score) for doc, score in (selected or scored_docs[:k])]
+
+    if not selected:
+        best = max((score for _, score in scored_docs), default=None)
+        print(f" - No chunk passed the relevance threshold {threshold} (best score: {best}). Skipping generation.")
+        retrieval.update(answer=NO_CONTEXT_ANSWER, gated=True)
+        get_metrics().inc("glimpse_retrievals_total", outcome="gated")
+        return
+
+    retrieval["scored_docs"] = selected
+    retrieval["docs"] = [doc for doc, _ in selected]
+    retrieval["sources"] = _list_sources(retrieval["docs"])
+    retrieval["chunk_ids"] = [doc.id for doc in retrieval["docs"] if doc.id]
+    get_metrics().inc("glimpse_retrievals_total", outcome="retrieved")
+
+
+
+def _result_from_retrieval(retrieval: dict) -> dict:
+    result = {
+        "answer": retrieval["answer"],
+        "sources": retrieval["sources"],
+        "scores": retrieval["scores"],
+        "chunk_ids": retrieval["chunk_ids"],
+        "gated": retrieval["gated"],
+        "cached": retrieval["cached"],
+    }
+    # Token accounting of the packed context, only for answers that were generated
+    if retrieval["context"] is not None:
+        result["context"] = retrieval["context"]
+    return result
+
+
+
+def _score_entry(doc, score: float) -> dict:
+    entry = {"source": doc.metadata.get('source'), "score": round(score, 4)}
+    if doc.metadata.get('page') is not None:
+        entry["page"] = doc.metadata.get('page')
+    return entry
+
+
+
+# Adaptive k: keep the chunks that pass the absolute threshold and are not much worse than the best hit,
+# at most `k` of them. With more of them than `k`, MMR picks a diverse subset (in pick order).
+
+def _select_relevant(scored_docs: list, threshold: float, k: int, vectors=None) -> list:
+    passing = [index for index, (_, score) in enumerate(scored_docs) if score >= threshold]
+    if not passing:
+        return []
+
+    best = max(scored_docs[index][1] for index in passing)
+    close = [index for index in passing if scored_docs[index][1] >= best - RELEVANCE_MARGIN]
+
+    if MMR_ENABLED and vectors is not None and len(close) > k:
+        with span("rerank"):
+            relevance = np.array([scored_docs[index][1] for index in close], dtype=np.float32)
+            picks = mmr_select(vectors[close], relevance, k, MMR_LAMBDA)
+        return [scored_docs[close[pick]] for pick in picks]
+
+    close.sort(key=lambda index: scored_docs[index][1], reverse=True)
+    return [scored_docs[index] for index in close[:k]]
+
+
+
+# Maximal marginal relevance. `vectors` is an (n, d) array of candidate embeddings and `relevance` their
+# scores for the query. Greedily picks `k` rows maximizing
+#     lambda_mult * relevance - (1 - lambda_mult) * (max cosine similarity to the rows already picked)
+# and returns their indexes in pick order. Each step costs one (n, d) matrix-vector product.
+
+def mmr_select(vectors, relevance, k: int, lambda_mult: float = MMR_LAMBDA) -> list:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    count = len(relevance)
+    if count == 0 or k <= 0:
+        return []
+
+    # Cosine similarity without normalizing the whole matrix: divide each product by the norms instead
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    norms[norms == 0] = 1.0
+
+    weighted_relevance = lambda_mult * relevance
+    # Highest similarity of every candidate to anything picked so far
+    redundancy = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+
+    picks = [int(np.argmax(relevance))]
+    available[picks[0]] = False
+
+    while len(picks) < min(k, count):
+        last = picks[-1]
+        np.maximum(redundancy, (vectors @ vectors[last]) / (norms * norms[last]), out=redundancy)
+        scores = weighted_relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        picks.append(pick)
+        available[pick] = False
+
+    return picks
+
+
+
+# Tier 1 of the query cache: reuse the embedding of a query we have already seen
+
+def _embed_query(query: str, embedding_model, query_cache: QueryCache = None) -> list:
+    if query_cache is not None:
+        embedding = query_cache.get_embedding(query)
+        if embedding is not None:
+            return embedding
+
+    with span("query_embedding"):
+        embedding = embedding_model.embed_query(query)
+
+    if query_cache is not None:
+        query_cache.put_embedding(query, embedding)
+    return embedding
+
+
+
+# Tier 1 lookups for a list of queries; the misses are embedded together in one batched call
+
+def _embed_queries(queries: list, embedding_model, query_cache: QueryCache = None) -> list:
+    embeddings = [None] * len(queries)
+    missing = {}
+
+    for index, query in enumerate(queries):
+        embedding = query_cache.get_embedding(query) if query_cache is not None else None
+        if embedding is not None:
+            embeddings[index] = embedding
+        else:
+            missing.setdefault(query, []).append(index)
+
+    if missing:
+        with span("query_embedding"):
+            vectors = embed_queries(embedding_model, list(missing))
+
+        for (query, indexes), embedding in zip(missing.items(), vectors):
+            if query_cache is not None:
+                query_cache.put_embedding(query, embedding)
+            for index in indexes:
+                embeddings[index] = embedding
+
+    return embeddings
+
+
+
+# Over-fetches candidates with their distances and stored embeddings, and turns the distances into
+# relevance scores in [0, 1]. Returns (scored docs, embedding matrix).
+# `carry_ids` are chunks to score against the query as well, even if the search did not return them.
+
+def _retrieve_scored_docs(query_embedding: list, collection_name: str, chroma_client, embedding_model, retriever=None,
+                          candidate_ids: list = None, carry_ids: list = None):
+    if retriever is None:
+        retriever = _default_retriever(collection_name, chroma_client, embedding_model)
+
+    scored_docs, vectors = _retrieve_scored_docs_batch([query_embedding], collection_name, chroma_client, embedding_model,
+                                                       retriever, candidate_ids)[0]
+    if carry_ids:
+        if candidate_ids is not None:
+            allowed = set(candidate_ids)
+            carry_ids = [chunk_id for chunk_id in carry_ids if chunk_id in allowed]
+        scored_docs, vectors = _add_carried_chunks(scored_docs, vectors, carry_ids, query_embedding,
+                                                   retriever.vectorstore._collection)
+    return scored_docs, vectors
+
+
+
+# Fetches the carried chunks the search did not return and scores them by cosine similarity to the query,
+# the same scale _distance_to_relevance gives for unit-length embeddings
+
+def _add_carried_chunks(scored_docs: list, vectors, carry_ids: list, query_embedding: list, collection):
+    returned = {doc.id for doc, _ in scored_docs}
+    missing = [chunk_id for chunk_id in dict.fromkeys(carry_ids) if chunk_id not in returned]
+    if not missing:
+        return scored_docs, vectors
+
+    found = collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+    if not len(found["ids"]):
+        return scored_docs, vectors
+
+    carried = np.asarray(found["embeddings"], dtype=np.float32)
+    query = _unit_vector(query_embedding)
+    norms = np.linalg.norm(carried, axis=1)
+    norms[norms == 0] = 1.0
+    similarities = np.clip((carried @ query) / norms, 0.0, 1.0)
+
+    scored_docs = list(scored_docs) + [
+        (Document(id=chunk_id, page_content=text, metadata=metadata or {}), float(similarity))
+        for chunk_id, text, metadata, similarity in zip(found["ids"], found["documents"], found["metadatas"], similarities)
+    ]
+    if MMR_ENABLED:
+        vectors = carried if vectors is None or not len(vectors) else np.vstack([vectors, carried])
+
+    print(f" - Carried {len(found['ids'])} chunk(s) over from the previous turn.")
+    return scored_docs, vectors
+
+
+
+# Same for several query vectors with one Chroma query call. Returns one (scored docs, embeddings) pair per vector.
+# With `candidate_ids` only those chunks are searched; an empty list matches nothing.
+
+def _retrieve_scored_docs_batch(query_embeddings: list, collection_name: str, chroma_client, embedding_model, retriever=None,
+                                candidate_ids: list = None) -> list:
+
+    if candidate_ids is not None and not candidate_ids:
+        return [([], None) for _ in query_embeddings]
+
+    if retriever is None:
+        retriever = _default_retriever(collection_name, chroma_client, embedding_model)
+
+    collection = retriever.vectorstore._collection
+    fetch_k = max(retriever.search_kwargs.get("k", DEFAULT_K), CANDIDATE_K)
+
+    # The queries are embedded up front, so search the collection by vector instead of going through the retriever
+    include = ["documents", "metadatas", "distances"] + (["embeddings"] if MMR_ENABLED else [])
+    if candidate_ids is not None:
+        results = collection.query(query_embeddings=query_embeddings, n_results=min(fetch_k, len(candidate_ids)),
+                                   ids=candidate_ids, include=include)
+    else:
+        results = collection.query(query_embeddings=query_embeddings, n_results=fetch_k, include=include)
+
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    embeddings = results.get("embeddings") if MMR_ENABLED else None
+    batch = []
+
+    for position, (ids, texts, metadatas, distances) in enumerate(
+            zip(results["ids"], results["documents"], results["metadatas"], results["distances"])):
+        scored_docs = [
+            (Document(id=chunk_id, page_content=text, metadata=metadata or {}), _distance_to_relevance(distance, space))
+            for chunk_id, text, metadata, distance in zip(ids, texts, metadatas, distances)
+        ]
+        vectors = None
+        if embeddings is not None and len(scored_docs):
+            vectors = np.asarray(embeddings[position], dtype=np.float32)
+        batch.append((scored_docs, vectors))
+
+    return batch
+
+
+
+def _default_retriever(collection_name: str, chroma_client, embedding_model):
+    from langchain_community.vectorstores import Chroma
+    vector_store = Chroma(
+        client=chroma_client,
+        collection_name=collection_name,
+        embedding_function=embedding_model
+    )
+    return vector_store.as_retriever(search_kwargs={"k": DEFAULT_K})
+
+
+
+# Chroma returns distances; for unit-length embeddings they map onto cosine similarity
+
+def _distance_to_relevance(distance: float, space: str) -> float:
+    if space in ("cosine", "ip"):
+        # Both are reported as 1 - similarity
+        similarity = 1.0 - distance
+    else:
+        # "l2" is the squared euclidean distance: ||a - b||^2 = 2 - 2 cos(a, b)
+        similarity = 1.0 - distance / 2.0
+    return max(0.0, min(1.0, similarity))
+
+
+
+# Unique source file names, in the order they were retrieved
+
+def _list_sources(relevant_docs: list) -> list:
+    return list(dict.fromkeys(doc.metadata.get('source') for doc in relevant_docs if doc.metadata.get('source')))
+
+
+
+# The relevant chunks are packed under the token budget (see rag_core.context); the report is kept on the retrieval.
+# Conversation turns add the bounded history block ahead of the context.
+
+def _build_prompt(query: str, retrieval: dict) -> str:
+
+    packed = pack_context(retrieval["scored_docs"])
+    retrieval["context"] = packed["report"]
+
+    metrics = get_metrics()
+    metrics.inc("glimpse_context_tokens_total", packed["report"]["tokens_packed"], kind="packed")
+    metrics.inc("glimpse_context_tokens_total", packed["report"]["tokens_saved"], kind="saved")
+
+    context_str = packed["context"]
+
+    if retrieval["history"]:
+        return f"""
         You are Glimpse, an intelligent assistant. Your task is to answer the user's question based *only* on the context provided below.
 
         - Do not make up any information or use outside knowledge.
+        - Use the conversation so far only to understand what the question refers to, not as a source of facts.
         - If the context is not sufficient to answer the question, simply state that you cannot answer based on the provided documents.
         - After your answer, list the source files you used, like this: "Sources: [file1.pdf, file2.jpg]".
-        
+
+        CONVERSATION SO FAR:
+        {retrieval["history"]}
+
         CONTEXT:
         {context_str}
 
@@ -53,12 +847,18 @@ def get_rag_answer(query: str, collection_name: str, chroma_client, embedding_mo
         ANSWER:
         """
 
-        print(" - Synthesis final answer with Gemini")
+    return f"""
+        You are Glimpse, an intelligent assistant. Your task is to answer the user's question based *only* on the context provided below.
 
-        answer_response = text_generation_model.generate_content(prompt)
+        - Do not make up any information or use outside knowledge.
+        - If the context is not sufficient to answer the question, simply state that you cannot answer based on the provided documents.
+        - After your answer, list the source files you used, like this: "Sources: [file1.pdf, file2.jpg]".
 
-        return answer_response.text
-    
-    except Exception as e:
-        print(f" - An error occured during the RAG process: {e}")
-        return "Sorry, an error occured while trying to answer your question."
\ No newline at end of file
+        CONTEXT:
+        {context_str}
+
+        QUESTION:
+        {query}
+
+        ANSWER:
+        """
@@ -0,0 +1,56 @@
+import os
+
+
+"""
+Vector store backends. The rest of the backend talks to the store through the part of Chroma's client API
+it already used, so either backend plugs in wherever a chroma client was passed before:
+
+  client:     get_or_create_collection(name, embedding_function=None, metadata=None), get_collection(name),
+              create_collection(name), delete_collection(name), list_collections(), heartbeat()
+  collection: add / upsert / update(ids, embeddings, metadatas, documents),
+              delete(ids=None, where=None, where_document=None),
+              get(ids=None, where=None, where_document=None, limit=None, offset=None, include=[...]),
+              query(query_embeddings, n_results, where=None, where_document=None, ids=None, include=[...]),
+              count(), name, metadata
+
+"chroma" is chromadb's persistent client (HNSW index, float32); "numpy" is rag_core.numpy_store
+(quantized, memory-mapped segments with an exact scan).
+"""
+
+
+VECTOR_STORE_BACKENDS = ("chroma", "numpy")
+
+DEFAULT_PATHS = {
+    "chroma": "./chroma_db_mvp",
+    "numpy": "./vector_store",
+}
+
+
+# Options are passed on to NumpyVectorClient (dtype, coarse_index, nprobe, ...) and ignored for Chroma
+
+def make_vector_client(backend: str = "chroma", path: str = None, **options):
+    if backend == "chroma":
+        import chromadb
+        return chromadb.PersistentClient(path=path or DEFAULT_PATHS["chroma"])
+
+    if backend == "numpy":
+        from .numpy_store import NumpyVectorClient
+        return NumpyVectorClient(path=path or DEFAULT_PATHS["numpy"], **options)
+
+    raise ValueError(f"Unknown vector store backend '{backend}'. Expected one of {', '.join(VECTOR_STORE_BACKENDS)}.")
+
+
+
+# Backend settings from the environment: VECTOR_STORE_BACKEND, VECTOR_STORE_PATH, VECTOR_STORE_DTYPE,
+# VECTOR_STORE_COARSE_INDEX and VECTOR_STORE_NPROBE (VECTOR_STORE_DECODE_CACHE_MB is read by numpy_store)
+
+def vector_client_from_env():
+    backend = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+    options = {}
+    if backend == "numpy":
+        options = {
+            "dtype": os.getenv("VECTOR_STORE_DTYPE", "int8"),
+            "coarse_index": os.getenv("VECTOR_STORE_COARSE_INDEX", "0") == "1",
+            "nprobe": int(os.getenv("VECTOR_STORE_NPROBE", "16")),
+        }
+    return make_vector_client(backend, os.getenv("VECTOR_STORE_PATH"), **options)
@@ -0,0 +1,83 @@
+import time
+import types
+
+import pytest
+
+from rag_core import engine as engine_module
+from rag_core.engine import RetrievalEngine
+from rag_core.numpy_store import NumpyVectorClient
+
+pytest.importorskip("langchain_community")
+
+
+"""
+Collection handles of the retrieval engine: at most `max_open_collections` stay open, the least recently
+used going first, and handles idle longer than `idle_timeout` are dropped on the next access.
+"""
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    fake_time = types.SimpleNamespace(monotonic=clock, time=time.time, perf_counter=time.perf_counter)
+    monkeypatch.setattr(engine_module, "time", fake_time)
+    return clock
+
+
+def make_engine(tmp_path, **options) -> RetrievalEngine:
+    client = NumpyVectorClient(path=str(tmp_path), dtype="float32", background_merge=False)
+    return RetrievalEngine(client, embedding_model=None, **options)
+
+
+def test_least_recently_used_handle_is_closed_past_the_bound(tmp_path, clock):
+    engine = make_engine(tmp_path, max_open_collections=2)
+
+    engine.get_vector_store("user-a")
+    engine.get_vector_store("user-b")
+    engine.get_vector_store("user-a")
+    engine.get_vector_store("user-c")
+
+    assert list(engine._handles) == ["user-a", "user-c"]
+    assert engine.evictions == 1
+
+
+def test_idle_handles_are_swept_on_access_to_an_open_collection(tmp_path, clock):
+    engine = make_engine(tmp_path, max_open_collections=8, idle_timeout=60.0)
+
+    engine.get_vector_store("user-a")
+    engine.get_vector_store("user-b")
+    clock.now += 30.0
+    engine.get_vector_store("user-b")
+    clock.now += 45.0
+
+    # user-b is already open; the access still closes user-a, idle for 75 seconds
+    engine.get_vector_store("user-b")
+
+    assert list(engine._handles) == ["user-b"]
+    assert engine.evictions == 1
+
+
+def test_sweep_closes_idle_handles_without_an_access(tmp_path, clock):
+    engine = make_engine(tmp_path, idle_timeout=60.0)
+
+    engine.get_vector_store("user-a")
+    clock.now += 30.0
+    engine.get_vector_store("user-b")
+    clock.now += 40.0
+
+    assert engine.sweep_idle_handles() == 1
+    assert list(engine._handles) == ["user-b"]
+
+    clock.now += 61.0
+    assert engine.sweep_idle_handles() == 1
+    assert not engine._handles
+
@@ -0,0 +1,214 @@
+import threading
+
+import numpy as np
+import pytest
+
+from rag_core.numpy_store import NumpyVectorClient
+
+chromadb = pytest.importorskip("chromadb")
+
+
+"""
+rag_core.numpy_store checked against chromadb: the same writes go to a Chroma collection and a numpy
+collection, and every read must give the same ids, documents and metadatas. Distances are compared with a
+tolerance, because the numpy store keeps the embeddings quantized.
+"""
+
+
+DIMENSIONS = 32
+SPACE = {"hnsw:space": "cosine"}
+
+
+def random_vectors(count: int, seed: int) -> list:
+    return np.random.default_rng(seed).standard_normal((count, DIMENSIONS)).astype(np.float32).tolist()
+
+
+def make_chunks(count: int, seed: int = 0, prefix: str = "chunk") -> dict:
+    return {
+        "ids": [f"{prefix}-{index}" for index in range(count)],
+        "embeddings": random_vectors(count, seed),
+        "documents": [f"Text {index} of {'report' if index % 3 else 'invoice'} {prefix}" for index in range(count)],
+        "metadatas": [
+            {"source": f"file{index % 4}.pdf", "page": index % 5, "type": "pdf" if index % 2 else "png"}
+            for index in range(count)
+        ],
+    }
+
+
+@pytest.fixture(params=["float32", "int8"])
+def stores(request, tmp_path):
+    chroma = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    numpy_client = NumpyVectorClient(path=str(tmp_path / "numpy"), dtype=request.param, background_merge=False)
+    yield chroma.get_or_create_collection("parity", metadata=SPACE), numpy_client.get_or_create_collection("parity", metadata=SPACE)
+    numpy_client.close()
+
+
+def by_id(result: dict) -> dict:
+    return {
+        chunk_id: (result["documents"][index], result["metadatas"][index])
+        for index, chunk_id in enumerate(result["ids"])
+    }
+
+
+def assert_same_records(chroma_collection, numpy_collection, **kwargs):
+    expected = chroma_collection.get(include=["documents", "metadatas"], **kwargs)
+    actual = numpy_collection.get(include=["documents", "metadatas"], **kwargs)
+    assert by_id(actual) == by_id(expected)
+
+
+def assert_same_neighbours(chroma_collection, numpy_collection, queries, n_results=5, **kwargs):
+    expected = chroma_collection.query(query_embeddings=queries, n_results=n_results, **kwargs)
+    actual = numpy_collection.query(query_embeddings=queries, n_results=n_results, **kwargs)
+    for position in range(len(queries)):
+        assert actual["ids"][position] == expected["ids"][position]
+        assert actual["distances"][position] == pytest.approx(expected["distances"][position], abs=0.02)
+        assert actual["documents"][position] == expected["documents"][position]
+        assert actual["metadatas"][position] == expected["metadatas"][position]
+
+
+def test_add_upsert_update_delete(stores):
+    chroma_collection, numpy_collection = stores
+    chunks = make_chunks(40)
+    revised = make_chunks(10, seed=1)
+    revised["ids"] = [f"chunk-{index}" for index in range(35, 45)]
+
+    for collection in stores:
+        collection.add(**chunks)
+        collection.upsert(**revised)
+        collection.update(ids=["chunk-1", "chunk-2"], metadatas=[{"page": 99}, {"source": "renamed.pdf"}])
+        # Chroma would embed a document sent without its embedding
+        collection.update(ids=["chunk-3"], documents=["Rewritten text"], embeddings=random_vectors(1, seed=2))
+        collection.delete(ids=["chunk-4", "chunk-5"])
+        collection.delete(where={"source": "file0.pdf"})
+
+    assert numpy_collection.count() == chroma_collection.count()
+    assert_same_records(chroma_collection, numpy_collection)
+    assert_same_neighbours(chroma_collection, numpy_collection, random_vectors(4, seed=7))
+
+
+def test_update_without_embeddings_keeps_vectors(tmp_path):
+    client = NumpyVectorClient(path=str(tmp_path), dtype="float32", background_merge=False)
+    collection = client.get_or_create_collection("updates", metadata=SPACE)
+    chunks = make_chunks(5)
+    collection.add(**chunks)
+
+    collection.update(ids=["chunk-1", "missing"], documents=["Rewritten text", "Ignored"], metadatas=[{"page": None}, {}])
+    record = collection.get(ids=["chunk-1", "missing"], include=["documents", "metadatas", "embeddings"])
+    assert record["ids"] == ["chunk-1"]
+    assert record["documents"] == ["Rewritten text"]
+    assert record["metadatas"] == [{"source": "file1.pdf", "type": "pdf"}]
+    assert np.allclose(record["embeddings"][0], chunks["embeddings"][1], atol=1e-5)
+    assert collection.stats()["segments"] == 1
+    client.close()
+
+
+def test_add_keeps_existing_ids(stores):
+    chroma_collection, numpy_collection = stores
+    chunks = make_chunks(5)
+    duplicate = make_chunks(5, seed=3, prefix="chunk")
+    duplicate["documents"] = ["Should not replace"] * 5
+
+    for collection in stores:
+        collection.add(**chunks)
+        collection.add(**duplicate)
+
+    assert_same_records(chroma_collection, numpy_collection)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"where": {"source": "file1.pdf"}},
+    {"where": {"page": {"$gte": 3}}},
+    {"where": {"$and": [{"type": "pdf"}, {"page": {"$in": [1, 3]}}]}},
+    {"where": {"$or": [{"source": "file2.pdf"}, {"page": {"$ne": 0}}]}},
+    {"where": {"source": {"$nin": ["file1.pdf", "file2.pdf"]}}},
+    {"ids": ["chunk-3", "chunk-7", "chunk-12", "chunk-30"]},
+    {"ids": ["chunk-3", "chunk-7", "chunk-8"], "where": {"type": "pdf"}},
+    {"where_document": {"$contains": "invoice"}},
+    {"where_document": {"$not_contains": "invoice"}, "where": {"page": 1}},
+])
+def test_get_and_query_filters(stores, kwargs):
+    chroma_collection, numpy_collection = stores
+    for collection in stores:
+        collection.add(**make_chunks(60))
+
+    assert_same_records(chroma_collection, numpy_collection, **kwargs)
+    assert_same_neighbours(chroma_collection, numpy_collection, random_vectors(3, seed=11), n_results=4, **kwargs)
+
+
+def test_get_skips_unknown_ids(stores):
+    chroma_collection, numpy_collection = stores
+    for collection in stores:
+        collection.add(**make_chunks(10))
+
+    assert_same_records(chroma_collection, numpy_collection, ids=["chunk-3", "missing", "chunk-1"])
+
+
+def test_get_pages_in_insertion_order(stores):
+    chroma_collection, numpy_collection = stores
+    for collection in stores:
+        collection.add(**make_chunks(25))
+
+    pages = [numpy_collection.get(limit=10, offset=offset, include=[])["ids"] for offset in (0, 10, 20)]
+    assert [chunk_id for page in pages for chunk_id in page] == chroma_collection.get(include=[])["ids"]
+
+
+def test_persistence_across_reopen(tmp_path):
+    chunks = make_chunks(30)
+    client = NumpyVectorClient(path=str(tmp_path), dtype="int8", background_merge=False)
+    collection = client.get_or_create_collection("persisted", metadata=SPACE)
+    collection.add(**chunks)
+    collection.delete(ids=["chunk-0"])
+    collection.update(ids=["chunk-1"], metadatas=[{"page": 42}])
+    queries = random_vectors(3, seed=5)
+    before = collection.query(query_embeddings=queries, n_results=5)
+    records = collection.get()
+    client.close()
+
+    reopened = NumpyVectorClient(path=str(tmp_path), dtype="int8", background_merge=False)
+    collection = reopened.get_collection("persisted")
+    assert collection.metadata == SPACE
+    assert collection.count() == 29
+    assert by_id(collection.get()) == by_id(records)
+    after = collection.query(query_embeddings=queries, n_results=5)
+    assert after["ids"] == before["ids"]
+    for position in range(len(queries)):
+        assert after["distances"][position] == pytest.approx(before["distances"][position])
+    assert [collection.name for collection in reopened.list_collections()] == ["persisted"]
+    reopened.close()
+
+
+def test_merge_during_writes_matches_chroma(tmp_path):
+    chroma_collection = chromadb.PersistentClient(path=str(tmp_path / "chroma")).get_or_create_collection("merged", metadata=SPACE)
+    client = NumpyVectorClient(path=str(tmp_path / "numpy"), dtype="int8", max_segments=2, background_merge=True)
+    numpy_collection = client.get_or_create_collection("merged", metadata=SPACE)
+
+    batches = [make_chunks(20, seed=batch, prefix=f"batch{batch % 4}") for batch in range(12)]
+    for batch in batches:
+        chroma_collection.upsert(**batch)
+        chroma_collection.delete(ids=[batch["ids"][0]])
+
+    # Writers race the background merger and a forced merge on another thread
+    def write(part):
+        for batch in part:
+            numpy_collection.upsert(**batch)
+            numpy_collection.delete(ids=[batch["ids"][0]])
+
+    merger = threading.Thread(target=lambda: [numpy_collection.merge(force=True) for _ in range(5)])
+    merger.start()
+    write(batches)
+    merger.join()
+    numpy_collection.merge(force=True)
+
+    assert numpy_collection.stats()["segments"] == 1
+    assert numpy_collection.stats()["dead_rows"] == 0
+    assert numpy_collection.count() == chroma_collection.count()
+    assert_same_records(chroma_collection, numpy_collection)
+    assert_same_neighbours(chroma_collection, numpy_collection, random_vectors(4, seed=9))
+    client.close()
+
+
+def test_unknown_document_operator_is_rejected(stores):
+    _, numpy_collection = stores
+    numpy_collection.add(**make_chunks(3))
+    with pytest.raises(ValueError):
+        numpy_collection.get(where_document={"$startswith": "Text"})
@@ -0,0 +1,266 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import bcrypt
+
+
+"""
+User lookups and password hashing for /login and /register.
+
+Users are read through a TTL cache keyed by email, so repeated logins skip the Firestore round trip.
+Unknown emails are cached for a shorter time, so a burst of failed logins does not turn into a
+burst of queries. Concurrent misses for the same email wait on a single backend lookup.
+
+bcrypt runs on a dedicated, bounded pool of threads. bcrypt releases the GIL, so hashes run in
+parallel up to the number of workers. Requests beyond the queue limit fail fast with AuthBusyError
+instead of piling up behind each other.
+
+The backend is the Firestore collection (USER_STORE_BACKEND=firestore, the default) or an in-memory
+stand-in (USER_STORE_BACKEND=memory) for running the auth path offline and for load tests.
+"""
+
+
+USER_STORE_BACKENDS = ("firestore", "memory")
+
+
+class AuthBusyError(Exception):
+    """Raised when the password hashing queue is full."""
+
+
+# Users in the Firestore collection, one document per user keyed by user_id
+
+class FirestoreUserBackend:
+
+    def __init__(self, collection):
+        self.collection = collection
+
+
+    def find_by_email(self, usermail: str):
+        documents = self.collection.where("usermail", "==", usermail).limit(1).stream()
+        document = next(documents, None)
+        return document.to_dict() if document is not None else None
+
+
+    def create(self, user: dict):
+        self.collection.document(user["user_id"]).set(user)
+
+
+
+# Users in a dict, for offline runs. `latency` seconds are added to every call to stand in for the
+# Firestore round trip.
+
+class InMemoryUserBackend:
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lookups = 0
+        self._users = {}
+        self._lock = threading.Lock()
+
+
+    def find_by_email(self, usermail: str):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.lookups += 1
+            user = self._users.get(usermail)
+            return dict(user) if user is not None else None
+
+
+    def create(self, user: dict):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self._users[user["usermail"]] = dict(user)
+
+
+
+class UserStore:
+
+    def __init__(self, backend, ttl: float = 300.0, negative_ttl: float = 30.0, max_entries: int = 10000,
+                 hash_workers: int = None, max_pending_hashes: int = None, bcrypt_rounds: int = 12):
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.bcrypt_rounds = bcrypt_rounds
+
+        self.hash_workers = hash_workers or os.cpu_count() or 2
+        self.max_pending_hashes = max_pending_hashes or self.hash_workers * 16
+        self._hash_pool = ThreadPoolExecutor(max_workers=self.hash_workers, thread_name_prefix="glimpse-bcrypt")
+        self._hash_slots = threading.BoundedSemaphore(self.max_pending_hashes)
+
+        # email -> (user dict or None, expires_at)
+        self._users = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.hashes = 0
+        self.rejected_hashes = 0
+
+
+    # Returns the user's record, or None for an unknown email
+
+    def lookup(self, usermail: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(usermail)
+            if entry is not None and entry[1] > now:
+                self._users.move_to_end(usermail)
+                if entry[0] is None:
+                    self.negative_hits += 1
+                    return None
+                self.hits += 1
+                return dict(entry[0])
+
+            loading = self._loading.get(usermail)
+            if loading is None:
+                loading = self._loading[usermail] = Future()
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+                self.coalesced += 1
+
+        if not owner:
+            user = loading.result()
+            return dict(user) if user is not None else None
+
+        try:
+            user = self.backend.find_by_email(usermail)
+        except Exception as e:
+            with self._lock:
+                self._loading.pop(usermail, None)
+            loading.set_exception(e)
+            raise
+
+        with self._lock:
+            self._loading.pop(usermail, None)
+            self._remember(usermail, user)
+        loading.set_result(user)
+        return dict(user) if user is not None else None
+
+
+    # Creates the user and returns its record, or None when the email is already registered
+
+    def register(self, name: str, usermail: str, password: str):
+        # A cached "unknown" may be stale if another process registered the email, so ask the backend
+        with self._lock:
+            entry = self._users.get(usermail)
+            if entry is not None and entry[0] is None:
+                del self._users[usermail]
+
+        if self.lookup(usermail) is not None:
+            return None
+
+        hashed_password = self._run_hash(
+            bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=self.bcrypt_rounds)
+        )
+        user = {
+            "user_id": str(uuid.uuid4()),
+            "name": name,
+            "usermail": usermail,
+            "password": hashed_password.decode('utf-8')
+        }
+        self.backend.create(user)
+
+        # Replaces the negative entry left by the lookup above
+        with self._lock:
+            self._remember(usermail, user)
+        return dict(user)
+
+
+    # Returns (user, password_ok); user is None for an unknown email
+
+    def authenticate(self, usermail: str, password: str):
+        user = self.lookup(usermail)
+        if user is None:
+            return None, False
+
+        stored_password = user.get("password", "").encode('utf-8')
+        if not stored_password:
+            return user, False
+        try:
+            valid = self._run_hash(bcrypt.checkpw, password.encode('utf-8'), stored_password)
+        except ValueError:
+            # Not a bcrypt hash
+            valid = False
+        return user, valid
+
+
+    # Drops the cached record, e.g. after the user document was changed elsewhere
+
+    def invalidate(self, usermail: str):
+        with self._lock:
+            self._users.pop(usermail, None)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._users),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hashes": self.hashes,
+                "rejected_hashes": self.rejected_hashes,
+            }
+
+
+    def close(self):
+        self._hash_pool.shutdown(wait=False)
+
+
+    # Callers hold self._lock
+
+    def _remember(self, usermail: str, user):
+        ttl = self.ttl if user is not None else self.negative_ttl
+        if ttl <= 0:
+            self._users.pop(usermail, None)
+            return
+        self._users[usermail] = (dict(user) if user is not None else None, time.monotonic() + ttl)
+        self._users.move_to_end(usermail)
+        while len(self._users) > self.max_entries:
+            self._users.popitem(last=False)
+
+
+    # Runs a bcrypt call on the hashing pool and waits for it; raises AuthBusyError when the queue is full
+
+    def _run_hash(self, func, *args):
+        if not self._hash_slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected_hashes += 1
+            raise AuthBusyError("Too many logins in progress, try again shortly.")
+
+        try:
+            future = self._hash_pool.submit(func, *args)
+        except Exception:
+            self._hash_slots.release()
+            raise
+        future.add_done_callback(lambda _: self._hash_slots.release())
+
+        with self._lock:
+            self.hashes += 1
+        return future.result()
+
+
+
+# Backend from USER_STORE_BACKEND; `collection` is the Firestore collection (or a LazyObject of it)
+
+def make_user_backend(backend: str = "firestore", collection=None):
+    if backend == "firestore":
+        return FirestoreUserBackend(collection)
+
+    if backend == "memory":
+        return InMemoryUserBackend(latency=float(os.getenv("USER_STORE_MEMORY_LATENCY_MS", "0")) / 1000)
+
+    raise ValueError(f"Unknown user store backend '{backend}'. Expected one of {', '.join(USER_STORE_BACKENDS)}.")
@@ -30,6 +30,11 @@ const styles = {
     color: 'black',
     alignSelf: 'flex-start',
   },
+  sources: {
+    fontSize: '12px',
+    color: '#666',
+    marginTop: '6px',
+  },
   inputArea: {
     display: 'flex',
   },
@@ -64,6 +69,9 @@ function ChatComponent({ chatHistory, query, onQueryChange, onSendQuery }) {
             }}
           >
             {msg.text}
+            {msg.sources && msg.sources.length > 0 && (
+              <div style={styles.sources}>📎 {msg.sources.join(', ')}</div>
+            )}
           </div>
         ))}
       </div>
@@ -138,6 +138,115 @@ const styles = {
   },
 };
 
+// Files at least this large go through the chunked upload endpoints, with their parts sent in parallel
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const PART_SIZE = 8 * 1024 * 1024;
+const PARALLEL_PARTS = 4;
+const PART_RETRIES = 3;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+// Hex SHA-256 of a part, sent so the backend can reject a part that was damaged on the way
+const sha256Hex = async (blob) => {
+  if (!window.crypto || !window.crypto.subtle) return null;
+  const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest)).map(byte => byte.toString(16).padStart(2, '0')).join('');
+};
+
+// The backend processes uploads in the background, so poll the job until it finishes
+const waitForJob = async (apiBaseUrl, jobId, onProgress) => {
+  let data = { status: 'queued' };
+  while (!data.status || !data.status.startsWith('completed')) {
+    await sleep(1500);
+    const statusResponse = await fetch(`${apiBaseUrl}/jobs/${jobId}`, { credentials: 'include' });
+    data = await statusResponse.json();
+    if (!statusResponse.ok) throw new Error(data.error || 'Could not fetch job status.');
+    if (onProgress) onProgress(data);
+  }
+  return data;
+};
+
+// Uploads one file in parts and returns its ingestion job. The fingerprint lets the backend hand back an
+// earlier upload of the same file that was interrupted, so only the missing parts are sent again.
+const uploadInParts = async (apiBaseUrl, file, onProgress) => {
+  const response = await fetch(`${apiBaseUrl}/uploads`, {
+    method: 'POST',
+    credentials: 'include',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      filename: file.name,
+      size: file.size,
+      part_size: PART_SIZE,
+      fingerprint: `${file.name}:${file.size}:${file.lastModified}`,
+    }),
+  });
+  const upload = await response.json();
+  if (!response.ok) throw new Error(upload.error || 'Could not start the upload.');
+
+  const received = new Set(upload.received_parts);
+  const pending = [];
+  for (let index = 0; index < upload.total_parts; index++) {
+    if (!received.has(index)) pending.push(index);
+  }
+
+  let sentBytes = upload.received_bytes;
+  onProgress(sentBytes, file.size);
+
+  const sendPart = async (index) => {
+    const start = index * upload.part_size;
+    const part = file.slice(start, Math.min(start + upload.part_size, file.size));
+    const headers = { 'Content-Type': 'application/octet-stream' };
+    const checksum = await sha256Hex(part);
+    if (checksum) headers['X-Part-SHA256'] = checksum;
+
+    for (let attempt = 1; attempt <= PART_RETRIES; attempt++) {
+      let partResponse;
+      try {
+        partResponse = await fetch(`${apiBaseUrl}/uploads/${upload.upload_id}/parts/${index}`, {
+          method: 'PUT',
+          credentials: 'include',
+          headers,
+          body: part,
+        });
+      } catch (error) {
+        // The connection dropped; send the part again
+        if (attempt === PART_RETRIES) throw error;
+        await sleep(1000 * attempt);
+        continue;
+      }
+
+      if (partResponse.ok) {
+        sentBytes += part.size;
+        onProgress(sentBytes, file.size);
+        return;
+      }
+
+      // Client errors other than a checksum mismatch do not go away on a retry
+      const data = await partResponse.json().catch(() => ({}));
+      if ((partResponse.status < 500 && partResponse.status !== 422) || attempt === PART_RETRIES) {
+        throw new Error(data.error || `Part ${index + 1} of '${file.name}' failed.`);
+      }
+      await sleep(1000 * attempt);
+    }
+  };
+
+  // PARALLEL_PARTS workers each take the next missing part until none are left
+  const workers = Array.from({ length: Math.min(PARALLEL_PARTS, pending.length) }, async () => {
+    while (pending.length > 0) {
+      await sendPart(pending.shift());
+    }
+  });
+  await Promise.all(workers);
+
+  const completeResponse = await fetch(`${apiBaseUrl}/uploads/${upload.upload_id}/complete`, {
+    method: 'POST',
+    credentials: 'include',
+  });
+  const job = await completeResponse.json();
+  if (!completeResponse.ok) throw new Error(job.error || 'Could not complete the upload.');
+  return job;
+};
+
 function UploadComponent({ onFilesUploaded }) {
   const [isModalOpen, setIsModalOpen] = useState(false);
   const [selectedFiles, setSelectedFiles] = useState([]);
@@ -165,98 +274,106 @@ function UploadComponent({ onFilesUploaded }) {
     setStatus({ message: `Uploading ${selectedFiles.length} file(s)...`, type: 'loading' });
 
     const API_BASE_URL = 'http://localhost:5000/api';
+    const largeFiles = selectedFiles.filter(file => file.size >= CHUNKED_UPLOAD_THRESHOLD);
+    const smallFiles = selectedFiles.filter(file => file.size < CHUNKED_UPLOAD_THRESHOLD);
+    const uploadResults = [];
     
     try {
+      // Large files: chunked uploads that resume after a dropped connection
+      for (const file of largeFiles) {
+        try {
+          const job = await uploadInParts(API_BASE_URL, file, (sent, total) => {
+            setStatus({
+              message: `Uploading ${file.name}: ${Math.round((100 * sent) / total)}%`,
+              type: 'loading'
+            });
+          });
+          const data = await waitForJob(API_BASE_URL, job.job_id, () => {
+            setStatus({ message: `Processing ${file.name}...`, type: 'loading' });
+          });
+          const result = data.results[0];
+          uploadResults.push({ name: file.name, success: result.status === 'success', error: result.error });
+        } catch (error) {
+          uploadResults.push({ name: file.name, success: false, error: error.message });
+        }
+      }
+
       // Option 1: Use batch upload endpoint for better performance (if multiple files)
-      if (selectedFiles.length > 1) {
+      if (smallFiles.length > 1) {
         const formData = new FormData();
-        selectedFiles.forEach(file => {
+        smallFiles.forEach(file => {
           formData.append('files', file);
         });
 
         const response = await fetch(`${API_BASE_URL}/upload-batch`, {
           method: 'POST',
+          credentials: 'include',
           body: formData,
         });
-        const data = await response.json();
-        
-        // Extract successful uploads
-        const successfulUploads = data.results
-          ? data.results.filter(r => r.status === 'success').map(r => r.filename)
-          : [];
-        
-        setUploadedFiles([...uploadedFiles, ...successfulUploads]);
-        setSelectedFiles([]);
-        
-        if (data.failed === 0) {
-          setStatus({ 
-            message: `✅ Successfully uploaded ${data.successful} file(s)!`, 
-            type: 'success' 
-          });
-        } else {
-          setStatus({ 
-            message: `⚠️ Uploaded ${data.successful} file(s), ${data.failed} failed.`, 
-            type: 'error' 
+        const queued = await response.json();
+        if (!response.ok) throw new Error(queued.error || 'Batch upload failed.');
+
+        const data = await waitForJob(API_BASE_URL, queued.job_id, (job) => {
+          setStatus({
+            message: `Processing ${job.processed}/${job.total} file(s)...`,
+            type: 'loading'
           });
-        }
+        });
 
-        // Notify parent component
-        if (onFilesUploaded) {
-          onFilesUploaded(successfulUploads);
-        }
+        (data.results || []).forEach(r => {
+          uploadResults.push({ name: r.filename, success: r.status === 'success', error: r.error });
+        });
         
-      } else {
+      } else if (smallFiles.length === 1) {
         // Option 2: Single file upload (original method)
-        const uploadResults = [];
-        
-        for (const file of selectedFiles) {
-          const formData = new FormData();
-          formData.append('file', file);
-
-          try {
-            const response = await fetch(`${API_BASE_URL}/upload`, {
-              method: 'POST',
-              body: formData,
-            });
-            const data = await response.json();
-            
-            if (response.ok) {
-              uploadResults.push({ name: file.name, success: true });
-            } else {
-              uploadResults.push({ name: file.name, success: false, error: data.error });
-            }
-          } catch (error) {
-            uploadResults.push({ name: file.name, success: false, error: error.message });
-          }
-        }
+        const file = smallFiles[0];
+        const formData = new FormData();
+        formData.append('file', file);
 
-        // Update uploaded files list
-        const successfulUploads = uploadResults.filter(r => r.success).map(r => r.name);
-        setUploadedFiles([...uploadedFiles, ...successfulUploads]);
-        
-        // Clear selected files
-        setSelectedFiles([]);
-        
-        // Set status message
-        const successCount = successfulUploads.length;
-        const failCount = uploadResults.length - successCount;
-        
-        if (failCount === 0) {
-          setStatus({ 
-            message: `✅ Successfully uploaded ${successCount} file(s)!`, 
-            type: 'success' 
-          });
-        } else {
-          setStatus({ 
-            message: `⚠️ Uploaded ${successCount} file(s), ${failCount} failed.`, 
-            type: 'error' 
+        try {
+          const response = await fetch(`${API_BASE_URL}/upload`, {
+            method: 'POST',
+            credentials: 'include',
+            body: formData,
           });
+          const data = await response.json();
+          
+          if (response.ok) {
+            uploadResults.push({ name: file.name, success: true });
+          } else {
+            uploadResults.push({ name: file.name, success: false, error: data.error });
+          }
+        } catch (error) {
+          uploadResults.push({ name: file.name, success: false, error: error.message });
         }
+      }
 
-        // Notify parent component
-        if (onFilesUploaded) {
-          onFilesUploaded(successfulUploads);
-        }
+      // Update uploaded files list
+      const successfulUploads = uploadResults.filter(r => r.success).map(r => r.name);
+      setUploadedFiles([...uploadedFiles, ...successfulUploads]);
+      
+      // Clear selected files
+      setSelectedFiles([]);
+      
+      // Set status message
+      const successCount = successfulUploads.length;
+      const failCount = uploadResults.length - successCount;
+      
+      if (failCount === 0) {
+        setStatus({ 
+          message: `✅ Successfully uploaded ${successCount} file(s)!`, 
+          type: 'success' 
+        });
+      } else {
+        setStatus({ 
+          message: `⚠️ Uploaded ${successCount} file(s), ${failCount} failed.`, 
+          type: 'error' 
+        });
+      }
+
+      // Notify parent component
+      if (onFilesUploaded) {
+        onFilesUploaded(successfulUploads);
       }
     } catch (error) {
       setStatus({ message: `❌ Error: ${error.message}`, type: 'error' });
@@ -57,12 +57,56 @@ function ChatPage() {
         try {
             const response = await fetch(`${API_BASE_URL}/query`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ query: currentQuery }),
+                credentials: 'include',
+                headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+                body: JSON.stringify({ query: currentQuery, stream: true }),
             });
-            const data = await response.json();
-            if (!response.ok) throw new Error(data.error || 'Query failed.');
-            setChatHistory([...newChatHistory, { sender: 'ai', text: data.answer }]);
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.error || 'Query failed.');
+            }
+
+            // Render the answer progressively as the backend streams it
+            let answer = '';
+            let sources = [];
+            const updateAnswer = () => {
+                setChatHistory([...newChatHistory, { sender: 'ai', text: answer, sources }]);
+            };
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // Server-Sent Events are separated by a blank line
+                const frames = buffer.split('\n\n');
+                buffer = frames.pop();
+
+                for (const frame of frames) {
+                    const eventLine = frame.split('\n').find(line => line.startsWith('event: '));
+                    const dataLine = frame.split('\n').find(line => line.startsWith('data: '));
+                    if (!eventLine || !dataLine) continue;
+
+                    const eventName = eventLine.slice('event: '.length);
+                    const payload = JSON.parse(dataLine.slice('data: '.length));
+
+                    if (eventName === 'sources') {
+                        sources = payload.sources;
+                        setStatus('✍️ Writing answer...');
+                    } else if (eventName === 'token') {
+                        answer += payload.text;
+                        updateAnswer();
+                    } else if (eventName === 'error') {
+                        throw new Error(payload.error);
+                    }
+                }
+            }
+
+            updateAnswer();
             setStatus('Ready for your next question.');
         } catch (error) {
             console.error('Query Error:', error);